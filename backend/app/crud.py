@@ -1,5 +1,5 @@
 from sqlalchemy.orm import Session, joinedload
-from sqlalchemy import func, and_, or_, desc, asc
+from sqlalchemy import func, and_, or_, desc, asc, cast, Integer, String
 from typing import List, Optional, Dict, Any
 from datetime import datetime, timedelta
 from . import models, schemas
@@ -137,12 +137,50 @@ def get_system_settings(db: Session, category: Optional[str] = None, is_public:
         query = query.filter(models.SystemSetting.is_public == is_public)
     return query.all()
 
+def get_system_setting(db: Session, setting_id: int) -> Optional[models.SystemSetting]:
+    return db.query(models.SystemSetting).filter(models.SystemSetting.id == setting_id).first()
+
 def get_system_setting_by_key(db: Session, key: str) -> Optional[models.SystemSetting]:
     return db.query(models.SystemSetting).filter(models.SystemSetting.key == key).first()
 
+# 版本计数行：存放在 system_settings 中，由原子 UPDATE 递增
+SETTINGS_VERSION_KEY = "system_settings_version"
+GLOSSARY_VERSION_KEY = "terminology_glossary_version"
+_COUNTERS = {
+    SETTINGS_VERSION_KEY: ("system", "系统设置版本（设置变更时自动递增）"),
+    GLOSSARY_VERSION_KEY: ("terminology", "术语表版本（术语/分类变更时自动递增）"),
+}
+
+def _get_counter(db: Session, key: str) -> int:
+    row = db.query(models.SystemSetting.value).filter(models.SystemSetting.key == key).first()
+    try:
+        return int(row[0]) if row and row[0] else 0
+    except (TypeError, ValueError):
+        return 0
+
+def _bump_counter(db: Session, key: str, commit: bool = False) -> None:
+    """原子递增版本计数行，与对应变更在同一事务内提交（commit=False 时由调用方提交）"""
+    updated = db.query(models.SystemSetting).filter(models.SystemSetting.key == key).update(
+        {models.SystemSetting.value: cast(cast(models.SystemSetting.value, Integer) + 1, String)},
+        synchronize_session=False,
+    )
+    if not updated:
+        category, description = _COUNTERS[key]
+        db.add(models.SystemSetting(category=category, key=key, value="1", value_type="int",
+                                    description=description, is_editable=False))
+    if commit:
+        db.commit()
+
+def get_settings_version(db: Session) -> int:
+    return _get_counter(db, SETTINGS_VERSION_KEY)
+
+def bump_settings_version(db: Session, commit: bool = False) -> None:
+    _bump_counter(db, SETTINGS_VERSION_KEY, commit=commit)
+
 def create_system_setting(db: Session, setting: schemas.SystemSettingCreate) -> models.SystemSetting:
     db_setting = models.SystemSetting(**setting.dict())
     db.add(db_setting)
+    bump_settings_version(db)
     db.commit()
     db.refresh(db_setting)
     return db_setting
@@ -155,6 +193,7 @@ def update_system_setting(db: Session, setting_id: int, setting_update: schemas.
     for field, value in update_data.items():
         setattr(db_setting, field, value)
     db_setting.update_time = datetime.utcnow()
+    bump_settings_version(db)
     db.commit()
     db.refresh(db_setting)
     return db_setting
@@ -236,7 +275,9 @@ def get_terminologies(db: Session, skip: int = 0, limit: int = 100):
 
 def create_terminology(db: Session, terminology: schemas.TerminologyCreate) -> models.Terminology:
     db_terminology = models.Terminology(**terminology.dict())
+    _fill_term_norms(db_terminology)
     db.add(db_terminology)
+    bump_glossary_version(db)
     db.commit()
     db.refresh(db_terminology)
     return db_terminology
@@ -256,6 +297,47 @@ def get_terms(db: Session, skip: int = 0, limit: int = 100, category_id: Optiona
 from typing import Optional
 from sqlalchemy import or_, and_, func
 
+# --- Glossary version (bumped by every term/category change) ---
+def get_glossary_version(db: Session) -> int:
+    return _get_counter(db, GLOSSARY_VERSION_KEY)
+
+def bump_glossary_version(db: Session, commit: bool = False) -> None:
+    """递增术语表版本：与术语变更在同一事务内提交（commit=False 时由调用方提交）"""
+    _bump_counter(db, GLOSSARY_VERSION_KEY, commit=commit)
+
+# --- 术语规范化列 ---
+WILDCARD_LANGS = ("auto", "any", "*")
+
+# 界面常用的语言名称/别名 -> 规范代码
+_LANG_CANONICAL = {
+    'zh-cn': 'zh', '中文': 'zh', 'chinese': 'zh', 'cn': 'zh',
+    'en-us': 'en', '英文': 'en', 'english': 'en',
+    'jp': 'ja', '日本語': 'ja', '日文': 'ja', '日语': 'ja',
+    'kr': 'ko', '한국어': 'ko', '韩国语': 'ko', '韩文': 'ko', '韩语': 'ko',
+}
+
+def normalize_lang_code(lang: Optional[str]) -> Optional[str]:
+    if not lang:
+        return None
+    code = str(lang).strip().lower().replace('_', '-')
+    return _LANG_CANONICAL.get(code, code)[:10]
+
+def term_search_key(text: Optional[str]) -> str:
+    return (text or "").casefold()[:200]
+
+def term_norm_fields(source_text: Optional[str], target_text: Optional[str],
+                     source_lang: Optional[str], target_lang: Optional[str]) -> Dict[str, Any]:
+    return {
+        "source_lang_norm": normalize_lang_code(source_lang),
+        "target_lang_norm": normalize_lang_code(target_lang),
+        "source_key": term_search_key(source_text),
+        "target_key": term_search_key(target_text),
+    }
+
+def _fill_term_norms(term: models.Terminology) -> None:
+    for field, value in term_norm_fields(term.source_text, term.target_text, term.source_lang, term.target_lang).items():
+        setattr(term, field, value)
+
 def create_term(db: Session, term: schemas.TerminologyCreate, user_id: Optional[int] = None):
     payload = term.dict()
     # 公共术语：user_id=0；否则为当前用户
@@ -271,7 +353,9 @@ def create_term(db: Session, term: schemas.TerminologyCreate, user_id: Optional[
         else:
             payload['user_id'] = user_id
     db_term = models.Terminology(**payload)
+    _fill_term_norms(db_term)
     db.add(db_term)
+    bump_glossary_version(db)
     db.commit()
     db.refresh(db_term)
     return db_term
@@ -281,6 +365,7 @@ def delete_term(db: Session, term_id: int):
     if not db_term:
         return None
     db.delete(db_term)
+    bump_glossary_version(db)
     db.commit()
     return db_term
 
@@ -331,6 +416,7 @@ def update_term_category(db: Session, category_id: int, category_update: schemas
     update_data = category_update.dict(exclude_unset=True)
     for field, value in update_data.items():
         setattr(db_category, field, value)
+    bump_glossary_version(db)
     db.commit()
     db.refresh(db_category)
     return db_category
@@ -344,6 +430,7 @@ def delete_term_category(db: Session, category_id: int) -> Optional[models.TermC
     if count > 0:
         raise ValueError("Category has associated terms")
     db.delete(db_category)
+    bump_glossary_version(db)
     db.commit()
     return db_category
 
@@ -354,6 +441,8 @@ def update_term(db: Session, term_id: int, term_update: schemas.TerminologyUpdat
     update_data = term_update.dict(exclude_unset=True)
     for field, value in update_data.items():
         setattr(db_term, field, value)
+    _fill_term_norms(db_term)
+    bump_glossary_version(db)
     db.commit()
     db.refresh(db_term)
     return db_term
@@ -367,21 +456,7 @@ def get_terms_by_categories(
 ):
     if not category_ids:
         return []
-    query = db.query(models.Terminology).filter(
-        models.Terminology.category_id.in_(category_ids),
-        models.Terminology.is_active == True,
-        models.Terminology.is_approved == True,
-    )
-    if src_lang and str(src_lang).strip().lower() not in ("auto", "any", "*"):
-        query = query.filter(func.lower(models.Terminology.source_lang) == func.lower(src_lang))
-    if tgt_lang:
-        query = query.filter(func.lower(models.Terminology.target_lang) == func.lower(tgt_lang))
-    if user_id is not None:
-        # 公共术语使用 NULL 表示
-        query = query.filter(or_(models.Terminology.user_id.is_(None), models.Terminology.user_id == user_id))
-    else:
-        query = query.filter(models.Terminology.user_id.is_(None))
-    return query.all()
+    return _term_lookup_query(db, (models.Terminology,), src_lang, tgt_lang, user_id=user_id, category_ids=category_ids).all()
 
 def create_translation_term_set(db: Session, term_set: schemas.TranslationTermSetCreate) -> models.TranslationTermSet:
     db_ts = models.TranslationTermSet(**term_set.dict())
@@ -398,54 +473,83 @@ def get_translation_term_set(db: Session, translation_id: str, translation_type:
 
 # --- Terminology retrieval for runtime processing ---
 def get_terms_by_lang_pair(db: Session, src_lang: str, tgt_lang: str, only_public: bool = True, user_id: Optional[int] = None):
-    def lang_aliases(lang: str):
-        if not lang:
-            return []
-        l = lang.strip().lower()
-        # Basic aliases for common languages used in UI
-        table = {
-            'zh': ['zh', 'zh-cn', '中文', 'chinese', 'cn'],
-            'en': ['en', 'en-us', '英文', 'english'],
-            'ja': ['ja', 'jp', '日本語', '日文', '日语'],
-            'ko': ['ko', 'kr', '한국어', '韩文', '韩语'],
-        }
-        # map localized labels back to canonical
-        reverse = {
-            '中文': 'zh', 'chinese': 'zh', 'cn': 'zh', 'zh-cn': 'zh',
-            '英文': 'en', 'english': 'en', 'en-us': 'en',
-            '日本語': 'ja', '日文': 'ja', '日语': 'ja', 'jp': 'ja',
-            '韩国语': 'ko', '韩语': 'ko', '韩文': 'ko', 'kr': 'ko', '한국어': 'ko',
-        }
-        base = reverse.get(l, l)
-        return table.get(base, [base])
-
-    src_alias = lang_aliases(src_lang)
-    tgt_alias = lang_aliases(tgt_lang)
-    if not src_alias:
-        src_alias = [src_lang]
-    if not tgt_alias:
-        tgt_alias = [tgt_lang]
-
-    base = db.query(models.Terminology).filter(
-        models.Terminology.is_approved == True,
-    )
-    # target language is required
-    base = base.filter(func.lower(models.Terminology.target_lang).in_(tgt_alias))
+    return _term_lookup_query(db, (models.Terminology,), src_lang, tgt_lang,
+                              user_id=None if only_public else user_id, all_owners=(not only_public and user_id is None)).all()
+
+def get_term_pairs(db: Session, src_lang: str, tgt_lang: str, user_id: Optional[int] = None,
+                   category_ids: Optional[List[int]] = None):
+    """任务加载术语：只取 (source_text, target_text)，由 ix_terminologies_lookup 覆盖（index-only）
+
+    category_ids=None 时为公共术语 + 该用户私有术语；给定分类时只取这些分类中启用的术语。
+    """
+    if category_ids is not None and not category_ids:
+        return []
+    return _term_lookup_query(db, (models.Terminology.source_text, models.Terminology.target_text),
+                              src_lang, tgt_lang, user_id=user_id, category_ids=category_ids).all()
+
+def _term_lookup_query(db: Session, entities, src_lang: str, tgt_lang: str, user_id: Optional[int] = None,
+                       category_ids: Optional[List[int]] = None, all_owners: bool = False):
+    T = models.Terminology
+    query = db.query(*entities).filter(T.is_approved == True)
+    # target language is required（按分类取术语时未给目标语言则不过滤）
+    if tgt_lang or category_ids is None:
+        query = query.filter(T.target_lang_norm == (normalize_lang_code(tgt_lang) or ""))
     # source language filter if not auto/wildcard
-    if src_lang and str(src_lang).strip().lower() not in ("auto", "any", "*"):
-        base = base.filter(func.lower(models.Terminology.source_lang).in_(src_alias))
-    if only_public:
-        # 公共术语：user_id IS NULL
-        return base.filter(models.Terminology.user_id.is_(None)).all()
-    # include public and specified user's private terms
+    if src_lang and str(src_lang).strip().lower() not in WILDCARD_LANGS:
+        query = query.filter(T.source_lang_norm == normalize_lang_code(src_lang))
+    if category_ids is not None:
+        query = query.filter(T.category_id.in_(category_ids), T.is_active == True)
+    if all_owners:
+        return query
     if user_id is not None:
-        return base.filter(
-            or_(
-                models.Terminology.user_id.is_(None),
-                models.Terminology.user_id == user_id,
-            )
-        ).all()
-    return base.all()
+        # 公共术语使用 NULL 表示
+        return query.filter(or_(T.user_id.is_(None), T.user_id == user_id))
+    return query.filter(T.user_id.is_(None))
+
+def _escape_like(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+def _key_match(db: Session, column, key: str, mode: str):
+    if mode == "contains":
+        # PostgreSQL 上由 pg_trgm GIN 索引支持（见 main.ensure_terminology_search_columns），其他库为扫描
+        return column.like(f"%{_escape_like(key)}%", escape="\\")
+    if db.get_bind().dialect.name == "postgresql":
+        return column.like(f"{_escape_like(key)}%", escape="\\")
+    # 二进制排序下的区间扫描，等价于前缀匹配且可走普通 B-tree 索引
+    return and_(column >= key, column < key + "\U0010ffff")
+
+def search_terms(db: Session, q: str, mode: str = "prefix", field: str = "source",
+                 src_lang: Optional[str] = None, tgt_lang: Optional[str] = None,
+                 category_id: Optional[int] = None, user_id: Optional[int] = None,
+                 include_public: bool = True, all_owners: bool = False,
+                 skip: int = 0, limit: int = 50) -> List[models.Terminology]:
+    """按源/目标文本前缀（prefix）或子串（contains）检索术语，不区分大小写"""
+    T = models.Terminology
+    key = term_search_key(q)
+    query = db.query(T)
+    if key:
+        if field == "target":
+            query = query.filter(_key_match(db, T.target_key, key, mode))
+        elif field == "both":
+            query = query.filter(or_(_key_match(db, T.source_key, key, mode), _key_match(db, T.target_key, key, mode)))
+        else:
+            query = query.filter(_key_match(db, T.source_key, key, mode))
+    if src_lang and str(src_lang).strip().lower() not in WILDCARD_LANGS:
+        query = query.filter(T.source_lang_norm == normalize_lang_code(src_lang))
+    if tgt_lang:
+        query = query.filter(T.target_lang_norm == normalize_lang_code(tgt_lang))
+    if category_id is not None:
+        query = query.filter(T.category_id == category_id)
+    if not all_owners:
+        if include_public:
+            query = query.filter(or_(T.user_id.is_(None), T.user_id == user_id))
+        else:
+            query = query.filter(T.user_id == user_id)
+    if key and mode != "contains" and field in ("source", "target"):
+        query = query.order_by(T.target_key if field == "target" else T.source_key, T.id)
+    else:
+        query = query.order_by(T.id)
+    return query.offset(skip).limit(limit).all()
 
 # --- TranslationTask upsert used by main.translate_document ---
 def create_or_update_translation_task(db: Session, task: schemas.TranslationTaskCreate) -> models.TranslationTask:
@@ -33,10 +33,12 @@ from . import models, schemas, crud
 from .database import engine, get_db, SessionLocal
 from .routers import terminology, users, auth, admin
 from .services.engine_config import EngineConfig
-from .worker import translate_document_task, process_translation_task, process_batch_translation_task, celery_app
+from .worker import translate_document_task, process_translation_task, process_batch_translation_task, run_batch_translation_task, celery_app, dispatch_task
 from .auth import get_current_active_user, get_password_hash
+from .services.settings_snapshot import get_settings, invalidate_settings
 from .services.terminology_service import (
     get_terminology_options,
+    get_glossary_version,
     preprocess_texts,
     postprocess_texts,
     record_translation_term_set,
@@ -73,9 +75,11 @@ def create_default_settings():
         if existing_settings == 0:
             default_settings = [
                 models.SystemSetting(category="security", key="allow_registration", value="true", value_type="bool", description="是否允许用户注册"),
+                models.SystemSetting(category="system", key="system_settings_version", value="0", value_type="int", description="系统设置版本（设置变更时自动递增）", is_editable=False),
                 # Terminology minimal switches
                 models.SystemSetting(category="terminology", key="terminology_enabled", value="true", value_type="bool", description="是否启用术语前/后处理"),
                 models.SystemSetting(category="terminology", key="terminology_case_sensitive", value="false", value_type="bool", description="术语匹配大小写敏感"),
+                models.SystemSetting(category="terminology", key="terminology_glossary_version", value="0", value_type="int", description="术语表版本（术语/分类变更时自动递增）", is_editable=False),
                 # History limits per user (separate)
                 models.SystemSetting(category="history", key="max_text_items_per_user", value="1000", value_type="int", description="每个用户文本历史记录上限"),
                 models.SystemSetting(category="history", key="max_doc_items_per_user", value="1000", value_type="int", description="每个用户文档历史记录上限"),
@@ -86,16 +90,19 @@ def create_default_settings():
                 models.SystemSetting(category="ooxml", key="pptx_use_ooxml", value="true", value_type="bool", description="PPTX 使用 OOXML 级替换（推荐）"),
                 models.SystemSetting(category="ooxml", key="xlsx_use_ooxml", value="true", value_type="bool", description="XLSX 使用 OOXML 级替换（推荐）"),
                 models.SystemSetting(category="ooxml", key="docx_parallel_workers", value="6", value_type="int", description="DOCX 解析并行工作线程数"),
-                models.SystemSetting(category="ooxml", key="docx_collect_tokens", value="false", value_type="bool", description="DOCX 启用顺序模式以精确统计 tokens"),
+                models.SystemSetting(category="ooxml", key="docx_collect_tokens", value="false", value_type="bool", description="已废弃：DOCX 并行模式已逐批精确统计 tokens，此项不再生效"),
             ]
             db.add_all(default_settings)
             db.commit()
+            invalidate_settings()
             print("默认系统设置创建成功")
         else:
             # ensure terminology keys exist
             keys = {
                 "terminology_enabled": ("terminology", "true", "bool", "是否启用术语前/后处理"),
                 "terminology_case_sensitive": ("terminology", "false", "bool", "术语匹配大小写敏感"),
+                "terminology_glossary_version": ("terminology", "0", "int", "术语表版本（术语/分类变更时自动递增）"),
+                "system_settings_version": ("system", "0", "int", "系统设置版本（设置变更时自动递增）"),
                 "max_text_items_per_user": ("history", "1000", "int", "每个用户文本历史记录上限"),
                 "max_doc_items_per_user": ("history", "1000", "int", "每个用户文档历史记录上限"),
                 "frontend_delete_permanent": ("history", "true", "bool", "小历史删除是否等同后台删除"),
@@ -105,7 +112,7 @@ def create_default_settings():
                 "pptx_use_ooxml": ("ooxml", "true", "bool", "PPTX 使用 OOXML 级替换（推荐）"),
                 "xlsx_use_ooxml": ("ooxml", "true", "bool", "XLSX 使用 OOXML 级替换（推荐）"),
                 "docx_parallel_workers": ("ooxml", "6", "int", "DOCX 解析并行工作线程数"),
-                "docx_collect_tokens": ("ooxml", "false", "bool", "DOCX 启用顺序模式以精确统计 tokens"),
+                "docx_collect_tokens": ("ooxml", "false", "bool", "已废弃：DOCX 并行模式已逐批精确统计 tokens，此项不再生效"),
             }
             created = 0
             for k, (cat, val, vtype, desc) in keys.items():
@@ -113,7 +120,10 @@ def create_default_settings():
                     db.add(models.SystemSetting(category=cat, key=k, value=val, value_type=vtype, description=desc))
                     created += 1
             if created:
+                # 其他进程的设置快照按版本号感知新增项
+                crud.bump_settings_version(db)
                 db.commit()
+                invalidate_settings()
                 print(f"补充创建术语相关系统设置 {created} 项")
             else:
                 print("系统设置已存在")
@@ -290,10 +300,97 @@ def create_default_strategies():
     finally:
         db.close()
 
+def ensure_task_lease_columns():
+    """为已有的 translation_tasks 表补齐租约相关列（create_all 不会修改已存在的表）"""
+    try:
+        from sqlalchemy import inspect, text
+        existing = {c["name"] for c in inspect(engine).get_columns("translation_tasks")}
+        columns = {
+            "worker_id": "VARCHAR(128)",
+            "lease_expires_at": "TIMESTAMP",
+            "heartbeat_time": "TIMESTAMP",
+            "attempts": "INTEGER DEFAULT 0",
+        }
+        with engine.begin() as conn:
+            for name, ddl in columns.items():
+                if name not in existing:
+                    conn.execute(text(f"ALTER TABLE translation_tasks ADD COLUMN {name} {ddl}"))
+                    print(f"translation_tasks 新增列: {name}")
+    except Exception as e:
+        print(f"租约列检查失败: {e}")
+
+TERMINOLOGY_BACKFILL_BATCH_SIZE = int(os.getenv("TERMINOLOGY_BACKFILL_BATCH_SIZE", "2000"))
+
+def ensure_terminology_search_columns():
+    """为已有的 terminologies 表补齐规范化列与索引，并回填旧数据（create_all 不会修改已存在的表）"""
+    try:
+        from sqlalchemy import inspect, text
+        existing = {c["name"] for c in inspect(engine).get_columns("terminologies")}
+        columns = {
+            "source_lang_norm": "VARCHAR(10)",
+            "target_lang_norm": "VARCHAR(10)",
+            "source_key": "VARCHAR(200)",
+            "target_key": "VARCHAR(200)",
+        }
+        with engine.begin() as conn:
+            for name, ddl in columns.items():
+                if name not in existing:
+                    conn.execute(text(f"ALTER TABLE terminologies ADD COLUMN {name} {ddl}"))
+                    print(f"terminologies 新增列: {name}")
+    except Exception as e:
+        print(f"术语规范化列检查失败: {e}")
+        return
+
+    # 回填：按 id 分批处理尚未规范化的行
+    db = SessionLocal()
+    try:
+        T = models.Terminology
+        last_id, filled = 0, 0
+        while True:
+            rows = db.query(T.id, T.source_text, T.target_text, T.source_lang, T.target_lang).filter(
+                T.id > last_id, or_(T.target_lang_norm.is_(None), T.source_key.is_(None)),
+            ).order_by(T.id.asc()).limit(TERMINOLOGY_BACKFILL_BATCH_SIZE).all()
+            if not rows:
+                break
+            db.bulk_update_mappings(T, [{"id": r[0], **crud.term_norm_fields(r[1], r[2], r[3], r[4])} for r in rows])
+            db.commit()
+            filled += len(rows)
+            last_id = rows[-1][0]
+        if filled:
+            print(f"terminologies 回填规范化列: {filled} 行")
+    except Exception as e:
+        print(f"术语规范化列回填失败: {e}")
+        db.rollback()
+    finally:
+        db.close()
+
+    try:
+        for index in models.Terminology.__table__.indexes:
+            index.create(bind=engine, checkfirst=True)
+    except Exception as e:
+        print(f"术语索引创建失败: {e}")
+
+    if engine.dialect.name == "postgresql":
+        # 子串检索（LIKE '%abc%'）使用 pg_trgm 三元组索引；扩展不可用时退化为顺序扫描
+        try:
+            from sqlalchemy import text
+            with engine.begin() as conn:
+                conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+            with engine.begin() as conn:
+                for col in ("source_key", "target_key"):
+                    conn.execute(text(
+                        f"CREATE INDEX IF NOT EXISTS ix_terminologies_{col}_trgm "
+                        f"ON terminologies USING gin ({col} gin_trgm_ops)"
+                    ))
+        except Exception as e:
+            print(f"pg_trgm 索引不可用，子串检索将顺序扫描: {e}")
+
 def init_db():
     """初始化数据库"""
     try:
         models.Base.metadata.create_all(bind=engine)
+        ensure_task_lease_columns()
+        ensure_terminology_search_columns()
         print("数据库表创建成功")
         create_default_admin()
         create_default_settings()
@@ -402,7 +499,7 @@ async def translate_document(
         source_file_size = os.path.getsize(file_path) if os.path.exists(file_path) else None
         logger.info(f"Source file size: {source_file_size} bytes")
         
-        logger.info("Creating Celery translation task...")
+        logger.info("Preparing translation task record...")
 
         # 解析术语分类ID
         parsed_category_ids: Optional[List[int]] = None
@@ -417,8 +514,7 @@ async def translate_document(
 
         # 历史上限校验（文档）
         try:
-            max_doc = crud.get_system_setting_by_key(db, "max_doc_items_per_user")
-            max_doc_val = int(max_doc.value) if max_doc and str(max_doc.value).isdigit() else 1000
+            max_doc_val = get_settings(db).get_int("max_doc_items_per_user", 1000)
             # 仅统计仍有文件的记录，已清理(file_name/result_path 均为空)的不计入
             current_doc = db.query(models.TranslationTask).filter(
                 models.TranslationTask.user_id == current_user.id,
@@ -431,21 +527,6 @@ async def translate_document(
         except Exception:
             pass
         task_id_str = str(uuid.uuid4())
-        translate_document_task.apply_async(
-            kwargs=dict(
-                task_id=task_id_str,
-                file_path=file_path,
-                output_path=output_path,
-                source_lang=source_lang,
-                target_lang=target_lang,
-                engine=engine,
-                strategy=strategy,
-                category_ids=parsed_category_ids,
-                style_instruction=style_instruction,
-                style_preset=style_preset,
-            ),
-            task_id=task_id_str,
-        )
 
         # 记录初始 engine_params （基础配置，便于审计）
         try:
@@ -517,19 +598,25 @@ async def translate_document(
         except Exception as _e:
             logger.warning(f"record_translation_term_set failed: {_e}")
 
-        # 在后台处理翻译任务
-        background_tasks.add_task(
+        # 派发执行：任务记录已创建，交给 Celery；仅当 broker 不可达时才在本进程后台执行。
+        # 执行端通过 translation_tasks 上的认领/租约保证只运行一次
+        dispatch_task(
+            translate_document_task,
+            background_tasks,
             process_translation_task,
             task_id=task_id_str,
-            file_path=file_path,
-            output_path=output_path,
-            source_lang=source_lang,
-            target_lang=target_lang,
-            engine=engine,
-            strategy=strategy,
-            category_ids=parsed_category_ids,
-            style_instruction=style_instruction,
-            style_preset=style_preset,
+            kwargs=dict(
+                task_id=task_id_str,
+                file_path=file_path,
+                output_path=output_path,
+                source_lang=source_lang,
+                target_lang=target_lang,
+                engine=engine,
+                strategy=strategy,
+                category_ids=parsed_category_ids,
+                style_instruction=style_instruction,
+                style_preset=style_preset,
+            ),
         )
 
         return JSONResponse(content={"task_id": task_id_str})
@@ -568,8 +655,7 @@ async def translate_text(payload: Dict = Body(...), db: Session = Depends(get_db
         
         # 历史上限校验（文本）
         try:
-            max_text = crud.get_system_setting_by_key(db, "max_text_items_per_user")
-            max_text_val = int(max_text.value) if max_text and str(max_text.value).isdigit() else 1000
+            max_text_val = get_settings(db).get_int("max_text_items_per_user", 1000)
             # 仅统计“有效”文本历史：源/译文本至少一个非空
             current_text = (
                 db.query(models.TextTranslation)
@@ -635,6 +721,11 @@ async def translate_text(payload: Dict = Body(...), db: Session = Depends(get_db
             extra_kwargs['style_preset'] = style_preset
         if engine in ("qwen_plus","qwen-plus","deepseek"):
             extra_kwargs['enable_thinking'] = enable_thinking
+        # 翻译记忆按用户作用域隔离
+        extra_kwargs['user_id'] = current_user.id if current_user and hasattr(current_user, 'id') else None
+        # 术语表版本进入翻译记忆缓存键，术语变更后不复用旧译文
+        if options.get("terminology_enabled", True):
+            extra_kwargs['terminology_version'] = get_glossary_version(db)
         translation_results, tokens = translate_batch(processed_texts, source_lang, target_lang, engine=engine, **extra_kwargs)
 
         # 术语后处理
@@ -1254,10 +1345,14 @@ async def batch_submit(
             db.add(models.BatchItem(batch_id=batch_id, task_id=task_id_str))
             db.commit()
 
-            # 启动后台处理：改为通过 Celery 队列执行，确保由 worker 处理并正确落盘
-            # 通过 Celery 派发，同时也在本进程后台线程执行一次作为兜底，确保文件一定生成
-            try:
-                process_batch_translation_task.delay(
+            # 启动后台处理：通过 Celery 队列执行；仅当 broker 不可达时才在本进程后台执行（认领/租约保证只运行一次）
+            # 本进程回退执行纯函数（与文档路径的 process_translation_task 一致），不调用绑定的 Celery 任务
+            dispatch_task(
+                process_batch_translation_task,
+                background_tasks,
+                run_batch_translation_task,
+                task_id=task_id_str,
+                kwargs=dict(
                     task_id=task_id_str,
                     file_path=file_path,
                     output_path=output_path,
@@ -1266,19 +1361,7 @@ async def batch_submit(
                     category_ids=parsed_category_ids,
                     style_instruction=style_instruction,
                     style_preset=style_preset,
-                )
-            except Exception:
-                pass
-            background_tasks.add_task(
-                process_batch_translation_task,
-                task_id=task_id_str,
-                file_path=file_path,
-                output_path=output_path,
-                source_lang=source_lang,
-                target_lang=target_lang,
-                category_ids=parsed_category_ids,
-                style_instruction=style_instruction,
-                style_preset=style_preset,
+                ),
             )
             created.append({"file": filename, "task_id": task_id_str})
         except Exception as e:
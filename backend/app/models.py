@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, Enum, Boolean, Float, func, ForeignKey, JSON
+from sqlalchemy import Column, Integer, String, Text, DateTime, Enum, Boolean, Float, func, ForeignKey, JSON, Index
 from sqlalchemy.orm import relationship, declarative_base
 import enum
 
@@ -168,12 +168,28 @@ class Terminology(Base):
     approval_by = Column(Integer, ForeignKey("users.id"), nullable=True)
     approval_time = Column(DateTime(timezone=True), nullable=True)
     is_active = Column(Boolean, default=True, comment="术语是否启用")
+    # 规范化列（写入时由 crud.term_norm_fields 填充）：语言代码归一（如 zh-CN/中文 -> zh），文本 casefold 后用于检索
+    source_lang_norm = Column(String(10), nullable=True, comment="规范化源语言代码")
+    target_lang_norm = Column(String(10), nullable=True, comment="规范化目标语言代码")
+    source_key = Column(String(200), nullable=True, comment="casefold 后的源文本（前缀/子串检索）")
+    target_key = Column(String(200), nullable=True, comment="casefold 后的目标文本（前缀/子串检索）")
     create_time = Column(DateTime(timezone=True), server_default=func.now())
     update_time = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
     
     # 关联关系
     category = relationship("TermCategory", back_populates="terms")
 
+    __table_args__ = (
+        # 任务加载术语：按语言对定位，其余过滤列与 source/target 都在索引内，可只读索引完成（index-only）
+        Index("ix_terminologies_lookup", "target_lang_norm", "source_lang_norm", "user_id", "category_id",
+              "is_approved", "is_active", "source_text", "target_text"),
+        Index("ix_terminologies_owner", "user_id", "category_id"),
+        Index("ix_terminologies_category", "category_id"),
+        # 前缀检索；PostgreSQL 使用 text_pattern_ops，LIKE 'abc%' 在任意排序规则下都能走索引
+        Index("ix_terminologies_source_key", "source_key", postgresql_ops={"source_key": "text_pattern_ops"}),
+        Index("ix_terminologies_target_key", "target_key", postgresql_ops={"target_key": "text_pattern_ops"}),
+    )
+
 class TermCategory(Base):
     __tablename__ = "term_categories"
     id = Column(Integer, primary_key=True, index=True)
@@ -198,6 +214,21 @@ class TranslationTermSet(Base):
     category_ids = Column(JSON, nullable=True, comment="使用的分类ID数组")
     create_time = Column(DateTime(timezone=True), server_default=func.now())
 
+class TranslationMemory(Base):
+    __tablename__ = "translation_memory"
+    id = Column(Integer, primary_key=True, index=True)
+    cache_key = Column(String(64), unique=True, index=True, nullable=False, comment="sha256(原文/语言对/引擎/模型/风格/术语版本/作用域)")
+    scope = Column(String(32), nullable=False, default="public", comment="public 或 user:<id>")
+    engine = Column(String(50), nullable=False)
+    model = Column(String(100), nullable=True)
+    source_lang = Column(String(10), nullable=True)
+    target_lang = Column(String(10), nullable=True)
+    source_text = Column(Text, nullable=False)
+    target_text = Column(Text, nullable=False)
+    hit_count = Column(Integer, default=0)
+    create_time = Column(DateTime(timezone=True), server_default=func.now())
+    last_hit_time = Column(DateTime(timezone=True), nullable=True)
+
 class TranslationTask(Base):
     __tablename__ = "translation_tasks"
     task_id = Column(String(36), primary_key=True, index=True)
@@ -221,6 +252,11 @@ class TranslationTask(Base):
     engine = Column(String(50), nullable=True)  # e.g., 'deepseek'
     strategy = Column(String(50), nullable=True)  # e.g., 'ooxml_direct'
     engine_params = Column(JSON, nullable=True)  # 运行参数审计（model/max_workers/batch_size/retry/sleep/timeout/style等）
+    # 执行认领与租约（保证同一任务只有一个执行者；租约过期后可被接管）
+    worker_id = Column(String(128), nullable=True)
+    lease_expires_at = Column(DateTime, nullable=True, index=True)
+    heartbeat_time = Column(DateTime, nullable=True)
+    attempts = Column(Integer, default=0)
     
     # 关联关系
     user = relationship("User", back_populates="translation_tasks")
@@ -9,6 +9,8 @@ import secrets
 import hashlib
 from sqlalchemy import and_, func
 import os
+from ..services.engine_config import EngineConfig
+from ..services.settings_snapshot import get_settings, invalidate_settings
 
 router = APIRouter(tags=["admin"])
 
@@ -253,7 +255,9 @@ async def create_translation_engine(
     if existing_engine:
         raise HTTPException(status_code=400, detail="引擎名称已存在")
     
-    return crud.create_translation_engine(db, engine)
+    created = crud.create_translation_engine(db, engine)
+    EngineConfig.invalidate_cache()
+    return created
 
 @router.put("/engines/{engine_id}", response_model=schemas.TranslationEngine)
 async def update_translation_engine(
@@ -272,6 +276,8 @@ async def update_translation_engine(
     updated_engine = crud.update_translation_engine(db, engine_id, engine_update)
     if not updated_engine:
         raise HTTPException(status_code=404, detail="翻译引擎不存在")
+    # 引擎配置已变化：失效配置缓存与引擎实例池
+    EngineConfig.invalidate_cache()
     return updated_engine
 
 @router.delete("/engines/{engine_id}")
@@ -292,6 +298,7 @@ async def delete_translation_engine(
     
     db.delete(engine)
     db.commit()
+    EngineConfig.invalidate_cache()
     
     return {"message": "翻译引擎删除成功"}
 
@@ -313,6 +320,7 @@ async def toggle_engine_status(
     
     engine.update_time = datetime.utcnow()
     db.commit()
+    EngineConfig.invalidate_cache()
     
     return {"message": f"引擎状态已切换为 {engine.status}"}
 
@@ -322,10 +330,10 @@ async def toggle_engine_status(
 async def get_registration_setting(db: Session = Depends(get_db)):
     """获取用户注册是否开放的设置（公开，无需登录）。异常时默认允许。"""
     try:
-        setting = crud.get_system_setting_by_key(db, "allow_registration")
+        setting = get_settings(db).get("allow_registration")
         allow = True  # 默认允许注册
-        if setting and isinstance(setting.value, str):
-            if setting.value.strip().lower() in ["false", "0", "no"]:
+        if isinstance(setting, str):
+            if setting.strip().lower() in ["false", "0", "no"]:
                 allow = False
         return {"allow_registration": allow}
     except Exception:
@@ -443,7 +451,9 @@ async def create_system_setting(
     if existing_setting:
         raise HTTPException(status_code=400, detail="设置键已存在")
     
-    return crud.create_system_setting(db, setting)
+    created = crud.create_system_setting(db, setting)
+    invalidate_settings()
+    return created
 
 @router.put("/settings/{setting_id}", response_model=schemas.SystemSetting)
 async def update_system_setting(
@@ -456,6 +466,7 @@ async def update_system_setting(
     updated_setting = crud.update_system_setting(db, setting_id, setting_update)
     if not updated_setting:
         raise HTTPException(status_code=404, detail="系统设置不存在")
+    invalidate_settings()
     return updated_setting
 
 @router.delete("/settings/{setting_id}")
@@ -473,7 +484,9 @@ async def delete_system_setting(
         raise HTTPException(status_code=400, detail="该设置不可编辑")
     
     db.delete(setting)
+    crud.bump_settings_version(db)
     db.commit()
+    invalidate_settings()
     
     return {"message": "系统设置删除成功"}
 
@@ -629,6 +642,55 @@ async def clear_old_logs(
         "deleted_tokens": deleted_tokens
     }
 
+@router.get("/maintenance/translation-memory")
+async def get_translation_memory_stats(
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_admin_user)
+):
+    """获取翻译记忆命中率统计（当前进程）与持久化条目数"""
+    from ..services.translation_memory import get_translation_memory_stats as _tm_stats
+    stats = _tm_stats()
+    try:
+        stats["stored_entries"] = db.query(func.count(models.TranslationMemory.id)).scalar() or 0
+    except Exception:
+        stats["stored_entries"] = None
+    return stats
+
+@router.post("/maintenance/translation-memory/clear")
+async def clear_translation_memory(
+    engine: Optional[str] = Query(None),
+    scope: Optional[str] = Query(None, description="public 或 user:<id>"),
+    current_user: models.User = Depends(get_current_admin_user)
+):
+    """清理翻译记忆（可按引擎/作用域过滤）"""
+    from ..services.translation_memory import translation_memory
+    deleted = translation_memory.purge(engine=engine, scope=scope)
+    return {"message": "翻译记忆已清理", "deleted": deleted}
+
+@router.get("/maintenance/http-pools")
+async def get_http_pool_stats(
+    current_user: models.User = Depends(get_current_admin_user)
+):
+    """获取引擎 HTTP 连接池统计（在途/峰值/饱和次数，当前进程）"""
+    from ..services.http_transport import get_http_pool_stats as _pool_stats
+    return _pool_stats()
+
+@router.get("/maintenance/rate-limits")
+async def get_rate_limit_stats(
+    current_user: models.User = Depends(get_current_admin_user)
+):
+    """获取引擎限流（令牌桶）统计：后端类型、各引擎/API Key 的获取与等待情况（当前进程）"""
+    from ..services.rate_limiter import rate_limiter
+    return rate_limiter.get_stats()
+
+@router.get("/maintenance/concurrency")
+async def get_concurrency_stats(
+    current_user: models.User = Depends(get_current_admin_user)
+):
+    """获取各引擎自适应并发控制器状态（当前并发上限、在途数、限流/慢响应次数，当前进程）"""
+    from ..services.concurrency_controller import get_concurrency_stats as _stats
+    return _stats()
+
 @router.post("/maintenance/reset-quotas")
 async def reset_all_quotas(
     quota_type: Optional[str] = Query(None),
@@ -1,11 +1,13 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, UploadFile, File, Form
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 from typing import List, Optional
 from sqlalchemy import or_
 
 from .. import crud, models, schemas
 from ..services.terminology_service import get_terminology_options as svc_get_terminology_options
-from ..database import get_db
+from ..services import glossary_io
+from ..database import get_db, SessionLocal
 from ..auth import get_current_active_user
 
 router = APIRouter()
@@ -190,10 +192,12 @@ def read_terminologies(
     include_public: bool = Query(True, description="是否包含公共术语"),
     category_id: Optional[int] = Query(None, description="按分类过滤"),
     is_active: Optional[bool] = Query(None, description="是否启用"),
+    source_lang: Optional[str] = Query(None, description="按源语言过滤"),
+    target_lang: Optional[str] = Query(None, description="按目标语言过滤"),
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_active_user)
 ):
-    """获取术语列表（支持分类过滤）"""
+    """获取术语列表（支持分类、语言过滤）"""
     # 管理员：查看所有术语
     q = db.query(models.Terminology)
     if current_user.role == models.UserRole.admin:
@@ -218,11 +222,44 @@ def read_terminologies(
     if is_active is not None:
         q = q.filter(models.Terminology.is_active == is_active)
     
-    items = q.offset(skip).limit(limit).all()
+    # 语言过滤（规范化列，可走索引）
+    if source_lang:
+        q = q.filter(models.Terminology.source_lang_norm == crud.normalize_lang_code(source_lang))
+    if target_lang:
+        q = q.filter(models.Terminology.target_lang_norm == crud.normalize_lang_code(target_lang))
     
-    # 附带用户名和分类信息（仅用于展示）
-    users_map = {u.id: u.username for u in db.query(models.User).all()}
-    categories_map = {c.id: c.name for c in db.query(models.TermCategory).all()}
+    items = q.order_by(models.Terminology.id.asc()).offset(skip).limit(limit).all()
+    return _annotate_terms(db, items)
+
+@router.get("/search", response_model=List[schemas.Terminology])
+def search_terminologies(
+    q: str = Query(..., min_length=1, max_length=200, description="检索词（不区分大小写）"),
+    mode: str = Query("prefix", pattern="^(prefix|contains)$", description="prefix 前缀 / contains 子串"),
+    field: str = Query("source", pattern="^(source|target|both)$"),
+    source_lang: Optional[str] = Query(None),
+    target_lang: Optional[str] = Query(None),
+    category_id: Optional[int] = Query(None),
+    mine: bool = Query(False, description="是否只检索我的术语"),
+    skip: int = Query(0, ge=0),
+    limit: int = Query(50, ge=1, le=500),
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_active_user)
+):
+    """按源/目标文本检索术语（管理员检索全部，普通用户检索公共术语 + 自己的术语）"""
+    items = crud.search_terms(
+        db, q, mode=mode, field=field, src_lang=source_lang, tgt_lang=target_lang, category_id=category_id,
+        user_id=current_user.id, include_public=not mine,
+        all_owners=current_user.role == models.UserRole.admin and not mine,
+        skip=skip, limit=limit,
+    )
+    return _annotate_terms(db, items)
+
+def _annotate_terms(db: Session, items):
+    # 附带用户名和分类信息（仅用于展示）：只查询本页涉及的用户与分类
+    user_ids = {i.user_id for i in items if i.user_id is not None}
+    category_ids = {i.category_id for i in items if i.category_id}
+    users_map = dict(db.query(models.User.id, models.User.username).filter(models.User.id.in_(user_ids)).all()) if user_ids else {}
+    categories_map = dict(db.query(models.TermCategory.id, models.TermCategory.name).filter(models.TermCategory.id.in_(category_ids)).all()) if category_ids else {}
     
     for item in items:
         item.owner_username = users_map.get(item.user_id, 'public' if item.user_id is None else None)
@@ -231,6 +268,69 @@ def read_terminologies(
     
     return items
 
+# --- 批量导入/导出 ---
+@router.post("/import")
+def import_terminologies(
+    file: UploadFile = File(...),
+    file_format: Optional[str] = Form(None, description="csv/tsv/tbx，默认按扩展名"),
+    source_lang: str = Form("", description="文件未提供语言列时使用的源语言（TBX 必填）"),
+    target_lang: str = Form("", description="文件未提供语言列时使用的目标语言（TBX 必填）"),
+    category_id: Optional[int] = Form(None),
+    public: bool = Form(False, description="导入为公共术语（仅管理员）"),
+    dry_run: bool = Form(False, description="只返回差异，不写库"),
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_active_user)
+):
+    """批量导入术语（流式解析 CSV/TSV/TBX，按块 upsert，结束时递增一次术语表版本）"""
+    if public and current_user.role != models.UserRole.admin:
+        raise HTTPException(status_code=403, detail="Only admins can import public terms")
+    if category_id:
+        category = crud.get_term_category(db, category_id)
+        if not category:
+            raise HTTPException(status_code=404, detail="Category not found")
+        if category.owner_type != "public" and category.owner_id != current_user.id and current_user.role != models.UserRole.admin:
+            raise HTTPException(status_code=403, detail="Access denied to specified category")
+        if category.owner_type == "public" and current_user.role != models.UserRole.admin:
+            raise HTTPException(status_code=403, detail="Only admins can import into public categories")
+    try:
+        fmt = glossary_io.detect_format(file.filename, file_format)
+        rows = glossary_io.iter_rows(file.file, fmt, source_lang.strip(), target_lang.strip())
+        owner_id = glossary_io.resolve_owner(db, category_id, current_user.id, public=public)
+        return glossary_io.import_terms(db, rows, category_id=category_id, owner_id=owner_id, dry_run=dry_run)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.get("/export")
+def export_terminologies(
+    file_format: str = Query("csv", pattern="^(csv|tsv|tbx)$"),
+    source_lang: Optional[str] = Query(None),
+    target_lang: Optional[str] = Query(None),
+    category_id: Optional[int] = Query(None),
+    mine: bool = Query(False, description="是否只导出我的术语"),
+    current_user: models.User = Depends(get_current_active_user)
+):
+    """流式导出术语（管理员导出全部，普通用户导出公共术语 + 自己的术语）"""
+    is_admin = current_user.role == models.UserRole.admin
+    filters = dict(
+        src_lang=source_lang, tgt_lang=target_lang, category_id=category_id,
+        user_id=current_user.id, include_public=not mine, all_owners=is_admin and not mine,
+    )
+    media_types = {"csv": "text/csv", "tsv": "text/tab-separated-values", "tbx": "application/x-tbx+xml"}
+
+    def _stream():
+        # 依赖注入的会话在响应开始发送前即被关闭，流式读取使用独立会话
+        session = SessionLocal()
+        try:
+            yield from glossary_io.export_lines(session, file_format, **filters)
+        finally:
+            session.close()
+
+    return StreamingResponse(
+        _stream(),
+        media_type=f"{media_types[file_format]}; charset=utf-8",
+        headers={"Content-Disposition": f'attachment; filename="terminology.{file_format}"'},
+    )
+
 @router.put("/{term_id}", response_model=schemas.Terminology)
 def update_terminology(
     term_id: int,
@@ -4,6 +4,7 @@ from typing import List
 
 from .. import crud, models, schemas, auth
 from ..database import get_db
+from ..services.settings_snapshot import get_settings
 
 router = APIRouter()
 
@@ -12,9 +13,9 @@ def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
     # Check if registration is allowed (default: allowed)
     allow = True
     try:
-        allow_reg_setting = crud.get_system_setting_by_key(db, key="allow_registration")
-        if allow_reg_setting and isinstance(allow_reg_setting.value, str):
-            if allow_reg_setting.value.strip().lower() in ["false", "0", "no"]:
+        allow_reg_setting = get_settings(db).get("allow_registration")
+        if isinstance(allow_reg_setting, str):
+            if allow_reg_setting.strip().lower() in ["false", "0", "no"]:
                 allow = False
     except Exception:
         # if settings table not ready, allow registration by default
@@ -69,16 +70,12 @@ def _validate_password(pw: str) -> bool:
             'password_require_digit': 'req_digit',
             'password_require_special': 'req_special',
         }
-        # 使用直接查询，避免循环发请求
-        # 此处简化：逐项查询，系统设置数量很小
-        from .. import crud as _crud
-        from ..database import get_db as _get_db
-        # FastAPI 依赖外部，此处仅在请求上下文内调用，因此创建一个会话
-        db = _get_db().__next__()
+        # 从系统设置快照读取，不再为每次校验打开会话逐项查询
+        settings = get_settings()
         def get_val(key, default):
-            row = _crud.get_system_setting_by_key(db, key)
-            if row is None: return default
-            v = str(row.value).strip().lower()
+            value = settings.get(key)
+            if value is None: return default
+            v = str(value).strip().lower()
             if isinstance(default, bool):
                 return v in ['true','1','yes','y']
             try:
@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+"""
+引擎异步接口（asyncio）
+
+- AsyncEngineMixin：为 TranslationEngine 提供 send_request_async / translate_batch_async。
+  声明 async_json_api = True 的引擎（标准 Bearer JSON POST，OpenAI 兼容）走原生异步请求；
+  其余引擎退化为在线程中执行同步实现，保证接口一致。
+- 原生异步请求使用 httpx.AsyncClient（可选依赖，支持 HTTP/2 需安装 h2）；未安装 httpx 时
+  退化为线程 + 共享 keep-alive 连接池。
+- AsyncTranslateLoop：SegmentPipeline 在异步模式下为每个任务创建一个，整篇文档的所有批次提交到
+  同一个事件循环，共用异步客户端与在途请求信号量（ENGINE_ASYNC_CONCURRENCY）。
+- translate_batch_async：在已有事件循环中翻译一组片段（含翻译记忆）；run_translate_async 为其
+  同步入口，每次调用使用一个临时事件循环，调用结束即关闭客户端。
+"""
+import os
+import time
+import asyncio
+import logging
+import threading
+from typing import Any, Dict, List, Optional
+
+from .http_transport import http_post, HTTP_CONNECT_TIMEOUT
+from .rate_limiter import acquire_for_engine_async, settle_for_engine
+from .concurrency_controller import report_response
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+logger = logging.getLogger(__name__)
+
+ENGINE_ASYNC_CONCURRENCY = int(os.getenv("ENGINE_ASYNC_CONCURRENCY", "64"))
+ENGINE_HTTP2 = os.getenv("ENGINE_HTTP2", "false").strip().lower() in ("1", "true", "yes", "on")
+# Celery worker / 后台任务执行模式：thread（默认，线程池调用同步引擎）或 async（每个任务一个事件循环，见 AsyncTranslateLoop）
+WORKER_EXECUTION_MODE = os.getenv("WORKER_EXECUTION_MODE", "thread").strip().lower()
+
+
+def is_async_mode(value: Optional[Any] = None) -> bool:
+    if value is None:
+        return WORKER_EXECUTION_MODE == "async"
+    if isinstance(value, str):
+        return value.strip().lower() in ("1", "true", "yes", "on", "async")
+    return bool(value)
+
+
+# --- 共享异步 HTTP 客户端（每个事件循环一个） ---
+_clients: Dict[int, Any] = {}
+_clients_lock = threading.Lock()
+
+
+def _client_for_loop():
+    loop = asyncio.get_running_loop()
+    key = id(loop)
+    client = _clients.get(key)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(key)
+            if client is None:
+                http2 = ENGINE_HTTP2
+                if http2:
+                    try:
+                        import h2  # noqa: F401
+                    except ImportError:
+                        http2 = False
+                client = httpx.AsyncClient(
+                    http2=http2,
+                    limits=httpx.Limits(max_connections=ENGINE_ASYNC_CONCURRENCY,
+                                        max_keepalive_connections=ENGINE_ASYNC_CONCURRENCY),
+                )
+                _clients[key] = client
+    return client
+
+
+async def aclose_client():
+    """关闭当前事件循环的异步客户端"""
+    try:
+        key = id(asyncio.get_running_loop())
+    except RuntimeError:
+        return
+    client = _clients.pop(key, None)
+    if client is not None:
+        try:
+            await client.aclose()
+        except Exception:
+            pass
+
+
+async def apost(engine: str, url: str, timeout: Optional[float] = None, pool_size: Optional[int] = None, **kwargs):
+    """异步 POST；返回对象具备 status_code / json() / text"""
+    if httpx is None:
+        return await asyncio.to_thread(http_post, engine, url, timeout=timeout, pool_size=pool_size, **kwargs)
+    read_timeout = float(timeout or 60)
+    client = _client_for_loop()
+    return await client.post(
+        url,
+        timeout=httpx.Timeout(read_timeout, connect=min(HTTP_CONNECT_TIMEOUT, read_timeout)),
+        **kwargs,
+    )
+
+
+def _unwrap(result):
+    """统一为 (List[str], tokens)，兼容 [[text]] 包装"""
+    if isinstance(result, tuple) and len(result) >= 2:
+        texts, tokens = result[0], result[1]
+    else:
+        texts, tokens = result, 0
+    cleaned = []
+    for t in texts or []:
+        if isinstance(t, list) and len(t) == 1:
+            cleaned.append(t[0])
+        elif isinstance(t, str) or t is None:
+            # None 表示该片段翻译失败
+            cleaned.append(t)
+        else:
+            cleaned.append(str(t))
+    return cleaned, tokens
+
+
+class AsyncEngineMixin:
+    """TranslationEngine 的异步孪生接口"""
+
+    # 引擎的 send_request 是否为标准 Bearer JSON POST（可直接走原生异步请求）
+    async_json_api = False
+    # 原生异步路径每个请求携带的条数；None 表示使用 batch_size
+    async_batch_size: Optional[int] = None
+
+    # translate_batch / send_request 是否接受任务级 metrics（EngineMetrics）参数
+    supports_metrics = False
+
+    def _translate_sync(self, texts: List[str], src_lang: str, tgt_lang: str, metrics=None, **options):
+        if hasattr(self, 'translate_batch_with_options'):
+            return _unwrap(self.translate_batch_with_options(texts, src_lang, tgt_lang, **options))
+        if metrics is not None and self.supports_metrics:
+            return _unwrap(self.translate_batch(texts, src_lang, tgt_lang, metrics=metrics))
+        return _unwrap(self.translate_batch(texts, src_lang, tgt_lang))
+
+    async def send_request_async(self, payload: Dict[str, Any], headers: Dict[str, str], metrics=None) -> tuple:
+        """异步发送请求，返回 (response, tokens)，失败返回 (None, 0)；429 次数记入调用方传入的 metrics"""
+        if not self.async_json_api:
+            if metrics is not None and self.supports_metrics:
+                return await asyncio.to_thread(self.send_request, payload, headers, metrics)
+            return await asyncio.to_thread(self.send_request, payload, headers)
+
+        headers = dict(headers or {})
+        headers["Authorization"] = f"Bearer {self.api_key}"
+        retries = max(1, int(getattr(self, 'retry_max', 3) or 1))
+        delay = float(getattr(self, 'retry_delay', 0.7) or 0.7)
+        name = self.__class__.__name__
+        engine_key = getattr(self, 'engine_key', None) or name
+        for attempt in range(retries):
+            try:
+                ticket = await acquire_for_engine_async(self, payload)
+                started = time.monotonic()
+                response = await apost(name, self.api_url, timeout=getattr(self, 'timeout', 60),
+                                       pool_size=getattr(self, 'max_workers', None),
+                                       headers=headers, json=payload)
+                report_response(engine_key, response.status_code, time.monotonic() - started)
+                settle_for_engine(ticket, response)
+            except Exception as e:
+                report_response(engine_key, None, 0.0)
+                logger.warning(f"[{name}] async request failed on attempt {attempt + 1}: {e}")
+                if attempt < retries - 1:
+                    await asyncio.sleep(min(delay * (attempt + 1), 4.0))
+                    continue
+                return None, 0
+            if response.status_code in (429, 502, 503):
+                if response.status_code == 429 and metrics is not None:
+                    metrics.add(throttled=1)
+                if attempt < retries - 1:
+                    wait_time = min(delay * (2 ** attempt), 10.0)
+                    logger.warning(f"[{name}] HTTP {response.status_code}, sleeping {wait_time:.2f}s then retry {attempt + 1}/{retries}")
+                    await asyncio.sleep(wait_time)
+                    continue
+                return None, 0
+            if response.status_code != 200:
+                logger.error(f"[{name}] async request HTTP {response.status_code}: {str(response.text)[:200]}")
+                return None, 0
+            try:
+                tokens = response.json().get("usage", {}).get("total_tokens", 0)
+            except Exception:
+                tokens = 0
+            return response, tokens
+        return None, 0
+
+    async def _process_batch_async(self, texts: List[str], src_lang: str, tgt_lang: str, metrics=None) -> tuple:
+        payload = self.build_payload(texts, src_lang, tgt_lang)
+        response, tokens = await self.send_request_async(payload, self._get_headers(), metrics=metrics)
+        if not response:
+            return [None] * len(texts), 0
+        parsed = self.parse_response(response, len(texts))
+        outputs = []
+        for i in range(len(texts)):
+            out = parsed[i] if isinstance(parsed, list) and i < len(parsed) else None
+            # 缺失/空串记为 None（失败），不以原文冒充译文
+            outputs.append(out if isinstance(out, str) and out.strip() else None)
+        return outputs, tokens
+
+    async def translate_batch_async(self, texts: List[str], src_lang: str, tgt_lang: str,
+                                    concurrency: Optional[int] = None, metrics=None,
+                                    semaphore: Optional[asyncio.Semaphore] = None, **options) -> tuple:
+        """异步批量翻译：按批切分，在同一事件循环中并发发送（受信号量约束），按下标回填；
+        metrics 为调用方的任务级统计对象（引擎实例跨任务共享，统计随调用传递）；
+        semaphore 为调用方共享的在途请求信号量（同一循环上的多次调用共用上限），不传则按 concurrency 新建"""
+        if not texts:
+            return texts, 0
+        if not self.async_json_api or (options and hasattr(self, 'translate_batch_with_options')):
+            # 同步引擎（或需要风格等扩展参数的引擎）：整批在线程中执行，保留其原有分批/重试语义
+            return await asyncio.to_thread(self._translate_sync, texts, src_lang, tgt_lang, metrics, **options)
+
+        size = max(1, int(self.async_batch_size or self.batch_size or 1))
+        sem = semaphore or asyncio.Semaphore(max(1, int(concurrency or ENGINE_ASYNC_CONCURRENCY)))
+
+        async def _one(idxs: List[int]):
+            chunk = [texts[i] for i in idxs]
+            async with sem:
+                try:
+                    return idxs, await self._process_batch_async(chunk, src_lang, tgt_lang, metrics=metrics)
+                except Exception as e:
+                    logger.warning(f"[{self.__class__.__name__}] async batch at {idxs[0]} failed: {e}")
+                    return idxs, ([None] * len(chunk), 0)
+
+        # 按条数上限 + token 预算装箱（与同步路径一致）
+        if hasattr(self, '_pack_batches'):
+            batches = self._pack_batches(texts, max_items=size)
+        else:
+            batches = [list(range(i, min(i + size, len(texts)))) for i in range(0, len(texts), size)]
+        results: List[Optional[str]] = [None] * len(texts)
+        total_tokens = 0
+        for idxs, (outs, tokens) in await asyncio.gather(*[_one(b) for b in batches]):
+            for i, out in zip(idxs, outs):
+                results[i] = out
+            try:
+                total_tokens += int(tokens or 0)
+            except Exception:
+                pass
+        # 失败的下标保持 None，由上层（translate_with_memory）回填原文或交给补救重发
+        return results, total_tokens
+
+
+def _translate_on_loop(texts: List[str], src_lang: str, tgt_lang: str, engine: str, loop,
+                       concurrency: Optional[int] = None, semaphore: Optional[asyncio.Semaphore] = None,
+                       **options) -> tuple:
+    """在调用线程中查翻译记忆，未命中的片段提交到 loop 上异步翻译，返回 (译文列表, tokens)
+
+    调用线程不能是 loop 所在的线程（否则等待结果会阻塞循环本身）。
+    """
+    from .utils_translator import TranslationEngineFactory
+    from .translation_memory import translate_with_memory
+
+    user_id = options.pop('user_id', None)
+    terminology_version = options.pop('terminology_version', None)
+    metrics = options.pop('metrics', None)
+    report_failures = bool(options.pop('report_failures', False))
+    translator = TranslationEngineFactory.create_engine(engine)
+
+    def _run(batch_texts):
+        future = asyncio.run_coroutine_threadsafe(
+            translator.translate_batch_async(batch_texts, src_lang, tgt_lang, concurrency=concurrency,
+                                             metrics=metrics, semaphore=semaphore, **options), loop
+        )
+        return future.result()
+
+    return translate_with_memory(
+        texts, src_lang, tgt_lang, engine, _run,
+        model=getattr(translator, 'model', None), options=options,
+        user_id=user_id, terminology_version=terminology_version, report_failures=report_failures,
+    )
+
+
+async def translate_batch_async(texts: List[str], src_lang: str = 'auto', tgt_lang: str = 'ja', engine: str = 'deepseek',
+                                concurrency: Optional[int] = None, **options) -> tuple:
+    """模块级异步批量翻译（含翻译记忆），返回 (译文列表, tokens)"""
+    loop = asyncio.get_running_loop()
+    # 翻译记忆是同步的数据库访问：在工作线程中执行，引擎请求回调本事件循环
+    return await asyncio.to_thread(_translate_on_loop, texts, src_lang, tgt_lang, engine, loop,
+                                   concurrency=concurrency, **options)
+
+
+class AsyncTranslateLoop:
+    """长生命周期的事件循环（独立线程）：一个任务的所有批次都提交到这里
+
+    同一循环上的批次共用一个异步客户端（连接复用）和一个在途请求信号量（ENGINE_ASYNC_CONCURRENCY），
+    调用方在各自线程中同步等待结果；用完调用 close() 关闭客户端并停止循环。
+    """
+
+    def __init__(self, concurrency: Optional[int] = None):
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="engine-async-loop", daemon=True)
+        self._thread.start()
+        limit = max(1, int(concurrency or ENGINE_ASYNC_CONCURRENCY))
+
+        async def _make_semaphore():
+            # 在循环内创建，绑定到该循环
+            return asyncio.Semaphore(limit)
+
+        self._semaphore = asyncio.run_coroutine_threadsafe(_make_semaphore(), self._loop).result()
+
+    def translate(self, texts: List[str], src_lang: str, tgt_lang: str, engine: str,
+                  usage=None, **options) -> List[Optional[str]]:
+        """同步提交一组片段并等待结果；usage 为 UsageCollector 时记录 tokens"""
+        if not texts:
+            return []
+        outputs, tokens = _translate_on_loop(texts, src_lang, tgt_lang, engine, self._loop,
+                                             semaphore=self._semaphore, **options)
+        if usage is not None:
+            usage.add(tokens)
+        return list(outputs)
+
+    def close(self):
+        if self._loop.is_closed():
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(aclose_client(), self._loop).result()
+        except Exception as e:
+            logger.warning(f"[AsyncTranslateLoop] close client failed: {e}")
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+def run_translate_async(texts: List[str], src_lang: str, tgt_lang: str, engine: str,
+                        concurrency: Optional[int] = None, usage=None, **options) -> List[str]:
+    """同步入口：在临时事件循环中翻译一组片段，调用结束即关闭循环与客户端；usage 为 UsageCollector 时记录 tokens
+
+    多次调用之间不复用连接，整篇文档的批次应提交到同一个 AsyncTranslateLoop（见 SegmentPipeline）。
+    """
+    if not texts:
+        return []
+    # 循环运行在独立线程中，调用方是否已处于事件循环内都可以直接等待
+    with AsyncTranslateLoop(concurrency) as runner:
+        return runner.translate(texts, src_lang, tgt_lang, engine, usage=usage, **options)
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+批次粒度的工作调度：进程级常驻线程池 + 共享工作队列（工作窃取）
+
+之前每次并行翻译都新建并销毁一个 ThreadPoolExecutor，且按 len(texts)//workers 切成几大块，
+每块再由引擎串行地按 batch_size 逐批请求——线程数再多也只有几条长的串行链。这里：
+- 先按引擎批次大小切好批次（cut_batches，元素为原文下标），放入同一个队列
+- 调用线程与最多 workers-1 个常驻线程从队列中各自取下一批（谁空闲谁取，快的线程多做）
+- 结果按下标写回，失败的批次只影响自己的下标，不会造成后续译文错位
+- 线程池进程内常驻复用（fork 后的子进程重新创建），不再按调用创建/销毁
+
+调用线程始终参与处理，且队列取空后会取消尚未启动的辅助任务，因此在常驻线程内嵌套调用
+（如流水线批次内再按装箱结果分批）也不会因线程池占满而死锁。
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, List, Optional, Sequence
+
+BATCH_EXECUTOR_WORKERS = int(os.getenv("BATCH_EXECUTOR_WORKERS", "32"))
+
+_lock = threading.Lock()
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_pid: Optional[int] = None
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """进程级常驻线程池（惰性创建；fork 后在子进程中重新创建）"""
+    global _executor, _executor_pid
+    with _lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(max_workers=max(1, BATCH_EXECUTOR_WORKERS), thread_name_prefix="batch-worker")
+            _executor_pid = os.getpid()
+        return _executor
+
+
+def cut_batches(n: int, batch_size: int) -> List[List[int]]:
+    """把 0..n-1 按 batch_size 切成下标批次"""
+    size = max(1, int(batch_size))
+    return [list(range(i, min(i + size, n))) for i in range(0, n, size)]
+
+
+def run_work_queue(items: Sequence[Any], fn: Callable[[Any], Any], workers: int,
+                   acquire: Optional[Callable[[float], bool]] = None,
+                   release: Optional[Callable[[], None]] = None) -> List[Any]:
+    """对 items 逐项执行 fn（共享队列、工作窃取），结果按下标返回
+
+    - 调用线程直接参与处理；额外最多 workers-1 个辅助任务提交到常驻线程池
+    - 传入 acquire/release 时，辅助任务每处理一项前先获取名额（如引擎并发控制器），
+      调用线程视为已持有名额
+    - 任一项抛异常后不再领取新项，全部结束后抛出第一个异常
+    """
+    n = len(items)
+    results: List[Any] = [None] * n
+    if n == 0:
+        return results
+    state = {"next": 0, "error": None}
+    state_lock = threading.Lock()
+
+    def _take() -> int:
+        with state_lock:
+            if state["error"] is not None or state["next"] >= n:
+                return -1
+            i = state["next"]
+            state["next"] += 1
+            return i
+
+    def _run(i: int):
+        try:
+            results[i] = fn(items[i])
+        except Exception as e:
+            with state_lock:
+                if state["error"] is None:
+                    state["error"] = e
+
+    def _helper():
+        while state["next"] < n and state["error"] is None:
+            if acquire is not None and not acquire(1.0):
+                continue
+            try:
+                i = _take()
+                if i < 0:
+                    return
+                _run(i)
+            finally:
+                if release is not None:
+                    release()
+
+    helpers = min(max(1, int(workers)), n) - 1
+    executor = get_executor() if helpers > 0 else None
+    futures = [executor.submit(_helper) for _ in range(helpers)] if executor else []
+    while True:
+        i = _take()
+        if i < 0:
+            break
+        _run(i)
+    for f in futures:
+        # 队列已取空：未启动的辅助任务直接取消，只等待正在处理的
+        if not f.cancel():
+            f.result()
+    if state["error"] is not None:
+        raise state["error"]
+    return results
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""
+按引擎的自适应并发控制（AIMD）
+
+每个引擎一个控制器，维护“允许的在途批次数” limit：
+- 加性增：并发已用满、响应成功且延迟未明显高于基线时，每完成约 limit 个请求 limit += 1
+- 乘性减：出现 429/503 或延迟超过基线 ADAPTIVE_LATENCY_TOLERANCE 倍时 limit *= ADAPTIVE_BACKOFF
+  （两次减小之间至少间隔 ADAPTIVE_DECREASE_COOLDOWN 秒，避免同一波限流被重复计数）
+
+文档翻译的并行入口（SegmentPipeline / parallel_translate / Qwen3 逐条请求）
+通过 controller.slot() 获取并发名额；引擎 _post 在每次 HTTP 响应后调用 on_response 反馈。
+初始并发取引擎配置 max_workers，上限取 api_config.max_concurrency 或 ADAPTIVE_CONCURRENCY_MAX。
+"""
+import os
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional
+
+from .batch_scheduler import run_work_queue
+
+logger = logging.getLogger(__name__)
+
+ADAPTIVE_CONCURRENCY_ENABLED = os.getenv("ADAPTIVE_CONCURRENCY_ENABLED", "true").strip().lower() in ("1", "true", "yes", "on")
+ADAPTIVE_CONCURRENCY_MIN = int(os.getenv("ADAPTIVE_CONCURRENCY_MIN", "1"))
+ADAPTIVE_CONCURRENCY_MAX = int(os.getenv("ADAPTIVE_CONCURRENCY_MAX", "32"))
+ADAPTIVE_BACKOFF = float(os.getenv("ADAPTIVE_BACKOFF", "0.5"))
+ADAPTIVE_LATENCY_TOLERANCE = float(os.getenv("ADAPTIVE_LATENCY_TOLERANCE", "2.0"))
+ADAPTIVE_DECREASE_COOLDOWN = float(os.getenv("ADAPTIVE_DECREASE_COOLDOWN", "2.0"))
+# 延迟基线的 EWMA 系数与最少样本数
+_BASELINE_ALPHA = 0.05
+_MIN_SAMPLES = 5
+
+# 引擎名别名（与 EngineConfig.get_engine_config 一致）
+_ALIASES = {'qwen': 'qwen3', 'qwen_mt': 'qwen3', 'qwen_plus': 'qwen_plus'}
+
+# 记录当前线程持有名额的引擎（用于嵌套调用时复用外层名额）
+_held = threading.local()
+
+
+def normalize_engine_name(engine: str) -> str:
+    name = (engine or 'deepseek').lower().replace('-', '_')
+    return _ALIASES.get(name, name)
+
+
+class AdaptiveConcurrency:
+    """单个引擎的 AIMD 并发控制器（线程安全）"""
+
+    def __init__(self, name: str, initial: int, min_limit: int, max_limit: int):
+        self.name = name
+        self.min_limit = max(1, int(min_limit))
+        self.max_limit = max(self.min_limit, int(max_limit))
+        self._limit = float(min(max(int(initial), self.min_limit), self.max_limit))
+        self._in_flight = 0
+        self._cond = threading.Condition()
+        self._baseline: Optional[float] = None
+        self._samples = 0
+        self._last_decrease = 0.0
+        self._stats = {"increases": 0, "decreases": 0, "throttled": 0, "slow": 0, "peak_in_flight": 0}
+
+    @property
+    def limit(self) -> int:
+        return max(self.min_limit, int(self._limit))
+
+    def acquire(self, timeout: Optional[float] = None) -> bool:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._in_flight >= self.limit:
+                remaining = 0.5 if deadline is None else min(0.5, deadline - time.monotonic())
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            self._in_flight += 1
+            if self._in_flight > self._stats["peak_in_flight"]:
+                self._stats["peak_in_flight"] = self._in_flight
+        _held.names = getattr(_held, 'names', ()) + (self.name,)
+        return True
+
+    def release(self):
+        names = list(getattr(_held, 'names', ()))
+        if self.name in names:
+            names.remove(self.name)
+            _held.names = tuple(names)
+        with self._cond:
+            self._in_flight = max(0, self._in_flight - 1)
+            self._cond.notify()
+
+    def holding(self) -> bool:
+        """当前线程是否已持有该引擎的并发名额"""
+        return self.name in getattr(_held, 'names', ())
+
+    @contextmanager
+    def slot(self):
+        self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    @property
+    def baseline_latency(self) -> Optional[float]:
+        """成功响应的延迟基线（EWMA，秒）；尚无样本时为 None"""
+        return self._baseline
+
+    def run_items(self, fn: Callable[[Any], Any], items: List[Any], max_workers: Optional[int] = None) -> List[Any]:
+        """按控制器并发对 items 逐项执行 fn，结果按下标返回
+
+        调用线程始终参与处理（使用已持有或新获取的名额），额外的工作线程来自进程级常驻线程池，
+        只在获得空闲名额后才领取下一项，因此在外层已持有名额时嵌套调用也不会死锁。
+        max_workers 为本次调用的在途上限（不超过控制器上限）。
+        """
+        helpers = min(self.max_limit, len(items))
+        if max_workers:
+            helpers = min(helpers, max(1, int(max_workers)))
+        if self.holding():
+            return run_work_queue(items, fn, helpers, acquire=self.acquire, release=self.release)
+        with self.slot():
+            return run_work_queue(items, fn, helpers, acquire=self.acquire, release=self.release)
+
+    def _decrease(self, reason: str):
+        now = time.monotonic()
+        if now - self._last_decrease < ADAPTIVE_DECREASE_COOLDOWN:
+            return
+        self._last_decrease = now
+        old = self.limit
+        self._limit = max(float(self.min_limit), self._limit * ADAPTIVE_BACKOFF)
+        self._stats["decreases"] += 1
+        if self.limit != old:
+            logger.info(f"[AdaptiveConcurrency] {self.name}: {reason}, limit {old} -> {self.limit}")
+
+    def on_response(self, status_code: Optional[int], latency: float):
+        """HTTP 响应反馈：status_code 为 None 表示网络异常"""
+        if not ADAPTIVE_CONCURRENCY_ENABLED:
+            return
+        with self._cond:
+            if status_code in (429, 503):
+                self._stats["throttled"] += 1
+                self._decrease(f"HTTP {status_code}")
+                return
+            if status_code is None or status_code >= 400:
+                return
+
+            baseline = self._baseline
+            self._samples += 1
+            if baseline is None:
+                self._baseline = latency
+                return
+            if self._samples >= _MIN_SAMPLES and latency > baseline * ADAPTIVE_LATENCY_TOLERANCE:
+                self._stats["slow"] += 1
+                self._decrease(f"latency {latency:.2f}s > {ADAPTIVE_LATENCY_TOLERANCE}x baseline {baseline:.2f}s")
+            else:
+                # 只有并发被用满时才增长，避免空闲时 limit 无限上涨
+                if self._in_flight >= self.limit - 1 and self._limit < self.max_limit:
+                    old = self.limit
+                    self._limit = min(float(self.max_limit), self._limit + 1.0 / max(self._limit, 1.0))
+                    if self.limit != old:
+                        self._stats["increases"] += 1
+                        self._cond.notify_all()
+            self._baseline = baseline * (1 - _BASELINE_ALPHA) + latency * _BASELINE_ALPHA
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "limit": self.limit,
+                "min": self.min_limit,
+                "max": self.max_limit,
+                "in_flight": self._in_flight,
+                "baseline_latency": round(self._baseline, 3) if self._baseline is not None else None,
+                **self._stats,
+            }
+
+
+_controllers: Dict[str, AdaptiveConcurrency] = {}
+_lock = threading.Lock()
+
+
+def _limits_from_config(name: str, initial: Optional[int]) -> tuple:
+    from .engine_config import EngineConfig
+    try:
+        cfg = EngineConfig.get_engine_config(name)
+    except ValueError:
+        cfg = {}
+    start = initial or cfg.get('max_workers') or 5
+    try:
+        upper = int(cfg.get('max_concurrency') or ADAPTIVE_CONCURRENCY_MAX)
+    except (ValueError, TypeError):
+        upper = ADAPTIVE_CONCURRENCY_MAX
+    if not ADAPTIVE_CONCURRENCY_ENABLED:
+        # 关闭自适应时退化为固定并发
+        return int(start), int(start), int(start)
+    return int(start), ADAPTIVE_CONCURRENCY_MIN, max(upper, int(start))
+
+
+def get_controller(engine: str, initial: Optional[int] = None) -> AdaptiveConcurrency:
+    """获取引擎的并发控制器；initial 仅在首次创建时作为初始并发"""
+    name = normalize_engine_name(engine)
+    controller = _controllers.get(name)
+    if controller is not None:
+        return controller
+    with _lock:
+        controller = _controllers.get(name)
+        if controller is None:
+            start, lo, hi = _limits_from_config(name, initial)
+            controller = AdaptiveConcurrency(name, start, lo, hi)
+            _controllers[name] = controller
+            logger.info(f"[AdaptiveConcurrency] {name}: initial={controller.limit} range=[{lo}, {hi}]")
+    return controller
+
+
+def report_response(engine: str, status_code: Optional[int], latency: float):
+    """引擎请求完成后的反馈入口"""
+    try:
+        get_controller(engine).on_response(status_code, latency)
+    except Exception:
+        pass
+
+
+def get_concurrency_stats() -> Dict[str, Any]:
+    return {
+        "enabled": ADAPTIVE_CONCURRENCY_ENABLED,
+        "engines": {name: c.get_stats() for name, c in list(_controllers.items())},
+    }
+
+
+def reset_controllers():
+    """丢弃全部控制器（引擎配置变更后调用，下次获取时按新配置重建）"""
+    with _lock:
+        _controllers.clear()
@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+"""
+DOCX 段落级分段：把一个 w:p 内的各个 run 合并为一个片段，格式边界用紧凑的行内标记表示
+
+Word 会把一句话拆成很多 run（拼写检查 proofErr、修订 rsid、格式变化），逐个 w:t 翻译时
+一句话常被切成 5~20 个碎片，每个碎片都有提示词开销且没有上下文。这里：
+- 段落内相邻、格式（rPr）相同、所在容器相同且中间没有硬边界（制表符、换行、域、图形等）的
+  w:t 无损合并为一个 span；proofErr / 书签等零宽标记不构成边界
+- 只有一个 span 时片段就是纯文本；多个 span 时写成 [r1]..[/r1][r2]..[/r2]（与引擎提示词中
+  “保留 [b]/[/b] 等格式标记”的约定一致）
+- 回写时按标记把译文分配回各 span：写入 span 的第一个 w:t，其余 w:t 置空
+- 并非所有引擎都会保留标记：repair_markers 作为 SegmentPipeline 的 repair 钩子，只把标记丢失/错乱的
+  片段合并重发（DOCX_MARKER_RETRIES 轮），仍失败的逐 span 翻译后按原标记拼装，避免文字跨过
+  制表符、换行等边界挪到别的 span；apply 时标记仍不可用才去掉标记整段写入第一个 span（保证不丢译文）
+
+原文中本身含有 [rN] 形式文本的段落，以及关闭段落分段时（DOCX_PARAGRAPH_SEGMENTS=false），
+退回逐个 w:t 的旧分段方式。
+"""
+import os
+import re
+import logging
+from typing import Callable, List, Optional, Sequence
+
+from lxml import etree as ET
+
+logger = logging.getLogger(__name__)
+
+W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+XML_SPACE = "{http://www.w3.org/XML/1998/namespace}space"
+
+DOCX_PARAGRAPH_SEGMENTS = os.getenv("DOCX_PARAGRAPH_SEGMENTS", "true").strip().lower() in ("1", "true", "yes", "on")
+# 标记丢失的片段整段重发的轮数，之后改为逐 span 翻译
+DOCX_MARKER_RETRIES = int(os.getenv("DOCX_MARKER_RETRIES", "1"))
+
+# 段落/容器内可跨越的零宽标记
+_ZERO_WIDTH = {W + "proofErr", W + "bookmarkStart", W + "bookmarkEnd", W + "permStart", W + "permEnd", W + "pPr"}
+# run 内不构成边界的子元素
+_RUN_NEUTRAL = {W + "rPr", W + "lastRenderedPageBreak"}
+# 其中的 run 仍属于本段落的容器
+_CONTAINERS = {
+    W + "hyperlink", W + "ins", W + "smartTag", W + "sdt", W + "sdtContent", W + "customXml",
+    W + "fldSimple", W + "moveTo", W + "dir", W + "bdo",
+}
+
+_TAG_RE = re.compile(r"\[r(\d+)\](.*?)\[/r\1\]", re.S)
+_ANY_TAG_RE = re.compile(r"\[/?r\d+\]")
+
+
+class TextNodeSegment:
+    """旧方式：单个 w:t 作为一个片段"""
+
+    __slots__ = ("node", "text", "plain")
+
+    def __init__(self, node):
+        self.node = node
+        self.text = node.text
+        self.plain = node.text
+
+    def apply(self, translated: Optional[str]):
+        if translated is not None:
+            self.node.text = translated
+
+
+class _Span:
+    __slots__ = ("key", "nodes")
+
+    def __init__(self, key):
+        self.key = key
+        self.nodes = []
+
+    @property
+    def text(self) -> str:
+        return "".join(n.text or "" for n in self.nodes)
+
+    def set_text(self, value: str):
+        first = self.nodes[0]
+        first.text = value
+        if value != value.strip():
+            first.set(XML_SPACE, "preserve")
+        for n in self.nodes[1:]:
+            n.text = ""
+
+
+class ParagraphSegment:
+    """段落级片段：text 为发送给引擎的文本（多 span 时带 [rN] 标记），plain 为纯文本"""
+
+    __slots__ = ("spans", "text", "plain")
+
+    def __init__(self, spans: List[_Span]):
+        self.spans = [s for s in spans if s.text]
+        if len(self.spans) == 1:
+            self.text = self.spans[0].text
+        else:
+            self.text = "".join(f"[r{i}]{s.text}[/r{i}]" for i, s in enumerate(self.spans, 1))
+        self.plain = "".join(s.text for s in self.spans)
+
+    def apply(self, translated: Optional[str]):
+        if translated is None or translated == self.text:
+            return
+        if len(self.spans) == 1:
+            self.spans[0].set_text(translated)
+            return
+        parts = self._split(translated)
+        if parts is None:
+            # 标记缺失/错乱：去掉标记，整段写入第一个 span
+            plain = _ANY_TAG_RE.sub("", translated)
+            self.spans[0].set_text(plain)
+            for s in self.spans[1:]:
+                s.set_text("")
+            return
+        for span, value in zip(self.spans, parts):
+            span.set_text(value)
+
+    def _split(self, translated: str) -> Optional[List[str]]:
+        return _split_tagged([s.text for s in self.spans], translated)
+
+
+def _split_tagged(spans: Sequence[str], translated: str) -> Optional[List[str]]:
+    """按 [rN] 标记把译文切回各 span（spans 为各 span 原文）；标记缺失或错乱时返回 None"""
+    n = len(spans)
+    parts = {}
+    lead = ""
+    last = None
+    pos = 0
+    for m in _TAG_RE.finditer(translated):
+        gap = translated[pos:m.start()]
+        if gap:
+            if last is None:
+                lead += gap
+            else:
+                parts[last] += gap
+        idx = int(m.group(1))
+        if idx < 1 or idx > n or idx in parts:
+            return None
+        parts[idx] = m.group(2)
+        last = idx
+        pos = m.end()
+    if last is None:
+        return None
+    tail = translated[pos:]
+    if tail:
+        parts[last] += tail
+    if lead:
+        first = min(parts)
+        parts[first] = lead + parts[first]
+    out = []
+    for i, span in enumerate(spans, 1):
+        if i in parts:
+            value = parts[i]
+            if _ANY_TAG_RE.search(value):
+                return None
+            out.append(value)
+        elif not span.strip():
+            # 仅含空白的 span 被引擎丢弃时置空即可
+            out.append("")
+        else:
+            return None
+    return out
+
+
+def _source_spans(text: str) -> Optional[List[str]]:
+    """带 [rN] 标记的段落片段 -> 各 span 原文；不是多 span 片段时返回 None"""
+    if not isinstance(text, str):
+        return None
+    spans = [m.group(2) for m in _TAG_RE.finditer(text)]
+    if len(spans) < 2 or _TAG_RE.sub("", text):
+        return None
+    return spans
+
+
+def markers_intact(text: str, translated) -> bool:
+    """译文能否按原片段的 [rN] 标记切回各 span（非标记片段、失败的 None 视为无需修复）"""
+    spans = _source_spans(text)
+    if spans is None or not isinstance(translated, str):
+        return True
+    return _split_tagged(spans, translated) is not None
+
+
+def repair_markers(processed: List[str], outputs: List, translate: Callable[..., Sequence],
+                   retries: Optional[int] = None) -> List:
+    """SegmentPipeline 的 repair 钩子：只重发标记丢失的段落片段，仍失败的逐 span 翻译后按原标记拼装"""
+    outputs = list(outputs)
+    pending = [i for i in range(min(len(processed), len(outputs))) if not markers_intact(processed[i], outputs[i])]
+    if not pending:
+        return outputs
+    lost = len(pending)
+    rounds = DOCX_MARKER_RETRIES if retries is None else retries
+    for _ in range(max(0, rounds)):
+        if not pending:
+            break
+        try:
+            retried = list(translate([processed[i] for i in pending]) or [])
+        except Exception as e:
+            logger.warning(f"[DOCX] marker repair batch failed: {e}")
+            break
+        still = []
+        for j, i in enumerate(pending):
+            out = retried[j] if j < len(retried) else None
+            if isinstance(out, str) and out.strip() and markers_intact(processed[i], out):
+                outputs[i] = out
+            else:
+                still.append(i)
+        pending = still
+    if pending:
+        # 逐 span 翻译（不带标记）：每段文字留在自己的 span 里，不会跨过制表符/换行等边界
+        jobs = [(i, _source_spans(processed[i])) for i in pending]
+        flat = [span for _, spans in jobs for span in spans if span.strip()]
+        try:
+            translated = list(translate(flat) or []) if flat else []
+        except Exception as e:
+            logger.warning(f"[DOCX] per-span marker fallback failed: {e}")
+            translated = []
+        k = 0
+        for i, spans in jobs:
+            parts = []
+            for span in spans:
+                if span.strip():
+                    out = translated[k] if k < len(translated) else None
+                    k += 1
+                    parts.append(_ANY_TAG_RE.sub("", out) if isinstance(out, str) and out.strip() else span)
+                else:
+                    parts.append(span)
+            outputs[i] = "".join(f"[r{n}]{v}[/r{n}]" for n, v in enumerate(parts, 1))
+    logger.info(f"[DOCX] run markers lost in {lost} segments, {lost - len(pending)} fixed by resend, "
+                f"{len(pending)} translated span by span")
+    return outputs
+
+
+def _collect_events(el, events: list):
+    """按文档顺序收集段落内的文本节点与硬边界（不进入嵌套段落/图形）"""
+    for child in el:
+        tag = child.tag
+        if not isinstance(tag, str):
+            continue
+        if tag == W + "r":
+            for rc in child:
+                rtag = rc.tag
+                if not isinstance(rtag, str) or rtag in _RUN_NEUTRAL:
+                    continue
+                if rtag == W + "t":
+                    events.append((rc, child))
+                else:
+                    events.append(None)
+        elif tag in _ZERO_WIDTH:
+            continue
+        elif tag in _CONTAINERS:
+            events.append(None)
+            _collect_events(child, events)
+            events.append(None)
+        else:
+            events.append(None)
+
+
+def _paragraph_spans(p) -> List[_Span]:
+    events: list = []
+    _collect_events(p, events)
+    spans: List[_Span] = []
+    current: Optional[_Span] = None
+    for ev in events:
+        if ev is None:
+            current = None
+            continue
+        node, run = ev
+        parent = run.getparent()
+        rpr = run.find(W + "rPr")
+        fmt = ET.tostring(rpr) if rpr is not None else b""
+        # 键中保留容器元素本身（按身份比较），相同格式但不同容器（如超链接内外）不合并
+        if current is None or current.key[0] is not parent or current.key[1] != fmt:
+            current = _Span((parent, fmt))
+            spans.append(current)
+        current.nodes.append(node)
+    return spans
+
+
+def segment_part(root, paragraph_mode: Optional[bool] = None) -> list:
+    """把部件切分为片段单元（按文档顺序）；每个单元有 text / plain / apply(translated)"""
+    if paragraph_mode is None:
+        paragraph_mode = DOCX_PARAGRAPH_SEGMENTS
+    if not paragraph_mode:
+        return [TextNodeSegment(t) for t in root.iter(W + "t")]
+
+    units = []
+    covered = set()
+    for p in root.iter(W + "p"):
+        spans = _paragraph_spans(p)
+        if not spans:
+            continue
+        for span in spans:
+            covered.update(span.nodes)
+        if any(_ANY_TAG_RE.search(n.text or "") for s in spans for n in s.nodes):
+            # 原文自带 [rN] 形式文本，避免与标记混淆：逐节点分段
+            units.extend(TextNodeSegment(n) for s in spans for n in s.nodes)
+            continue
+        seg = ParagraphSegment(spans)
+        if seg.spans:
+            units.append(seg)
+    # 不在段落结构内（或位于未识别容器中）的 w:t 仍逐节点处理
+    for t in root.iter(W + "t"):
+        if t not in covered:
+            units.append(TextNodeSegment(t))
+    return units
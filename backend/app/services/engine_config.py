@@ -3,6 +3,8 @@
 多AI引擎配置文件
 """
 import os
+import time
+import threading
 from typing import Dict, Any
 try:
     from ..database import SessionLocal
@@ -11,16 +13,50 @@ except Exception:
     SessionLocal = None
     models = None
 
+# 数据库中的引擎配置缓存（进程内）。管理端修改引擎后会立即失效本进程缓存；
+# 其他进程（Celery worker 等）在 TTL 到期后重新读取。
+ENGINE_CONFIG_CACHE_TTL_SECONDS = int(os.getenv("ENGINE_CONFIG_CACHE_TTL_SECONDS", "30"))
+
+_db_config_cache: Dict[tuple, Dict[str, Any]] = {}
+_db_config_lock = threading.Lock()
+_config_version = 0
+
+
 class EngineConfig:
     """AI引擎配置管理类"""
     
     @staticmethod
-    def _get_config_from_db(engine_names: list, defaults: dict) -> dict:
-        """从数据库加载配置并与默认值合并"""
-        cfg = defaults.copy()
+    def invalidate_cache():
+        """清空引擎配置缓存并递增配置版本（引擎表被修改后调用）"""
+        global _config_version
+        with _db_config_lock:
+            _db_config_cache.clear()
+            _config_version += 1
+        try:
+            from .engine_pool import clear_pool
+            from .concurrency_controller import reset_controllers
+            clear_pool()
+            reset_controllers()
+        except Exception:
+            pass
+
+    @staticmethod
+    def get_config_version() -> int:
+        return _config_version
+
+    @staticmethod
+    def _load_db_entry(engine_names: list) -> Dict[str, Any]:
+        """读取数据库中的引擎行（带 TTL 缓存），返回 {"api_config": 字典, "rate_limit": 每分钟请求数}"""
+        key = tuple(engine_names)
+        now = time.time()
+        entry = _db_config_cache.get(key)
+        if entry and entry["expire"] > now:
+            return entry
+
+        api_conf: Dict[str, Any] = {}
+        rate_limit = None
         if not (SessionLocal and models):
-            return cfg
-        
+            return {"api_config": api_conf, "rate_limit": rate_limit}
         db = None
         try:
             db = SessionLocal()
@@ -30,27 +66,49 @@ class EngineConfig:
                 .first()
             )
             if engine and isinstance(engine.api_config, dict):
-                api_conf = engine.api_config
-                # 合并配置，数据库中的值优先
-                for key, value in api_conf.items():
-                    if value is not None:
-                        # 类型转换以确保安全
-                        if key in cfg and isinstance(cfg[key], int):
-                            try: cfg[key] = int(value)
-                            except (ValueError, TypeError): pass
-                        elif key in cfg and isinstance(cfg[key], float):
-                            try: cfg[key] = float(value)
-                            except (ValueError, TypeError): pass
-                        elif key in cfg and isinstance(cfg[key], bool):
-                            cfg[key] = str(value).lower() in ('true', '1', 'yes')
-                        else:
-                            cfg[key] = value
+                api_conf = dict(engine.api_config)
+            if engine is not None:
+                rate_limit = getattr(engine, 'rate_limit', None)
         except Exception as e:
-            # 在日志中记录错误会更好，但这里保持静默失败
+            # 在日志中记录错误会更好，但这里保持静默失败；失败结果不缓存
             print(f"Error reading engine config from DB: {e}")
+            return {"api_config": api_conf, "rate_limit": rate_limit}
         finally:
             if db:
                 db.close()
+
+        entry = {"expire": now + ENGINE_CONFIG_CACHE_TTL_SECONDS, "api_config": api_conf, "rate_limit": rate_limit}
+        with _db_config_lock:
+            _db_config_cache[key] = entry
+        return entry
+
+    @staticmethod
+    def _load_db_overrides(engine_names: list) -> Dict[str, Any]:
+        """读取数据库中的 api_config（带 TTL 缓存），返回原始字典"""
+        return EngineConfig._load_db_entry(engine_names)["api_config"]
+
+    @staticmethod
+    def _get_config_from_db(engine_names: list, defaults: dict) -> dict:
+        """从数据库加载配置并与默认值合并"""
+        cfg = defaults.copy()
+        if not (SessionLocal and models):
+            return cfg
+        
+        api_conf = EngineConfig._load_db_overrides(engine_names)
+        # 合并配置，数据库中的值优先
+        for key, value in api_conf.items():
+            if value is not None:
+                # 类型转换以确保安全
+                if key in cfg and isinstance(cfg[key], int):
+                    try: cfg[key] = int(value)
+                    except (ValueError, TypeError): pass
+                elif key in cfg and isinstance(cfg[key], float):
+                    try: cfg[key] = float(value)
+                    except (ValueError, TypeError): pass
+                elif key in cfg and isinstance(cfg[key], bool):
+                    cfg[key] = str(value).lower() in ('true', '1', 'yes')
+                else:
+                    cfg[key] = value
         return cfg
 
     @staticmethod
@@ -180,7 +238,100 @@ class EngineConfig:
         if engine_func:
             return engine_func()
         raise ValueError(f"Unsupported engine: {engine_name}")
-    
+
+    # 各引擎的批次 token 预算默认值：max_items 为条数上限（0 表示只用 batch_size），
+    # max_input_tokens / max_output_tokens 为每个请求的输入 / 输出预算（0 表示不限），
+    # 输出预算需低于请求中的 max_tokens（Kimi/DeepSeek 文本模式为 4000）
+    _BATCH_LIMIT_DEFAULTS = {
+        'deepseek': {'max_items': 0, 'max_input_tokens': 6000, 'max_output_tokens': 3500, 'output_ratio': 1.3, 'prompt_overhead': 300},
+        'kimi': {'max_items': 8, 'max_input_tokens': 4000, 'max_output_tokens': 3200, 'output_ratio': 1.3, 'prompt_overhead': 200},
+        'qwen3': {'max_items': 1, 'max_input_tokens': 0, 'max_output_tokens': 0, 'output_ratio': 1.3, 'prompt_overhead': 0},
+        'qwen_plus': {'max_items': 0, 'max_input_tokens': 6000, 'max_output_tokens': 3500, 'output_ratio': 1.3, 'prompt_overhead': 300},
+        'tencent': {'max_items': 0, 'max_input_tokens': 0, 'max_output_tokens': 0, 'output_ratio': 1.0, 'prompt_overhead': 0},
+        'youdao': {'max_items': 0, 'max_input_tokens': 0, 'max_output_tokens': 0, 'output_ratio': 1.0, 'prompt_overhead': 0},
+    }
+
+    @staticmethod
+    def get_batch_limits(engine_name: str) -> Dict[str, Any]:
+        """获取引擎批次装箱预算（用于 batch_packer.pack_for_engine）
+
+        覆盖优先级：环境变量 <ENGINE>_MAX_BATCH_ITEMS / _MAX_BATCH_INPUT_TOKENS / _MAX_BATCH_OUTPUT_TOKENS /
+        _BATCH_OUTPUT_RATIO / _BATCH_SORT_BY_LENGTH > api_config 中的同名小写键（max_batch_items 等）> 默认值
+        """
+        name = (engine_name or '').lower().replace('-', '_')
+        if name in ('qwen', 'qwen_mt'):
+            name = 'qwen3'
+        limits = dict(EngineConfig._BATCH_LIMIT_DEFAULTS.get(name, {
+            'max_items': 0, 'max_input_tokens': 0, 'max_output_tokens': 0, 'output_ratio': 1.3, 'prompt_overhead': 0,
+        }))
+        limits['sort_by_length'] = True
+        names = EngineConfig._RATE_LIMIT_DB_NAMES.get(name, [name])
+        api_conf = EngineConfig._load_db_entry(names).get("api_config") or {}
+
+        overrides = {
+            'max_items': 'max_batch_items',
+            'max_input_tokens': 'max_batch_input_tokens',
+            'max_output_tokens': 'max_batch_output_tokens',
+            'output_ratio': 'batch_output_ratio',
+            'sort_by_length': 'batch_sort_by_length',
+        }
+        prefix = name.upper()
+        for key, conf_key in overrides.items():
+            value = os.getenv(f"{prefix}_{conf_key.upper()}")
+            if value in (None, ''):
+                value = api_conf.get(conf_key)
+            if value in (None, ''):
+                continue
+            try:
+                if key == 'sort_by_length':
+                    limits[key] = str(value).lower() in ('true', '1', 'yes')
+                elif key == 'output_ratio':
+                    limits[key] = float(value)
+                else:
+                    limits[key] = max(0, int(value))
+            except (ValueError, TypeError):
+                pass
+        return limits
+
+    # 限流额度查询时使用的数据库引擎名（与各 get_*_config 保持一致）
+    _RATE_LIMIT_DB_NAMES = {
+        'deepseek': ['deepseek'],
+        'tencent': ['tencent'],
+        'kimi': ['kimi'],
+        'youdao': ['youdao'],
+        'qwen3': ['qwen3', 'qwen', 'qwen-mt'],
+        'qwen_plus': ['qwen_plus', 'qwen-plus'],
+        'chatgpt': ['chatgpt', 'openai'],
+        'gemini': ['gemini', 'google'],
+    }
+
+    @staticmethod
+    def get_rate_limits(engine_name: str) -> tuple:
+        """获取引擎限流额度 (rpm, tpm)，0 表示不限制
+
+        优先级：环境变量 <ENGINE>_RPM / <ENGINE>_TPM > api_config 中的 rpm / tokens_per_minute
+        > translation_engines.rate_limit 列（每分钟请求数）
+        """
+        name = (engine_name or '').lower().replace('-', '_')
+        names = EngineConfig._RATE_LIMIT_DB_NAMES.get(name, [name])
+        entry = EngineConfig._load_db_entry(names)
+        api_conf = entry.get("api_config") or {}
+
+        def _pick(env_key, conf_key, fallback):
+            for value in (os.getenv(env_key), api_conf.get(conf_key), fallback):
+                if value is None or value == '':
+                    continue
+                try:
+                    return max(0, int(value))
+                except (ValueError, TypeError):
+                    continue
+            return 0
+
+        prefix = name.upper()
+        rpm = _pick(f"{prefix}_RPM", 'rpm', entry.get("rate_limit"))
+        tpm = _pick(f"{prefix}_TPM", 'tokens_per_minute', None)
+        return rpm, tpm
+
     @staticmethod
     def is_engine_available(engine_name: str) -> bool:
         """检查指定引擎是否可用（有API密钥）"""
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+翻译引擎实例池（进程内）
+
+引擎实例只保存配置（api_key/url/batch_size 等），可安全地在线程间共享。
+池按 (引擎类, 引擎名, 配置指纹) 复用实例：配置（数据库 api_config 或环境变量）变化后
+指纹随之变化，下一次获取时自动重建，旧实例被丢弃。
+"""
+import json
+import hashlib
+import logging
+import threading
+from typing import Any, Dict, Tuple
+
+from .engine_config import EngineConfig
+
+logger = logging.getLogger(__name__)
+
+_pool: Dict[Tuple[type, str, str], Any] = {}
+_lock = threading.Lock()
+
+
+def _config_fingerprint(engine_name: str) -> str:
+    try:
+        cfg = EngineConfig.get_engine_config(engine_name)
+    except ValueError:
+        cfg = {"__version__": EngineConfig.get_config_version()}
+    raw = json.dumps(cfg, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def get_engine(engine_name: str, engine_class: type, **kwargs):
+    """获取（或创建）池化的引擎实例；显式传入构造参数时不走池"""
+    if kwargs:
+        return engine_class(**kwargs)
+
+    key = (engine_class, engine_name, _config_fingerprint(engine_name))
+    instance = _pool.get(key)
+    if instance is not None:
+        return instance
+
+    with _lock:
+        instance = _pool.get(key)
+        if instance is None:
+            instance = engine_class()
+            # 同一引擎的旧配置实例直接淘汰
+            for stale in [k for k in _pool if k[0] is engine_class and k[1] == engine_name]:
+                _pool.pop(stale, None)
+            _pool[key] = instance
+            logger.info(f"[EnginePool] created {engine_class.__name__} for '{engine_name}'")
+    return instance
+
+
+def clear_pool():
+    with _lock:
+        _pool.clear()
+
+
+def get_pool_stats() -> Dict[str, Any]:
+    return {
+        "size": len(_pool),
+        "engines": sorted({f"{k[0].__module__.rsplit('.', 1)[-1]}.{k[0].__name__}:{k[1]}" for k in _pool}),
+        "config_version": EngineConfig.get_config_version(),
+    }
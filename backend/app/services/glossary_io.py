@@ -0,0 +1,369 @@
+#!/usr/bin/env python3
+"""
+术语表批量导入 / 导出（CSV / TSV / TBX）
+
+逐条 POST /api/terminology/ 导入一个 5 万条的客户术语表需要数小时（每条一次 HTTP 请求、一次提交）。这里：
+- 流式解析：CSV/TSV 逐行读取，TBX 用 iterparse 逐个 termEntry 解析并释放，不整体载入内存
+- 按块（GLOSSARY_IMPORT_CHUNK_SIZE）批量写入：每块一次查询已有术语，新术语 bulk insert、
+  变更的译文 bulk update，每块一次提交
+- 以 (source_text, 规范化源语言, 规范化目标语言, category_id, 归属用户) 为键做 upsert：
+  已存在且译文相同计为 unchanged，译文不同计为 updated；同一文件内重复的键只取第一次出现
+- dry_run：只计算差异（created / updated / unchanged 及样例），不写库
+- 全部写完后只递增一次术语表版本（而不是每行一次），已写入部分即使中途失败也会递增
+- 导出按 id 分批流式查询并逐行输出
+
+命令行：
+    python -m app.services.glossary_io import terms.csv --src en --tgt zh [--category-id 3] [--user-id 2] [--dry-run]
+    python -m app.services.glossary_io export out.tbx [--src en --tgt zh --category-id 3]
+"""
+import io
+import os
+import csv
+import codecs
+import sys
+import argparse
+from typing import Any, Dict, IO, Iterable, Iterator, List, Optional, Tuple
+from xml.sax.saxutils import escape
+
+from lxml import etree as ET
+
+from app import crud, models
+
+GLOSSARY_IMPORT_CHUNK_SIZE = int(os.getenv("GLOSSARY_IMPORT_CHUNK_SIZE", "500"))
+GLOSSARY_EXPORT_BATCH_SIZE = int(os.getenv("GLOSSARY_EXPORT_BATCH_SIZE", "1000"))
+# dry_run 报告中每类差异保留的样例条数
+DIFF_SAMPLE_SIZE = 50
+FORMATS = ("csv", "tsv", "tbx")
+
+XML_LANG = "{http://www.w3.org/XML/1998/namespace}lang"
+_SOURCE_COLUMNS = ("source_text", "source", "src", "term")
+_TARGET_COLUMNS = ("target_text", "target", "tgt", "translation")
+_SRC_LANG_COLUMNS = ("source_lang", "src_lang")
+_TGT_LANG_COLUMNS = ("target_lang", "tgt_lang")
+
+
+def detect_format(filename: Optional[str], fmt: Optional[str] = None) -> str:
+    """按显式参数或扩展名确定格式（默认 csv）"""
+    if fmt:
+        fmt = fmt.strip().lower()
+        if fmt not in FORMATS:
+            raise ValueError(f"Unsupported glossary format: {fmt}")
+        return fmt
+    ext = os.path.splitext(filename or "")[1].lower().lstrip(".")
+    if ext in ("tsv", "tab"):
+        return "tsv"
+    if ext in ("tbx", "xml"):
+        return "tbx"
+    return "csv"
+
+
+# ---------- 解析 ----------
+def _pick(header: List[str], names: Tuple[str, ...]) -> Optional[int]:
+    for name in names:
+        if name in header:
+            return header.index(name)
+    return None
+
+
+def _iter_delimited(stream: IO[bytes], delimiter: str, src_lang: str, tgt_lang: str) -> Iterator[Dict[str, str]]:
+    """CSV/TSV：带表头时按列名取值，否则按位置 source, target[, source_lang, target_lang]
+
+    按字节行增量解码（codecs.iterdecode），只要求 stream 可迭代：上传的 SpooledTemporaryFile
+    在 Python 3.10 上没有 readable()/read1()，不能交给 io.TextIOWrapper。
+    """
+    reader = csv.reader(codecs.iterdecode(stream, "utf-8-sig"), delimiter=delimiter)
+    cols = (0, 1, 2, 3)
+    for line_no, row in enumerate(reader, 1):
+        if not row or not any(c.strip() for c in row):
+            continue
+        if line_no == 1:
+            header = [c.strip().lower() for c in row]
+            s, t = _pick(header, _SOURCE_COLUMNS), _pick(header, _TARGET_COLUMNS)
+            if s is not None and t is not None:
+                cols = (s, t, _pick(header, _SRC_LANG_COLUMNS), _pick(header, _TGT_LANG_COLUMNS))
+                continue
+
+        def _cell(i):
+            return row[i].strip() if i is not None and i < len(row) else ""
+
+        yield {
+            "line": line_no,
+            "source_text": _cell(cols[0]),
+            "target_text": _cell(cols[1]),
+            "source_lang": _cell(cols[2]) or src_lang,
+            "target_lang": _cell(cols[3]) or tgt_lang,
+        }
+
+
+def _local(tag) -> str:
+    return tag.rsplit("}", 1)[-1] if isinstance(tag, str) else ""
+
+
+def _iter_tbx(stream: IO[bytes], src_lang: str, tgt_lang: str) -> Iterator[Dict[str, str]]:
+    """TBX：每个 termEntry / conceptEntry 取源语言与目标语言 langSet 中的第一个 term"""
+    src_key, tgt_key = (src_lang or "").lower(), (tgt_lang or "").lower()
+    entry_no = 0
+    for _event, elem in ET.iterparse(stream, events=("end",), recover=True, resolve_entities=False):
+        if _local(elem.tag) not in ("termEntry", "conceptEntry"):
+            continue
+        entry_no += 1
+        terms: Dict[str, str] = {}
+        for lang_set in elem.iter():
+            if _local(lang_set.tag) != "langSet":
+                continue
+            lang = (lang_set.get(XML_LANG) or lang_set.get("lang") or "").lower()
+            for node in lang_set.iter():
+                if _local(node.tag) == "term" and (node.text or "").strip():
+                    terms.setdefault(lang, node.text.strip())
+                    break
+        source = terms.get(src_key) or next((v for k, v in terms.items() if k.split("-")[0] == src_key.split("-")[0]), "")
+        target = terms.get(tgt_key) or next((v for k, v in terms.items() if k.split("-")[0] == tgt_key.split("-")[0]), "")
+        # 解析完即释放，保持内存平稳
+        elem.clear()
+        while elem.getprevious() is not None:
+            del elem.getparent()[0]
+        yield {"line": entry_no, "source_text": source, "target_text": target,
+               "source_lang": src_lang, "target_lang": tgt_lang}
+
+
+def iter_rows(stream: IO[bytes], fmt: str, src_lang: str, tgt_lang: str) -> Iterator[Dict[str, str]]:
+    if fmt == "tbx":
+        if not src_lang or not tgt_lang:
+            raise ValueError("TBX import requires source and target languages")
+        return _iter_tbx(stream, src_lang, tgt_lang)
+    return _iter_delimited(stream, "\t" if fmt == "tsv" else ",", src_lang, tgt_lang)
+
+
+# ---------- 导入 ----------
+def _chunks(rows: Iterable[Dict[str, str]], size: int) -> Iterator[List[Dict[str, str]]]:
+    chunk: List[Dict[str, str]] = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _existing_terms(db, chunk: List[Dict[str, str]], category_id: Optional[int], owner_id: Optional[int]):
+    """一次查询本块已存在的术语：(source_text, 规范化源语言, 规范化目标语言) -> (id, target_text)
+
+    语言按规范化代码比对（en→zh 与 en→zh-CN 视为同一语言对），与任务加载术语的口径一致，避免重复导入。
+    """
+    T = models.Terminology
+    # 经 ix_terminologies_source_key 定位候选，再在内存中按原文精确比对
+    q = db.query(T.id, T.source_text, T.source_lang_norm, T.target_lang_norm, T.target_text).filter(
+        T.source_key.in_({crud.term_search_key(r["source_text"]) for r in chunk})
+    )
+    q = q.filter(T.category_id.is_(None) if category_id is None else T.category_id == category_id)
+    q = q.filter(T.user_id.is_(None) if owner_id is None else T.user_id == owner_id)
+    return {(s, sl, tl): (tid, tt) for tid, s, sl, tl, tt in q.all()}
+
+
+def _row_key(row: Dict[str, str]) -> Tuple[str, Optional[str], Optional[str]]:
+    return (row["source_text"], crud.normalize_lang_code(row["source_lang"]), crud.normalize_lang_code(row["target_lang"]))
+
+
+def import_terms(db, rows: Iterable[Dict[str, str]], category_id: Optional[int] = None,
+                 owner_id: Optional[int] = None, dry_run: bool = False,
+                 chunk_size: Optional[int] = None) -> Dict[str, Any]:
+    """按块 upsert 术语；返回统计与差异样例。owner_id=None 表示公共术语"""
+    report: Dict[str, Any] = {
+        "dry_run": dry_run, "total": 0, "created": 0, "updated": 0, "unchanged": 0,
+        "duplicates": 0, "skipped": 0,
+        "samples": {"created": [], "updated": [], "skipped": []},
+    }
+    samples = report["samples"]
+    seen = set()
+    written = False
+    try:
+        for chunk in _chunks(rows, chunk_size or GLOSSARY_IMPORT_CHUNK_SIZE):
+            valid = []
+            for row in chunk:
+                report["total"] += 1
+                src, tgt = row["source_text"], row["target_text"]
+                if not src or not tgt or not row["source_lang"] or not row["target_lang"] or len(src) > 200 or len(tgt) > 200:
+                    report["skipped"] += 1
+                    if len(samples["skipped"]) < DIFF_SAMPLE_SIZE:
+                        samples["skipped"].append({"line": row.get("line"), "source_text": src[:200], "target_text": tgt[:200]})
+                    continue
+                key = _row_key(row)
+                if key in seen:
+                    report["duplicates"] += 1
+                    continue
+                seen.add(key)
+                valid.append(row)
+            if not valid:
+                continue
+
+            existing = _existing_terms(db, valid, category_id, owner_id)
+            inserts: List[Dict[str, Any]] = []
+            updates: List[Dict[str, Any]] = []
+            for row in valid:
+                hit = existing.get(_row_key(row))
+                if hit is None:
+                    report["created"] += 1
+                    inserts.append({
+                        "source_text": row["source_text"], "target_text": row["target_text"],
+                        "source_lang": row["source_lang"], "target_lang": row["target_lang"],
+                        "user_id": owner_id, "category_id": category_id,
+                        "is_approved": True, "is_active": True,
+                        **crud.term_norm_fields(row["source_text"], row["target_text"], row["source_lang"], row["target_lang"]),
+                    })
+                    if len(samples["created"]) < DIFF_SAMPLE_SIZE:
+                        samples["created"].append({"source_text": row["source_text"], "target_text": row["target_text"]})
+                elif hit[1] != row["target_text"]:
+                    report["updated"] += 1
+                    updates.append({"id": hit[0], "target_text": row["target_text"],
+                                    "target_key": crud.term_search_key(row["target_text"])})
+                    if len(samples["updated"]) < DIFF_SAMPLE_SIZE:
+                        samples["updated"].append({"source_text": row["source_text"], "old": hit[1], "new": row["target_text"]})
+                else:
+                    report["unchanged"] += 1
+            if dry_run or not (inserts or updates):
+                continue
+            if inserts:
+                db.bulk_insert_mappings(models.Terminology, inserts)
+            if updates:
+                db.bulk_update_mappings(models.Terminology, updates)
+            db.commit()
+            written = True
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        if written:
+            # 整次导入只递增一次术语表版本
+            crud.bump_glossary_version(db, commit=True)
+    return report
+
+
+def resolve_owner(db, category_id: Optional[int], user_id: Optional[int], public: bool = False) -> Optional[int]:
+    """与 crud.create_term 相同的归属规则：公共分类或显式公共导入 -> NULL，否则为当前用户"""
+    if public:
+        return None
+    if category_id:
+        cat = crud.get_term_category(db, category_id)
+        if cat and cat.owner_type == "public":
+            return None
+    return user_id
+
+
+# ---------- 导出 ----------
+def _query_terms(db, src_lang: Optional[str], tgt_lang: Optional[str], category_id: Optional[int],
+                 user_id: Optional[int], include_public: bool, all_owners: bool):
+    T = models.Terminology
+    q = db.query(T.id, T.source_text, T.target_text, T.source_lang, T.target_lang, T.category_id, T.user_id)
+    if src_lang:
+        q = q.filter(T.source_lang_norm == crud.normalize_lang_code(src_lang))
+    if tgt_lang:
+        q = q.filter(T.target_lang_norm == crud.normalize_lang_code(tgt_lang))
+    if category_id is not None:
+        q = q.filter(T.category_id == category_id)
+    if not all_owners:
+        if include_public:
+            q = q.filter((T.user_id == user_id) | T.user_id.is_(None)) if user_id is not None else q.filter(T.user_id.is_(None))
+        else:
+            q = q.filter(T.user_id == user_id)
+    return q
+
+
+def iter_terms(db, batch_size: Optional[int] = None, **filters) -> Iterator[Tuple]:
+    """按 id 递增分批（keyset）读取，避免一次载入整张表"""
+    size = batch_size or GLOSSARY_EXPORT_BATCH_SIZE
+    last_id = 0
+    T = models.Terminology
+    while True:
+        rows = _query_terms(db, **filters).filter(T.id > last_id).order_by(T.id.asc()).limit(size).all()
+        if not rows:
+            return
+        for row in rows:
+            yield row
+        last_id = rows[-1][0]
+
+
+def _xml_attr(value: Optional[str]) -> str:
+    return escape(value or "", {'"': "&quot;"})
+
+
+def export_lines(db, fmt: str, **filters) -> Iterator[str]:
+    """逐行生成导出内容（CSV/TSV 带表头，TBX 为 TBX-Basic 结构）"""
+    if fmt == "tbx":
+        yield '<?xml version="1.0" encoding="UTF-8"?>\n<martif type="TBX" xml:lang="en">\n<text>\n<body>\n'
+        for tid, src, tgt, sl, tl, _cat, _uid in iter_terms(db, **filters):
+            yield (f'<termEntry id="t{tid}">'
+                   f'<langSet xml:lang="{_xml_attr(sl)}"><tig><term>{escape(src or "")}</term></tig></langSet>'
+                   f'<langSet xml:lang="{_xml_attr(tl)}"><tig><term>{escape(tgt or "")}</term></tig></langSet>'
+                   f'</termEntry>\n')
+        yield '</body>\n</text>\n</martif>\n'
+        return
+    buf = io.StringIO()
+    writer = csv.writer(buf, delimiter="\t" if fmt == "tsv" else ",", lineterminator="\n")
+
+    def _flush() -> str:
+        value = buf.getvalue()
+        buf.seek(0)
+        buf.truncate(0)
+        return value
+
+    writer.writerow(["source_text", "target_text", "source_lang", "target_lang", "category_id"])
+    yield _flush()
+    for _tid, src, tgt, sl, tl, cat, _uid in iter_terms(db, **filters):
+        writer.writerow([src, tgt, sl, tl, "" if cat is None else cat])
+        yield _flush()
+
+
+# ---------- 命令行 ----------
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Bulk import/export terminology (CSV/TSV/TBX)")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    imp = sub.add_parser("import", help="import a glossary file")
+    imp.add_argument("path")
+    imp.add_argument("--format", choices=FORMATS, default=None)
+    imp.add_argument("--src", default="", help="source language (default for files without language columns)")
+    imp.add_argument("--tgt", default="", help="target language (default for files without language columns)")
+    imp.add_argument("--category-id", type=int, default=None)
+    imp.add_argument("--user-id", type=int, default=None, help="owner user id (omit for public terms)")
+    imp.add_argument("--dry-run", action="store_true")
+    imp.add_argument("--chunk-size", type=int, default=None)
+
+    exp = sub.add_parser("export", help="export terms to a file ('-' for stdout)")
+    exp.add_argument("path")
+    exp.add_argument("--format", choices=FORMATS, default=None)
+    exp.add_argument("--src", default=None)
+    exp.add_argument("--tgt", default=None)
+    exp.add_argument("--category-id", type=int, default=None)
+    exp.add_argument("--user-id", type=int, default=None, help="only this user's terms (plus public ones)")
+
+    args = parser.parse_args(argv)
+    import json
+    from app.database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        if args.command == "import":
+            fmt = detect_format(args.path, args.format)
+            owner = resolve_owner(db, args.category_id, args.user_id, public=args.user_id is None)
+            with open(args.path, "rb") as f:
+                report = import_terms(db, iter_rows(f, fmt, args.src, args.tgt), category_id=args.category_id,
+                                      owner_id=owner, dry_run=args.dry_run, chunk_size=args.chunk_size)
+            print(json.dumps(report, ensure_ascii=False, indent=2))
+        else:
+            fmt = detect_format(args.path if args.path != "-" else None, args.format)
+            filters = dict(src_lang=args.src, tgt_lang=args.tgt, category_id=args.category_id,
+                           user_id=args.user_id, include_public=True, all_owners=args.user_id is None)
+            out = sys.stdout if args.path == "-" else open(args.path, "w", encoding="utf-8", newline="")
+            try:
+                for chunk in export_lines(db, fmt, **filters):
+                    out.write(chunk)
+            finally:
+                if out is not sys.stdout:
+                    out.close()
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
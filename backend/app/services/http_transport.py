@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+共享 HTTP 传输层
+
+所有引擎共用按引擎划分的 requests.Session（keep-alive），每个 Session 挂载一个
+HTTPAdapter，为每个目标主机维护连接池，池大小取引擎的 max_workers（不低于
+ENGINE_HTTP_POOL_MIN）。这样同一引擎的请求可以复用 TCP/TLS 连接，不必每批都重新握手。
+
+超时拆分为连接超时（ENGINE_HTTP_CONNECT_TIMEOUT）与读取超时（引擎配置 timeout）。
+按主机统计在途请求数、峰值与“池饱和”次数（发起请求时在途数已达到池大小），
+用于判断 max_workers 与连接池是否匹配。
+
+说明：requests/urllib3 不支持 HTTP/2，这里保持 HTTP/1.1 keep-alive。
+"""
+import os
+import threading
+import logging
+from typing import Any, Dict, Optional, Tuple, Union
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+HTTP_CONNECT_TIMEOUT = float(os.getenv("ENGINE_HTTP_CONNECT_TIMEOUT", "10"))
+HTTP_POOL_MIN = int(os.getenv("ENGINE_HTTP_POOL_MIN", "10"))
+# 每个 Session 缓存多少个不同主机的连接池
+HTTP_POOL_HOSTS = int(os.getenv("ENGINE_HTTP_POOL_HOSTS", "4"))
+
+
+class _HostStats:
+    __slots__ = ("pool_size", "in_flight", "peak_in_flight", "requests", "errors", "saturated")
+
+    def __init__(self, pool_size: int):
+        self.pool_size = pool_size
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.requests = 0
+        self.errors = 0
+        self.saturated = 0
+
+    def to_dict(self) -> Dict[str, int]:
+        return {k: getattr(self, k) for k in self.__slots__}
+
+
+class HttpTransport:
+    """按引擎复用的 keep-alive 连接池"""
+
+    def __init__(self):
+        self._sessions: Dict[str, Tuple[requests.Session, int]] = {}
+        self._stats: Dict[str, _HostStats] = {}
+        self._lock = threading.Lock()
+
+    def _session_for(self, engine: str, pool_size: int) -> requests.Session:
+        entry = self._sessions.get(engine)
+        if entry and entry[1] >= pool_size:
+            return entry[0]
+        with self._lock:
+            entry = self._sessions.get(engine)
+            if entry and entry[1] >= pool_size:
+                return entry[0]
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=HTTP_POOL_HOSTS, pool_maxsize=pool_size, max_retries=0)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            # 池扩容时替换旧 Session；正在使用旧 Session 的请求不受影响
+            self._sessions[engine] = (session, pool_size)
+            logger.info(f"[HttpTransport] session for '{engine}' with pool_maxsize={pool_size}")
+            return session
+
+    @staticmethod
+    def _timeout(timeout: Optional[Union[int, float, tuple]]) -> Any:
+        if timeout is None:
+            return (HTTP_CONNECT_TIMEOUT, 60)
+        if isinstance(timeout, tuple):
+            return timeout
+        return (min(HTTP_CONNECT_TIMEOUT, float(timeout)), float(timeout))
+
+    def _host_stats(self, engine: str, url: str, pool_size: int) -> _HostStats:
+        key = f"{engine}@{urlparse(url).netloc}"
+        stats = self._stats.get(key)
+        if stats is None:
+            with self._lock:
+                stats = self._stats.setdefault(key, _HostStats(pool_size))
+        stats.pool_size = max(stats.pool_size, pool_size)
+        return stats
+
+    def request(self, method: str, engine: str, url: str, pool_size: Optional[int] = None,
+                timeout: Optional[Union[int, float, tuple]] = None, **kwargs) -> requests.Response:
+        size = max(int(pool_size or 0), HTTP_POOL_MIN)
+        session = self._session_for(engine, size)
+        stats = self._host_stats(engine, url, size)
+        with self._lock:
+            stats.requests += 1
+            if stats.in_flight >= stats.pool_size:
+                stats.saturated += 1
+            stats.in_flight += 1
+            stats.peak_in_flight = max(stats.peak_in_flight, stats.in_flight)
+        try:
+            return session.request(method, url, timeout=self._timeout(timeout), **kwargs)
+        except Exception:
+            with self._lock:
+                stats.errors += 1
+            raise
+        finally:
+            with self._lock:
+                stats.in_flight -= 1
+
+    def post(self, engine: str, url: str, **kwargs) -> requests.Response:
+        return self.request("POST", engine, url, **kwargs)
+
+    def get_stats(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            return {k: v.to_dict() for k, v in self._stats.items()}
+
+    def close(self):
+        with self._lock:
+            for session, _ in self._sessions.values():
+                try:
+                    session.close()
+                except Exception:
+                    pass
+            self._sessions.clear()
+
+
+transport = HttpTransport()
+
+
+def http_post(engine: str, url: str, **kwargs) -> requests.Response:
+    """模块级便捷函数：transport.post"""
+    return transport.post(engine, url, **kwargs)
+
+
+def get_http_pool_stats() -> Dict[str, Dict[str, int]]:
+    return transport.get_stats()
@@ -8,31 +8,45 @@ import time
 import logging
 import requests
 import re
+import math
+import threading
 from abc import ABC, abstractmethod
 from typing import List, Dict, Any, Optional
 from .engine_config import EngineConfig
+from .http_transport import http_post
+from .async_engine import AsyncEngineMixin
+from .rate_limiter import acquire_for_engine, settle_for_engine, limits_for_engine
+from .batch_packer import pack_for_engine
+from .concurrency_controller import report_response, get_controller
 
 logger = logging.getLogger(__name__)
 
-# --- Qwen3 runtime metrics (process-wide, reset per batch) ---
-QWEN3_METRICS = {"total": 0, "success": 0, "429": 0}
+class EngineMetrics:
+    """单个任务的引擎请求统计（线程安全）：片段总数 / 成功数 / 429 次数
 
-def qwen3_reset_metrics():
-    try:
-        QWEN3_METRICS["total"] = 0
-        QWEN3_METRICS["success"] = 0
-        QWEN3_METRICS["429"] = 0
-    except Exception:
-        pass
+    由调用方（SegmentPipeline）按任务创建，经 translate_batch(metrics=...) 逐次调用传入；
+    引擎实例来自进程级 engine_pool、被多个任务共享，统计对象不能挂在实例上。
+    取代之前进程级、按批次清零且多线程无锁修改的 QWEN3_METRICS。
+    """
 
-def qwen3_get_metrics():
-    try:
-        return {"total": int(QWEN3_METRICS.get("total", 0)), "success": int(QWEN3_METRICS.get("success", 0)), "429": int(QWEN3_METRICS.get("429", 0))}
-    except Exception:
-        return {"total": 0, "success": 0, "429": 0}
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.total = 0
+        self.success = 0
+        self.throttled = 0
 
-class TranslationEngine(ABC):
-    """AI翻译引擎抽象基类"""
+    def add(self, total: int = 0, success: int = 0, throttled: int = 0):
+        with self._lock:
+            self.total += total
+            self.success += success
+            self.throttled += throttled
+
+    def as_dict(self) -> Dict[str, int]:
+        with self._lock:
+            return {"total": self.total, "success": self.success, "429": self.throttled}
+
+class TranslationEngine(AsyncEngineMixin, ABC):
+    """AI翻译引擎抽象基类（同步接口 + translate_batch_async 异步孪生接口）"""
     
     def __init__(self, api_key: str, api_url: str, **kwargs):
         self.api_key = api_key
@@ -63,31 +77,42 @@ class TranslationEngine(ABC):
         if not texts:
             return texts, 0
         
-        # 分批处理
-        if len(texts) > self.batch_size:
-            batch_size = self.batch_size
-            logger.info(f"[{self.__class__.__name__}] Large batch detected ({len(texts)} texts), processing in batches of {batch_size}")
-            
-            all_results = []
-            total_tokens = 0
-            
-            for i in range(0, len(texts), batch_size):
-                batch_texts = texts[i:i + batch_size]
-                logger.info(f"[{self.__class__.__name__}] Processing batch {i//batch_size + 1}/{(len(texts) + batch_size - 1)//batch_size}: {len(batch_texts)} texts")
-                
-                try:
-                    batch_results, batch_tokens = self._process_batch(batch_texts, src_lang, tgt_lang)
-                    all_results.extend(batch_results)
-                    total_tokens += batch_tokens
-                except Exception as e:
-                    logger.error(f"[{self.__class__.__name__}] Batch {i//batch_size + 1} failed: {e}")
-                    # 直接返回失败，不使用原文回退
-                    logger.error(f"[{self.__class__.__name__}] Youdao API failed, returning failure")
-                    raise e
-            
-            return all_results, total_tokens
-        else:
-            return self._process_batch(texts, src_lang, tgt_lang)
+        return self._translate_packed(texts, src_lang, tgt_lang, self._process_batch)
+    
+    def _translate_packed(self, texts: List[str], src_lang: str, tgt_lang: str, process_fn, max_items: Optional[int] = None) -> tuple:
+        """按条数上限 + token 预算装箱分批（batch_packer），并行调用 process_fn，结果按下标回填"""
+        batches = self._pack_batches(texts, max_items=max_items)
+        if len(batches) <= 1:
+            return process_fn(texts, src_lang, tgt_lang)
+        
+        logger.info(f"[{self.__class__.__name__}] Large batch detected ({len(texts)} texts), packed into {len(batches)} batches")
+        results = [None] * len(texts)
+        total_tokens = 0
+        
+        def _one(batch):
+            n, idxs = batch
+            batch_texts = [texts[i] for i in idxs]
+            logger.info(f"[{self.__class__.__name__}] Processing batch {n + 1}/{len(batches)}: {len(batch_texts)} texts")
+            try:
+                return process_fn(batch_texts, src_lang, tgt_lang)
+            except Exception as e:
+                logger.error(f"[{self.__class__.__name__}] Batch {n + 1} failed: {e}")
+                # 直接返回失败，不使用原文回退
+                raise
+        
+        # 各批次从共享队列中领取，按引擎自适应并发并行请求；结果按下标回填
+        controller = get_controller(getattr(self, 'engine_key', None) or self.__class__.__name__, initial=self.max_workers)
+        for idxs, (batch_results, batch_tokens) in zip(batches, controller.run_items(_one, list(enumerate(batches)))):
+            for i, r in zip(idxs, batch_results):
+                results[i] = r
+            total_tokens += batch_tokens
+        
+        # 未回填的下标保持 None（失败），由上层回填原文或补救重发
+        return results, total_tokens
+    
+    def _pack_batches(self, texts: List[str], max_items: Optional[int] = None) -> List[List[int]]:
+        """按引擎批次预算（EngineConfig.get_batch_limits）与 batch_size 切分，返回每批下标"""
+        return pack_for_engine(getattr(self, 'engine_key', None) or '', texts, max_items=max_items or self.batch_size)
     
     def _process_batch(self, texts: List[str], src_lang: str, tgt_lang: str) -> tuple:
         """处理单个批次"""
@@ -136,8 +161,25 @@ class TranslationEngine(ABC):
         """获取请求头"""
         return {"Content-Type": "application/json"}
 
+    def _post(self, url: str, **kwargs):
+        """通过共享 keep-alive 连接池发送 POST 请求（发送前按 RPM/TPM 令牌桶获取额度）"""
+        kwargs.setdefault('timeout', getattr(self, 'timeout', 60))
+        ticket = acquire_for_engine(self, kwargs.get('json') or kwargs.get('data'))
+        engine_key = getattr(self, 'engine_key', None) or self.__class__.__name__
+        started = time.monotonic()
+        try:
+            response = http_post(self.__class__.__name__, url, pool_size=getattr(self, 'max_workers', None), **kwargs)
+        except Exception:
+            report_response(engine_key, None, time.monotonic() - started)
+            raise
+        report_response(engine_key, response.status_code, time.monotonic() - started)
+        settle_for_engine(ticket, response)
+        return response
+
 class DeepSeekTranslator(TranslationEngine):
     """DeepSeek翻译器"""
+
+    engine_key = 'deepseek'
     
     def __init__(self):
         config = EngineConfig.get_deepseek_config()
@@ -171,55 +213,15 @@ class DeepSeekTranslator(TranslationEngine):
         """使用JSON格式的批量翻译（更高效）"""
         logger.info(f"[{self.__class__.__name__}] Using JSON format for batch translation")
         
-        all_results = []
-        total_tokens = 0
-        
-        # 按批次大小分组
-        for i in range(0, len(texts), self.json_batch_size):
-            batch_texts = texts[i:i + self.json_batch_size]
-            logger.info(f"[{self.__class__.__name__}] Processing JSON batch {i//self.json_batch_size + 1}: {len(batch_texts)} texts")
-            
-            try:
-                batch_results, batch_tokens = self._process_batch_json(batch_texts, src_lang, tgt_lang)
-                all_results.extend(batch_results)
-                total_tokens += batch_tokens
-                
-                # 添加批次间延迟，避免API限制
-                if i + self.json_batch_size < len(texts):
-                    time.sleep(0.5)
-                    
-            except Exception as e:
-                logger.error(f"[{self.__class__.__name__}] JSON batch failed: {e}")
-                raise e
-        
-        return all_results, total_tokens
+        # 按 json_batch_size 与 token 预算装箱分批
+        return self._translate_packed(texts, src_lang, tgt_lang, self._process_batch_json, max_items=self.json_batch_size)
     
     def _translate_batch_text(self, texts: List[str], src_lang: str, tgt_lang: str) -> tuple:
         """使用文本格式的批量翻译（原有方式）"""
         logger.info(f"[{self.__class__.__name__}] Using text format for batch translation")
         
-        all_results = []
-        total_tokens = 0
-        
-        # 按批次大小分组
-        for i in range(0, len(texts), self.batch_size):
-            batch_texts = texts[i:i + self.batch_size]
-            logger.info(f"[{self.__class__.__name__}] Processing text batch {i//self.batch_size + 1}: {len(batch_texts)} texts")
-            
-            try:
-                batch_results, batch_tokens = self._process_batch_text(batch_texts, src_lang, tgt_lang)
-                all_results.extend(batch_results)
-                total_tokens += batch_tokens
-                
-                # 添加批次间延迟，避免API限制
-                if i + self.batch_size < len(texts):
-                    time.sleep(0.5)
-                    
-            except Exception as e:
-                logger.error(f"[{self.__class__.__name__}] Text batch failed: {e}")
-                raise e
-        
-        return all_results, total_tokens
+        # 按 batch_size 与 token 预算装箱分批
+        return self._translate_packed(texts, src_lang, tgt_lang, self._process_batch_text, max_items=self.batch_size)
     
     def _process_batch_json(self, texts: List[str], src_lang: str, tgt_lang: str) -> tuple:
         """处理JSON格式的批次翻译"""
@@ -274,11 +276,10 @@ Expected output format:
         }
         
         logger.info(f"[{self.__class__.__name__}] Sending JSON request to DeepSeek API")
-        response = requests.post(
+        response = self._post(
             self.api_url,
             headers=headers,
-            json=payload,
-            timeout=self.timeout
+            json=payload
         )
         
         if response.status_code != 200:
@@ -295,11 +296,10 @@ Expected output format:
         }
         
         logger.info(f"[{self.__class__.__name__}] Sending text request to DeepSeek API")
-        response = requests.post(
+        response = self._post(
             self.api_url,
             headers=headers,
-            json=payload,
-            timeout=self.timeout
+            json=payload
         )
         
         if response.status_code != 200:
@@ -665,6 +665,8 @@ Expected output format:
 
 class TencentTranslator(TranslationEngine):
     """腾讯原子能力翻译引擎"""
+
+    engine_key = 'tencent'
     
     def __init__(self, **kwargs):
         api_key = kwargs.get('api_key') or os.getenv("TENCENT_API_KEY", "").strip()
@@ -712,7 +714,7 @@ class TencentTranslator(TranslationEngine):
         
         try:
             start_time = time.time()
-            response = requests.post(self.api_url, headers=headers, json=payload, timeout=self.timeout)
+            response = self._post(self.api_url, headers=headers, json=payload)
             response.raise_for_status()
             
             elapsed_time = time.time() - start_time
@@ -728,6 +730,11 @@ class TencentTranslator(TranslationEngine):
 class KimiTranslator(TranslationEngine):
     """Kimi API翻译引擎"""
     
+    engine_key = 'kimi'
+    async_json_api = True
+    # 与同步 translate_batch 保持一致：每请求最多 8 条
+    async_batch_size = 8
+    
     def __init__(self, **kwargs):
         api_key = kwargs.get('api_key') or os.getenv("KIMI_API_KEY", "").strip()
         api_url = kwargs.get('api_url') or os.getenv("KIMI_API_URL", "https://api.moonshot.cn/v1/chat/completions")
@@ -826,7 +833,7 @@ class KimiTranslator(TranslationEngine):
         for attempt in range(max_retries):
             try:
                 start_time = time.time()
-                response = requests.post(self.api_url, headers=headers, json=payload, timeout=self.timeout)
+                response = self._post(self.api_url, headers=headers, json=payload)
                 
                 if response.status_code == 429:  # Too Many Requests
                     if attempt < max_retries - 1:
@@ -871,41 +878,13 @@ class KimiTranslator(TranslationEngine):
         if not texts:
             return texts, 0
         
-        # Kimi API对限流敏感，使用更小的批次
-        batch_size = min(self.batch_size, 8)  # 进一步降低批次大小
-        
-        if len(texts) > batch_size:
-            logger.info(f"[{self.__class__.__name__}] Large batch detected ({len(texts)} texts), processing in batches of {batch_size}")
-            
-            all_results = []
-            total_tokens = 0
-            
-            for i in range(0, len(texts), batch_size):
-                batch_texts = texts[i:i + batch_size]
-                logger.info(f"[{self.__class__.__name__}] Processing batch {i//batch_size + 1}/{(len(texts) + batch_size - 1)//batch_size}: {len(batch_texts)} texts")
-                
-                try:
-                    batch_results, batch_tokens = self._process_batch(batch_texts, src_lang, tgt_lang)
-                    all_results.extend(batch_results)
-                    total_tokens += batch_tokens
-                    
-                    # 在批次之间添加延迟，避免触发限流
-                    if i + batch_size < len(texts):
-                        logger.info(f"Adding delay between batches to avoid rate limiting...")
-                        time.sleep(1)  # 1秒延迟
-                        
-                except Exception as e:
-                    logger.error(f"[{self.__class__.__name__}] Batch {i//batch_size + 1} failed: {e}")
-                    # 直接返回失败，不使用原文回退
-                    logger.error(f"[{self.__class__.__name__}] Youdao API failed, returning failure")
-                    raise e
-            
-            return all_results, total_tokens
-        else:
-            return self._process_batch(texts, src_lang, tgt_lang)
+        # Kimi API对限流敏感，使用更小的批次：条数上限（默认 8）与 token 预算见 EngineConfig.get_batch_limits('kimi')
+        return self._translate_packed(texts, src_lang, tgt_lang, self._process_batch)
 
 class YoudaoTranslator(TranslationEngine):
     """有道云批量翻译引擎"""
+
+    engine_key = 'youdao'
     
     def __init__(self, **kwargs):
         api_key = kwargs.get('api_key') or os.getenv("YOUDAO_API_KEY", "").strip()
@@ -1133,7 +1112,7 @@ class YoudaoTranslator(TranslationEngine):
             logger.info(f"[YoudaoTranslator] Debug - clean_headers: {clean_headers}")
             
             # 有道云批量翻译API使用POST请求
-            response = requests.post(self.api_url, data=encoded_payload, headers=clean_headers, timeout=self.timeout)
+            response = self._post(self.api_url, data=encoded_payload, headers=clean_headers)
             
             logger.info(f"[YoudaoTranslator] Debug - response status: {response.status_code}")
             logger.info(f"[YoudaoTranslator] Debug - response headers: {dict(response.headers)}")
@@ -1277,6 +1256,13 @@ class YoudaoTranslator(TranslationEngine):
 class Qwen3Translator(TranslationEngine):
     """Qwen3 API翻译引擎"""
     
+    engine_key = 'qwen3'
+    async_json_api = True
+    # qwen-mt 逐条请求，避免多条合并导致解析失败
+    async_batch_size = 1
+    # translate_batch / send_request 接受任务级 metrics 参数
+    supports_metrics = True
+    
     def __init__(self, **kwargs):
         from .engine_config import EngineConfig
         cfg = EngineConfig.get_qwen3_config()
@@ -1400,21 +1386,20 @@ class Qwen3Translator(TranslationEngine):
             logger.error(f"Qwen3 response parse error: {e}")
             return [""] * expected_count
     
-    def send_request(self, payload: Dict[str, Any], headers: Dict[str, str]) -> tuple:
-        """发送Qwen3 API请求（含限流处理）"""
+    def send_request(self, payload: Dict[str, Any], headers: Dict[str, str],
+                     metrics: Optional[EngineMetrics] = None) -> tuple:
+        """发送Qwen3 API请求（含限流处理）；429 次数记入调用方传入的 metrics"""
         headers["Authorization"] = f"Bearer {self.api_key}"
         
         max_retries = max(1, self.retry_max)
         for attempt in range(max_retries):
             try:
                 start_time = time.time()
-                response = requests.post(self.api_url, headers=headers, json=payload, timeout=self.timeout)
+                response = self._post(self.api_url, headers=headers, json=payload)
                 
                 if response.status_code == 429:  # Too Many Requests
-                    try:
-                        QWEN3_METRICS["429"] += 1
-                    except Exception:
-                        pass
+                    if metrics is not None:
+                        metrics.add(throttled=1)
                     if attempt < max_retries - 1:
                         wait_time = self.retry_delay * (2 ** attempt)  # 指数退避
                         logger.warning(f"Qwen3 API rate limited (429), waiting {wait_time}s before retry {attempt + 1}/{max_retries}")
@@ -1435,11 +1420,8 @@ class Qwen3Translator(TranslationEngine):
             except requests.exceptions.HTTPError as e:
                 code = getattr(e.response, 'status_code', None)
                 retriable = code in (429, 502, 503)
-                try:
-                    if code == 429:
-                        QWEN3_METRICS["429"] += 1
-                except Exception:
-                    pass
+                if code == 429 and metrics is not None:
+                    metrics.add(throttled=1)
                 if retriable and attempt < max_retries - 1:
                     wait_time = min(self.retry_delay * (1.5 ** attempt) + (0.3 * attempt), 10.0)
                     logger.warning(f"Qwen3 HTTP {code}, sleeping {wait_time:.2f}s then retry {attempt + 1}/{max_retries}")
@@ -1457,64 +1439,66 @@ class Qwen3Translator(TranslationEngine):
         
         return None, 0
     
-    def translate_batch(self, texts: List[str], src_lang: str, tgt_lang: str) -> tuple:
-        """Qwen3：逐条请求，避免多条合并导致解析失败；失败回退原文。
-        增加轻节流抖动与可配置的重试上限，降低 429 出现频率。
+    def _inflight_cap(self, controller) -> int:
+        """单次调用的在途请求上限：QWEN3_MAX_WORKERS，且不超过共享限流额度可支撑的并发
+        （Little 定律：RPM/60 × 平均响应延迟，多出的请求只会在令牌桶前排队）"""
+        cap = max(1, int(self.max_workers or 1))
+        try:
+            _key, rpm, _tpm = limits_for_engine(self)
+        except Exception:
+            rpm = 0
+        if rpm > 0:
+            latency = controller.baseline_latency or 1.0
+            cap = min(cap, max(1, math.ceil(rpm / 60.0 * latency) + 1))
+        return cap
+
+    def translate_batch(self, texts: List[str], src_lang: str, tgt_lang: str,
+                        metrics: Optional[EngineMetrics] = None) -> tuple:
+        """Qwen3：逐条请求，避免多条合并导致解析失败；失败的条目返回 None（由上层回填原文或重发）。
+        逐条请求并发派发：在途数不超过 _inflight_cap，并受引擎自适应并发控制器（429/延迟反馈）
+        与集群级令牌桶（_post 内获取额度）共同约束；统计记入调用方传入的 metrics（未传入时仅用于本次日志）。
         """
         logger.info(f"[{self.__class__.__name__}] Starting batch translation: {len(texts)} texts, {src_lang} -> {tgt_lang}")
         if not texts:
             return texts, 0
 
-        # reset metrics per batch
-        try:
-            qwen3_reset_metrics()
-            QWEN3_METRICS["total"] = len(texts)
-        except Exception:
-            pass
+        if metrics is None:
+            metrics = EngineMetrics()
+        metrics.add(total=len(texts))
 
-        outputs: List[str] = []
-        total_tokens = 0
-        for i, t in enumerate(texts):
-            # 每条请求前抖动，降低尖峰
-            try:
-                if self.sleep_between_requests and self.sleep_between_requests > 0:
-                    time.sleep(min(self.sleep_between_requests, 0.2))
-            except Exception:
-                pass
+        def _one(item):
+            i, t = item
+            # 节流由 _post 中的集群级令牌桶负责（translation_engines.rate_limit）
             try:
                 payload = self.build_payload([t], src_lang, tgt_lang)
                 headers = self._get_headers()
                 headers["Authorization"] = f"Bearer {self.api_key}"
-                resp, tokens = self.send_request(payload, headers)
+                resp, tokens = self.send_request(payload, headers, metrics=metrics)
                 if not resp:
-                    outputs.append(t)
-                    continue
+                    return None, 0
                 parsed = self.parse_response(resp, expected_count=1)
                 out = parsed[0] if isinstance(parsed, list) and parsed else ""
-                outputs.append(out or t)
-                try:
-                    if out and out.strip() and out.strip() != t.strip():
-                        QWEN3_METRICS["success"] += 1
-                except Exception:
-                    pass
-                try:
-                    total_tokens += int(tokens or 0)
-                except Exception:
-                    pass
-                # 轻微节流，降低429概率
-                try:
-                    time.sleep(0.1)
-                except Exception:
-                    pass
+                if not (isinstance(out, str) and out.strip()):
+                    # 明确报告失败（None），不以原文冒充译文
+                    return None, tokens
+                metrics.add(success=1)
+                return out, tokens
             except Exception as e:
                 logger.warning(f"[{self.__class__.__name__}] item {i} failed: {e}")
-                outputs.append(t)
-        # summary
-        try:
-            m = qwen3_get_metrics()
-            logger.info(f"Qwen3 summary: total={m['total']} success={m['success']} 429={m['429']}")
-        except Exception:
-            pass
+                return None, 0
+
+        controller = get_controller(self.engine_key, initial=self.max_workers)
+        results = controller.run_items(_one, list(enumerate(texts)), max_workers=self._inflight_cap(controller))
+        outputs: List[str] = []
+        total_tokens = 0
+        for out, tokens in results:
+            outputs.append(out)
+            try:
+                total_tokens += int(tokens or 0)
+            except Exception:
+                pass
+        m = metrics.as_dict()
+        logger.info(f"Qwen3 summary: total={m['total']} success={m['success']} 429={m['429']}")
         return outputs, total_tokens
 
 # 引擎工厂类
@@ -1547,7 +1531,9 @@ class TranslationEngineFactory:
                 raise ValueError(f"Unsupported engine: {engine_name}. Supported engines: {list(cls._engines.keys())}")
         
         engine_class = cls._engines[engine_name]
-        return engine_class(**kwargs)
+        # 按引擎名+配置指纹复用实例，避免每次调用都重建引擎/读取配置
+        from .engine_pool import get_engine
+        return get_engine(engine_name, engine_class, **kwargs)
     
     @classmethod
     def get_available_engines(cls) -> List[str]:
@@ -1556,14 +1542,31 @@ class TranslationEngineFactory:
 
 # 兼容层
 def translate_batch(texts, src_lang='auto', tgt_lang='ja', engine='deepseek', debug=False, **options):
-    """模块级批量翻译函数，支持多引擎"""
+    """模块级批量翻译函数，支持多引擎（前置翻译记忆缓存）"""
+    # 翻译记忆作用域/术语版本，仅用于缓存键，不下发给引擎
+    user_id = options.pop('user_id', None)
+    terminology_version = options.pop('terminology_version', None)
+    # 任务级请求统计（EngineMetrics），逐次传给引擎，不参与缓存键
+    metrics = options.pop('metrics', None)
+    report_failures = bool(options.pop('report_failures', False))
     try:
         translator = TranslationEngineFactory.create_engine(engine)
-        # 优先使用带 options 的路径（供聊天式引擎注入风格/指令等）
-        if hasattr(translator, 'translate_batch_with_options'):
-            return getattr(translator, 'translate_batch_with_options')(texts, src_lang, tgt_lang, **options)
-        # 兜底：使用常规路径
-        return translator.translate_batch(texts, src_lang, tgt_lang)
+
+        def _run(batch_texts):
+            # 优先使用带 options 的路径（供聊天式引擎注入风格/指令等）
+            if hasattr(translator, 'translate_batch_with_options'):
+                return getattr(translator, 'translate_batch_with_options')(batch_texts, src_lang, tgt_lang, **options)
+            # 兜底：使用常规路径
+            if metrics is not None and getattr(translator, 'supports_metrics', False):
+                return translator.translate_batch(batch_texts, src_lang, tgt_lang, metrics=metrics)
+            return translator.translate_batch(batch_texts, src_lang, tgt_lang)
+
+        from .translation_memory import translate_with_memory
+        return translate_with_memory(
+            texts, src_lang, tgt_lang, engine, _run,
+            model=getattr(translator, 'model', None), options=options,
+            user_id=user_id, terminology_version=terminology_version, report_failures=report_failures,
+        )
     except Exception as e:
         logger.error(f"Failed to create engine {engine}: {e}")
         # 直接返回失败，不使用DeepSeek回退
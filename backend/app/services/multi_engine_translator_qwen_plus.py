@@ -3,7 +3,7 @@ import json
 import time
 import logging
 import requests
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 
 from .engine_config import EngineConfig
 from .multi_engine_translator import TranslationEngine
@@ -14,6 +14,8 @@ logger = logging.getLogger(__name__)
 class QwenPlusChatTranslator(TranslationEngine):
     """Qwen Plus 聊天式翻译引擎（OpenAI 兼容模式）"""
 
+    engine_key = 'qwen_plus'
+
     def __init__(self, **kwargs):
         cfg = EngineConfig.get_qwen_plus_config()
         api_key = kwargs.get('api_key') or cfg.get('api_key')
@@ -80,42 +82,24 @@ class QwenPlusChatTranslator(TranslationEngine):
     def translate_batch_with_options(self, texts: List[str], src_lang: str, tgt_lang: str, **options) -> tuple:
         if not texts:
             return texts, 0
-        all_results: List[str] = []
+        # 按 batch_size 与 token 预算装箱分批，结果按下标回填；失败或空串记为 None（由上层回填原文或重发）
+        all_results: List[Optional[str]] = [None] * len(texts)
         total_tokens = 0
-        batch_size = self.batch_size
-        for i in range(0, len(texts), batch_size):
-            chunk = texts[i:i+batch_size]
+        for idxs in self._pack_batches(texts):
+            chunk = [texts[i] for i in idxs]
             payload = self.build_payload(chunk, src_lang, tgt_lang, **options)
             resp, tokens = self.send_request(payload, {})
             if not resp:
-                # 失败则原文回填
-                all_results.extend(chunk)
                 continue
             parsed = self.parse_response(resp, expected_count=len(chunk))
-            if parsed and len(parsed) == len(chunk):
-                # 空串视为无效，回退原文，避免清空内容
-                for j, val in enumerate(parsed):
-                    if isinstance(val, str) and val.strip():
-                        all_results.append(val)
-                    else:
-                        all_results.append(chunk[j])
-            else:
-                # 尺寸不一致时尽量对齐，缺失回填原文
-                for j in range(len(chunk)):
-                    cand = parsed[j] if (isinstance(parsed, list) and j < len(parsed)) else None
-                    if isinstance(cand, str) and cand.strip():
-                        all_results.append(cand)
-                    else:
-                        all_results.append(chunk[j])
+            for j, i in enumerate(idxs):
+                cand = parsed[j] if (isinstance(parsed, list) and j < len(parsed)) else None
+                if isinstance(cand, str) and cand.strip():
+                    all_results[i] = cand
             try:
                 total_tokens += int(tokens or 0)
             except Exception:
                 pass
-            # 轻微节流
-            try:
-                time.sleep(self.sleep_between_requests)
-            except Exception:
-                pass
         return all_results, total_tokens
 
     def parse_response(self, response, expected_count: int) -> List[str]:
@@ -163,11 +147,10 @@ class QwenPlusChatTranslator(TranslationEngine):
         while retry_count <= self.retry_max:
             try:
                 start_time = time.time()
-                response = requests.post(
+                response = self._post(
                     self.api_url,
                     headers=headers,
-                    json=payload,
-                    timeout=self.timeout
+                    json=payload
                 )
                 
                 if response.status_code == 200:
@@ -176,10 +159,6 @@ class QwenPlusChatTranslator(TranslationEngine):
                     usage = result.get('usage', {})
                     total_tokens = usage.get('total_tokens', 0)
                     
-                    # 应用请求间隔
-                    if self.sleep_between_requests > 0:
-                        time.sleep(self.sleep_between_requests)
-                    
                     return result, total_tokens
                 
                 elif response.status_code == 429:
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+OOXML 部件级多进程解析与序列化
+
+幻灯片/工作表/图表等部件彼此独立，整树解析与序列化是纯 CPU 工作，单进程串行时只用到一个核。
+部件足够多、足够大时改为进程池处理：
+- scan_parts：子进程各自从源 zip 读取部件并抽取片段，只把片段表（文本列表）传回主进程
+- render_parts：子进程重新解析部件、应用本部件的补丁（原文 -> 译文，仅含本部件片段），
+  序列化到临时文件，只把文件路径传回主进程，由主进程写入输出 zip
+
+子进程与串行路径使用同一组 collect/apply 函数与相同的序列化参数，输出逐字节一致。
+各翻译模块通过模块级 PART_HANDLERS = {kind: (collect(bytes) -> (texts, tree), apply(tree, translations))}
+登记部件处理函数；进程池不可用（如受限环境）时返回 None，调用方回退串行路径。
+
+Celery prefork 的子进程是守护进程，标准库进程池不允许守护进程再创建子进程；此时改用 Celery 自带的
+billiard 进程池。未安装 billiard 的守护进程中始终走串行路径（只在首次回退时记录一条日志）。
+"""
+import os
+import zipfile
+import logging
+import importlib
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+try:
+    import billiard
+except ImportError:
+    billiard = None
+
+logger = logging.getLogger(__name__)
+
+OOXML_PARALLEL_ENABLED = os.getenv("OOXML_PARALLEL_ENABLED", "true").strip().lower() in ("1", "true", "yes", "on")
+OOXML_PARALLEL_WORKERS = int(os.getenv("OOXML_PARALLEL_WORKERS", str(max(1, min(8, (os.cpu_count() or 2) - 1)))))
+# 达到以下两个阈值才启用进程池（进程启动与参数传递有固定开销）
+OOXML_PARALLEL_MIN_PARTS = int(os.getenv("OOXML_PARALLEL_MIN_PARTS", "16"))
+OOXML_PARALLEL_MIN_BYTES = int(os.getenv("OOXML_PARALLEL_MIN_BYTES", str(4 * 1024 * 1024)))
+# 子进程启动方式：forkserver 避免在多线程进程（心跳/线程池）中直接 fork
+OOXML_PARALLEL_START_METHOD = os.getenv("OOXML_PARALLEL_START_METHOD", "forkserver")
+
+Job = Tuple[str, str]  # (部件名, 部件类型)
+
+# 回退串行的原因只记录一次，避免每个文档重复刷日志
+_fallback_logged = False
+_fallback_lock = threading.Lock()
+
+
+def _log_fallback(reason: str):
+    global _fallback_logged
+    with _fallback_lock:
+        if _fallback_logged:
+            logger.debug(f"[OOXML] 多进程不可用，改为串行: {reason}")
+            return
+        _fallback_logged = True
+    logger.warning(f"[OOXML] 多进程不可用，改为串行（后续不再提示）: {reason}")
+
+
+def _daemonic() -> bool:
+    """当前进程是否为守护进程（Celery prefork 子进程由 billiard 创建，两边都要看）"""
+    if multiprocessing.current_process().daemon:
+        return True
+    return billiard is not None and bool(billiard.current_process().daemon)
+
+
+def should_parallelize(zin: zipfile.ZipFile, jobs: Sequence[Job]) -> bool:
+    if not OOXML_PARALLEL_ENABLED or OOXML_PARALLEL_WORKERS < 2 or len(jobs) < OOXML_PARALLEL_MIN_PARTS:
+        return False
+    if billiard is None and _daemonic():
+        _log_fallback("守护进程中无法创建进程池且未安装 billiard")
+        return False
+    total = sum(zin.getinfo(name).file_size for name, _ in jobs)
+    return total >= OOXML_PARALLEL_MIN_BYTES
+
+
+def _handlers(module: str, kind: str):
+    return importlib.import_module(module).PART_HANDLERS[kind]
+
+
+def _scan_one(zip_path: str, module: str, name: str, kind: str) -> List[str]:
+    collect, _ = _handlers(module, kind)
+    with zipfile.ZipFile(zip_path, "r") as zin:
+        texts, _tree = collect(zin.read(name))
+    return list(texts)
+
+
+def _render_one(zip_path: str, module: str, name: str, kind: str, patch: Dict[str, str], out_path: str) -> Optional[str]:
+    collect, apply = _handlers(module, kind)
+    with zipfile.ZipFile(zip_path, "r") as zin:
+        _texts, tree = collect(zin.read(name))
+    if tree is None:
+        return None
+    apply(tree, patch)
+    with open(out_path, "wb") as f:
+        tree.write(f, encoding="utf-8", xml_declaration=True)
+    return out_path
+
+
+def _run_pool(fn: Callable[..., Any], calls: Sequence[tuple]) -> List[Any]:
+    """在进程池中执行 fn(*args)，按提交顺序返回结果；守护进程中使用 billiard 进程池"""
+    workers = max(1, min(OOXML_PARALLEL_WORKERS, len(calls)))
+    if _daemonic():
+        try:
+            ctx = billiard.get_context(OOXML_PARALLEL_START_METHOD)
+        except ValueError:
+            ctx = billiard.get_context()
+        pool = ctx.Pool(processes=workers)
+        try:
+            pending = [pool.apply_async(fn, args) for args in calls]
+            return [r.get() for r in pending]
+        finally:
+            pool.terminate()
+            pool.join()
+    try:
+        ctx = multiprocessing.get_context(OOXML_PARALLEL_START_METHOD)
+    except ValueError:
+        ctx = None
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+        futures = [pool.submit(fn, *args) for args in calls]
+        return [f.result() for f in futures]
+
+
+def scan_parts(zip_path: str, module: str, jobs: Sequence[Job]) -> Optional[Dict[str, List[str]]]:
+    """并行抽取各部件片段表；进程池不可用时返回 None"""
+    try:
+        results = _run_pool(_scan_one, [(zip_path, module, name, kind) for name, kind in jobs])
+        return {name: texts for (name, _kind), texts in zip(jobs, results)}
+    except Exception as e:
+        _log_fallback(f"抽取失败: {e}")
+        return None
+
+
+def render_parts(zip_path: str, module: str, jobs: Sequence[Job], patches: Dict[str, Dict[str, str]],
+                 out_dir: str) -> Optional[Dict[str, str]]:
+    """并行改写并序列化各部件到 out_dir，返回 部件名 -> 临时文件路径；进程池不可用时返回 None"""
+    try:
+        results = _run_pool(_render_one, [
+            (zip_path, module, name, kind, patches.get(name) or {}, os.path.join(out_dir, f"part{i}.xml"))
+            for i, (name, kind) in enumerate(jobs)
+        ])
+        return {name: path for (name, _kind), path in zip(jobs, results) if path}
+    except Exception as e:
+        _log_fallback(f"序列化失败: {e}")
+        return None
@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+"""
+OOXML 部件的流式抽取与改写（超大 XML 部件专用）
+
+整树模式（ET.parse）需要把每个部件的完整 DOM 与节点句柄保留到最后，20 万行的
+sharedStrings.xml 或上千页的 document.xml 会占用数 GB 内存。流式模式分两遍：
+1) scan_part：expat 逐块解析，只按文档顺序记录片段文本（片段表）
+2) rewrite_part：再次逐块解析，原样回写标记并替换片段文本，直接写入输出 zip 条目
+峰值内存只与片段表有关，与 XML 大小无关。
+
+规则（StreamRule）描述片段所在的元素：
+- leaf：文本元素（命名空间 URI 或 None 表示任意，本地名），如 w:t、a:t
+- ancestor：可选，要求文本元素位于该本地名的祖先之内（如 xlsx 内联字符串 is）
+- group：可选，分组元素（如 sharedStrings 的 si、批注 comment）；组内有富文本 run（r/t）时
+  合并为一个片段并写回第一个 run，否则取组内第一个直接 t
+
+命名空间前缀、属性顺序、处理指令与注释按原样保留；expat 以非命名空间模式解析，
+仅在匹配规则时按 xmlns 声明解析前缀。
+"""
+import os
+import zipfile
+from xml.parsers import expat
+from typing import Callable, Dict, List, Optional, Tuple
+
+from .ooxml_zip import new_member_info
+
+W_NS = "http://schemas.openxmlformats.org/wordprocessingml/2006/main"
+A_NS = "http://schemas.openxmlformats.org/drawingml/2006/main"
+
+# 部件（解压后）不小于该字节数时走流式模式；0 表示所有部件都走流式，-1 表示禁用
+OOXML_STREAM_THRESHOLD_BYTES = int(os.getenv("OOXML_STREAM_THRESHOLD_BYTES", str(32 * 1024 * 1024)))
+_READ_CHUNK = 1 << 16
+_WRITE_CHUNK = 1 << 16
+# 超过该大小的条目强制使用 zip64（流式写入时无法预知最终大小）
+_ZIP64_LIMIT = (1 << 31) - 1
+
+
+class StreamRule:
+    """片段匹配规则"""
+
+    def __init__(self, leaf: Tuple[Optional[str], str], ancestor: Optional[str] = None, group: Optional[str] = None):
+        self.leaf_ns, self.leaf_local = leaf
+        self.ancestor = ancestor
+        self.group = group
+
+
+DOCX_RULE = StreamRule((W_NS, "t"))
+DRAWING_RULE = StreamRule((A_NS, "t"))
+XLSX_SHARED_RULE = StreamRule((None, "t"), group="si")
+XLSX_INLINE_RULE = StreamRule((None, "t"), ancestor="is")
+XLSX_COMMENT_RULE = StreamRule((None, "t"), group="comment")
+
+
+def should_stream(info: zipfile.ZipInfo) -> bool:
+    if OOXML_STREAM_THRESHOLD_BYTES < 0:
+        return False
+    return info.file_size >= OOXML_STREAM_THRESHOLD_BYTES
+
+
+def _escape_text(s: str) -> str:
+    return s.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;").replace("\r", "&#13;")
+
+
+def _escape_attr(s: str) -> str:
+    return (s.replace("&", "&amp;").replace("<", "&lt;").replace('"', "&quot;")
+            .replace("\n", "&#10;").replace("\r", "&#13;").replace("\t", "&#9;"))
+
+
+class _Walker:
+    """expat 事件处理：维护元素栈与命名空间作用域，识别片段并交给 on_segment 处理
+
+    emit 为 None 时只抽取（scan）；否则逐事件输出标记（rewrite）。
+    """
+
+    def __init__(self, rule: StreamRule, on_segment: Callable[[str], Optional[str]], emit: Optional[Callable[[str], None]] = None):
+        self.rule = rule
+        self.on_segment = on_segment
+        self.emit = emit
+        self.stack: List[str] = []          # 本地名栈
+        self.ns_scopes: List[Dict[str, str]] = [{}]
+        self.ancestor_depth = 0
+        self.pending_start = False          # 起始标签尚未闭合（用于输出自闭合标签）
+        # 当前叶子片段
+        self.leaf_buf: Optional[List[str]] = None
+        # 分组：缓冲输出与文本槽位
+        self.group_depth = 0
+        self.group_out: Optional[List[str]] = None
+        self.group_slots: List[Tuple[int, bool]] = []   # (缓冲下标, 是否 run 文本)
+        self.group_texts: List[str] = []
+        self.slot_kind: Optional[bool] = None
+
+    # ---------- 输出 ----------
+    def _write(self, s: str):
+        if self.emit is None:
+            return
+        if self.group_out is not None:
+            self.group_out.append(s)
+        else:
+            self.emit(s)
+
+    def _close_pending(self):
+        if self.pending_start:
+            self.pending_start = False
+            self._write(">")
+
+    # ---------- 命名空间 ----------
+    def _resolve(self, qname: str) -> Tuple[Optional[str], str]:
+        if ":" in qname:
+            prefix, local = qname.split(":", 1)
+        else:
+            prefix, local = "", qname
+        for scope in reversed(self.ns_scopes):
+            if prefix in scope:
+                return scope[prefix], local
+        return None, local
+
+    def _is_leaf(self, qname: str) -> bool:
+        uri, local = self._resolve(qname)
+        if local != self.rule.leaf_local:
+            return False
+        return self.rule.leaf_ns is None or uri == self.rule.leaf_ns
+
+    # ---------- expat 回调 ----------
+    def xml_decl(self, version, encoding, standalone):
+        decl = f'<?xml version="{version or "1.0"}" encoding="UTF-8"'
+        if standalone != -1:
+            decl += f' standalone="{"yes" if standalone else "no"}"'
+        self._write(decl + "?>\n")
+
+    def start(self, name, attrs):
+        self._close_pending()
+        scope = {}
+        parts = [f"<{name}"]
+        for i in range(0, len(attrs), 2):
+            key, val = attrs[i], attrs[i + 1]
+            if key == "xmlns":
+                scope[""] = val
+            elif key.startswith("xmlns:"):
+                scope[key[6:]] = val
+            parts.append(f' {key}="{_escape_attr(val)}"')
+        self.ns_scopes.append(scope)
+        local = name.split(":", 1)[-1]
+        parent = self.stack[-1] if self.stack else None
+        self.stack.append(local)
+
+        rule = self.rule
+        if rule.group and local == rule.group and self.group_depth == 0:
+            self.group_depth = len(self.stack)
+            self.group_out = [] if self.emit is not None else None
+            self.group_slots = []
+            self.group_texts = []
+        if rule.ancestor and local == rule.ancestor and self.ancestor_depth == 0:
+            self.ancestor_depth = len(self.stack)
+
+        self._write("".join(parts))
+        self.pending_start = True
+
+        if self.leaf_buf is None and self._is_leaf(name):
+            if self.group_depth:
+                # 组内：r/t 为 run 文本，组的直接子 t 为普通文本，其余（如注音 rPh/t）原样保留
+                if parent == "r":
+                    self.slot_kind = True
+                elif len(self.stack) == self.group_depth + 1:
+                    self.slot_kind = False
+                else:
+                    return
+                self.leaf_buf = []
+            elif not rule.group and (not rule.ancestor or self.ancestor_depth):
+                self.leaf_buf = []
+
+    def chars(self, data):
+        if self.leaf_buf is not None:
+            self.leaf_buf.append(data)
+            return
+        self._close_pending()
+        self._write(_escape_text(data))
+
+    def end(self, name):
+        if self.leaf_buf is not None:
+            text = "".join(self.leaf_buf)
+            self.leaf_buf = None
+            if self.group_depth:
+                self._close_pending()
+                self.group_texts.append(text)
+                if self.group_out is not None:
+                    self.group_slots.append((len(self.group_out), bool(self.slot_kind)))
+                    self.group_out.append(_escape_text(text))
+                else:
+                    self.group_slots.append((-1, bool(self.slot_kind)))
+            else:
+                new_text = self.on_segment(text) if text else None
+                if text or new_text:
+                    self._close_pending()
+                    self._write(_escape_text(text if new_text is None else new_text))
+        if self.pending_start:
+            self.pending_start = False
+            self._write("/>")
+        else:
+            self._write(f"</{name}>")
+
+        depth = len(self.stack)
+        if self.group_depth and depth == self.group_depth:
+            self._finish_group()
+        if self.ancestor_depth and depth == self.ancestor_depth:
+            self.ancestor_depth = 0
+        self.stack.pop()
+        self.ns_scopes.pop()
+
+    def _finish_group(self):
+        runs = [k for k, (_, is_run) in enumerate(self.group_slots) if is_run]
+        if runs:
+            chosen = runs
+        else:
+            chosen = [k for k, (_, is_run) in enumerate(self.group_slots) if not is_run][:1]
+        joined = "".join(self.group_texts[k] for k in chosen)
+        new_text = self.on_segment(joined) if joined else None
+        out = self.group_out
+        self.group_out = None
+        self.group_depth = 0
+        if out is None:
+            return
+        if new_text is not None and chosen:
+            # 富文本：译文写入第一个 run，其余置空
+            out[self.group_slots[chosen[0]][0]] = _escape_text(new_text)
+            for k in chosen[1:]:
+                out[self.group_slots[k][0]] = ""
+        self._write("".join(out))
+
+    def pi(self, target, data):
+        self._close_pending()
+        self._write(f"<?{target} {data}?>" if data else f"<?{target}?>")
+
+    def comment(self, data):
+        self._close_pending()
+        self._write(f"<!--{data}-->")
+
+    def start_cdata(self):
+        # CDATA 内容按普通文本转义输出，语义不变
+        pass
+
+    def end_cdata(self):
+        pass
+
+
+def _parse(fileobj, walker: _Walker):
+    parser = expat.ParserCreate()
+    parser.ordered_attributes = True
+    parser.buffer_text = True
+    parser.buffer_size = _READ_CHUNK
+    parser.XmlDeclHandler = walker.xml_decl
+    parser.StartElementHandler = walker.start
+    parser.EndElementHandler = walker.end
+    parser.CharacterDataHandler = walker.chars
+    parser.ProcessingInstructionHandler = walker.pi
+    parser.CommentHandler = walker.comment
+    parser.StartCdataSectionHandler = walker.start_cdata
+    parser.EndCdataSectionHandler = walker.end_cdata
+    while True:
+        chunk = fileobj.read(_READ_CHUNK)
+        if not chunk:
+            break
+        parser.Parse(chunk, False)
+    parser.Parse(b"", True)
+
+
+def scan_part(zin: zipfile.ZipFile, name: str, rule: StreamRule) -> List[str]:
+    """抽取遍：按文档顺序返回部件内的片段文本（不构建 DOM）"""
+    texts: List[str] = []
+
+    def _record(text: str):
+        texts.append(text)
+        return None
+
+    with zin.open(name) as f:
+        _parse(f, _Walker(rule, _record))
+    return texts
+
+
+def rewrite_part(zin: zipfile.ZipFile, info: zipfile.ZipInfo, zout: zipfile.ZipFile, rule: StreamRule,
+                 lookup: Callable[[str], Optional[str]]) -> int:
+    """改写遍：逐块解析 info 对应部件，替换片段后直接写入 zout 的同名条目；返回替换的片段数
+
+    lookup(原文) 返回译文；返回 None 表示保留原文。
+    """
+    replaced = [0]
+
+    def _sub(text: str) -> Optional[str]:
+        new_text = lookup(text)
+        if new_text is not None and new_text != text:
+            replaced[0] += 1
+            return new_text
+        return None
+
+    with zin.open(info) as src, zout.open(new_member_info(info), "w", force_zip64=info.file_size > _ZIP64_LIMIT // 2) as dst:
+        pending: List[str] = []
+        size = [0]
+
+        def _emit(s: str):
+            pending.append(s)
+            size[0] += len(s)
+            if size[0] >= _WRITE_CHUNK:
+                dst.write("".join(pending).encode("utf-8"))
+                pending.clear()
+                size[0] = 0
+
+        _parse(src, _Walker(rule, _sub, _emit))
+        if pending:
+            dst.write("".join(pending).encode("utf-8"))
+    return replaced[0]
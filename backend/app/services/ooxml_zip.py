@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+OOXML 输出 zip 的成员写出
+
+- copy_unchanged：未改动的成员（图片、字体、嵌入工作簿、视频等）按原始压缩字节分块拷贝，
+  不做解压/再压缩；无法原样拷贝时（加密、源不是磁盘文件等）回退到解压后重新压缩
+- new_member_info：改写过的 XML 部件使用的条目信息，压缩级别由 OOXML_ZIP_COMPRESSLEVEL 配置
+
+原始拷贝依赖 zipfile 的内部字段（fp/_lock/start_dir 等），写入顺序与 ZipFile.writestr 一致。
+"""
+import os
+import shutil
+import struct
+import zipfile
+
+# 改写部件的 deflate 级别（1 最快，9 最小；默认与 zlib 一致）
+OOXML_ZIP_COMPRESSLEVEL = int(os.getenv("OOXML_ZIP_COMPRESSLEVEL", "6"))
+OOXML_RAW_COPY_ENABLED = os.getenv("OOXML_RAW_COPY_ENABLED", "true").strip().lower() in ("1", "true", "yes", "on")
+_COPY_CHUNK = 1 << 20
+_ZIP64_LIMIT = (1 << 31) - 1
+
+
+def _member_info(info: zipfile.ZipInfo, compress_type: int) -> zipfile.ZipInfo:
+    out = zipfile.ZipInfo(info.filename, date_time=info.date_time)
+    out.compress_type = compress_type
+    out.external_attr = info.external_attr
+    out.create_system = info.create_system
+    # ZipFile.open('w') 从条目信息读取压缩级别（3.13 起改名为 compress_level）
+    if hasattr(out, "compress_level"):
+        out.compress_level = OOXML_ZIP_COMPRESSLEVEL
+    else:
+        out._compresslevel = OOXML_ZIP_COMPRESSLEVEL
+    return out
+
+
+def new_member_info(info: zipfile.ZipInfo) -> zipfile.ZipInfo:
+    """为改写后的 XML 部件生成条目信息（保留名称/时间/属性，按配置级别 deflate 压缩）"""
+    return _member_info(info, zipfile.ZIP_DEFLATED)
+
+
+def _raw_copy(src_path: str, info: zipfile.ZipInfo, zout: zipfile.ZipFile):
+    out = _member_info(info, info.compress_type)
+    out.CRC = info.CRC
+    out.compress_size = info.compress_size
+    out.file_size = info.file_size
+    # 已知 CRC/大小，写在本地头中，不再需要数据描述符
+    out.flag_bits = info.flag_bits & ~0x08
+    zip64 = info.file_size > _ZIP64_LIMIT or info.compress_size > _ZIP64_LIMIT
+
+    with open(src_path, "rb") as src:
+        src.seek(info.header_offset)
+        header = struct.unpack(zipfile.structFileHeader, src.read(zipfile.sizeFileHeader))
+        if header[zipfile._FH_SIGNATURE] != zipfile.stringFileHeader:
+            raise zipfile.BadZipFile(f"bad local header for {info.filename}")
+        src.seek(header[zipfile._FH_FILENAME_LENGTH] + header[zipfile._FH_EXTRA_FIELD_LENGTH], os.SEEK_CUR)
+
+        with zout._lock:
+            if zout._writing:
+                raise ValueError("zip writer busy")
+            zout._writecheck(out)
+            zout._didModify = True
+            if zout._seekable:
+                zout.fp.seek(zout.start_dir)
+            out.header_offset = zout.fp.tell()
+            zout.fp.write(out.FileHeader(zip64))
+            remaining = info.compress_size
+            while remaining > 0:
+                chunk = src.read(min(_COPY_CHUNK, remaining))
+                if not chunk:
+                    raise zipfile.BadZipFile(f"truncated member {info.filename}")
+                zout.fp.write(chunk)
+                remaining -= len(chunk)
+            zout.start_dir = zout.fp.tell()
+            zout.filelist.append(out)
+            zout.NameToInfo[out.filename] = out
+
+
+def copy_unchanged(zin: zipfile.ZipFile, info: zipfile.ZipInfo, zout: zipfile.ZipFile):
+    """拷贝未改动的成员：优先原始压缩字节直拷，失败时回退到解压后重新写入"""
+    src_path = zin.filename if isinstance(zin.filename, str) else None
+    if OOXML_RAW_COPY_ENABLED and src_path and os.path.isfile(src_path) and not (info.flag_bits & 0x1):
+        start = zout.start_dir
+        try:
+            _raw_copy(src_path, info, zout)
+            return
+        except Exception as e:
+            if not zout._seekable:
+                raise
+            print(f"[OOXML] 原样拷贝 {info.filename} 失败，改为重新压缩: {e}")
+            # 丢弃写了一半的数据，从原位置继续写
+            zout.start_dir = start
+            zout.fp.seek(start)
+            zout.fp.truncate()
+    with zin.open(info) as src, zout.open(_member_info(info, info.compress_type), "w") as dst:
+        shutil.copyfileobj(src, dst, _COPY_CHUNK)
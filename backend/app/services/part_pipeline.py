@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+抽取 / 翻译 / 回写重叠执行的部件流水线（生产者-消费者）
+
+原流程严格分阶段：全部解析 -> 去重 -> 全部翻译 -> 全部写回。长文档解析时引擎空闲，
+翻译时 CPU 空闲。流水线中：
+- 生产者（调用线程）逐个部件抽取片段后立即 add_part：与已见片段去重，新片段做术语预处理，
+  攒满一个请求批次即提交给线程池翻译
+- 批次完成后在调用线程中登记译文；部件的全部片段都有译文时立刻回调 on_ready
+  （序列化并写入输出 zip），随后即可释放该部件的树
+任务耗时趋近于各阶段耗时的最大值而不是总和。
+
+回调 on_ready 与 prepare/finalize 都只在调用线程中执行，zip 写出与数据库会话无需额外加锁；
+只有 translate_chunk 在进程级常驻线程池（batch_scheduler）中运行，流水线不再自建线程池。
+"""
+from concurrent.futures import wait, FIRST_COMPLETED
+from typing import Any, Callable, Dict, Hashable, List, Optional, Sequence, Tuple
+
+from .batch_scheduler import get_executor
+from .segment_retry import DeadLetters
+
+
+class PartPipeline:
+    """按部件推进的流水线翻译
+
+    - translate_chunk(processed_texts, src_texts) -> List[str]：引擎调用（线程池中执行，需返回等长结果）；
+      src_texts 为同位置的原文（预处理前），供修复失败时改译原文
+    - prepare(src_texts) -> (processed_texts, ctx)：术语预处理等（可选）
+    - finalize(outputs, ctx) -> List[str]：术语后处理等（可选）
+    - on_ready(part_id, payload, translations)：部件全部片段已翻译时回调
+    - dead_letters：整批抛出异常时，该批片段（保留原文）记入死信，下标为片段在本流水线中的提交顺序
+    - max_inflight：在途批次上限（已提交到常驻线程池的批次数），超出时生产者等待（限制已解析未写出的部件数量）；
+      实际同时发出的请求数由 translate_chunk 内的引擎并发名额约束
+    """
+
+    def __init__(self, translate_chunk: Callable[[List[str], List[str]], Sequence[Any]], chunk_size: int, workers: int,
+                 on_ready: Callable[[Hashable, Any, Dict[str, str]], None],
+                 prepare: Optional[Callable[[List[str]], Tuple[List[str], Any]]] = None,
+                 finalize: Optional[Callable[[List[Any], Any], List[Any]]] = None,
+                 max_inflight: Optional[int] = None, dead_letters: Optional[DeadLetters] = None,
+                 debug: bool = False):
+        self.translate_chunk = translate_chunk
+        self.chunk_size = max(1, int(chunk_size))
+        self.workers = max(1, int(workers))
+        self.on_ready = on_ready
+        self.prepare = prepare
+        self.finalize = finalize
+        self.max_inflight = max(1, int(max_inflight or self.workers * 2))
+        self.dead_letters = dead_letters
+        self.debug = debug
+
+        self.translations: Dict[str, str] = {}
+        self._seen: set = set()
+        self._pending_src: List[str] = []
+        self._waiting: Dict[str, List[Hashable]] = {}       # 片段 -> 等待它的部件
+        self._parts: Dict[Hashable, List[Any]] = {}         # 部件 -> [未完成片段数, payload]
+        self._running: Dict[Any, Tuple[List[str], Any, int]] = {}
+        self._submitted = 0                                  # 已提交片段数（死信下标）
+        self._executor = get_executor()
+        self.stats = {"parts": 0, "segments": 0, "unique": 0, "batches": 0}
+
+    # ---------- 生产者 ----------
+    def add_part(self, part_id: Hashable, texts: Sequence[str], payload: Any = None):
+        """登记一个部件及其片段（已过滤）；没有待翻译片段的部件立即回调"""
+        self.stats["parts"] += 1
+        self.stats["segments"] += len(texts)
+        remaining = 0
+        for text in dict.fromkeys(texts):
+            if text in self.translations:
+                continue
+            remaining += 1
+            self._waiting.setdefault(text, []).append(part_id)
+            if text not in self._seen:
+                self._seen.add(text)
+                self._pending_src.append(text)
+        self.stats["unique"] = len(self._seen)
+        if remaining == 0:
+            self.on_ready(part_id, payload, self.translations)
+        else:
+            self._parts[part_id] = [remaining, payload]
+        while len(self._pending_src) >= self.chunk_size:
+            self._submit(self._pending_src[:self.chunk_size])
+            del self._pending_src[:self.chunk_size]
+        self._drain(block=False)
+
+    def finish(self) -> Dict[str, str]:
+        """提交剩余片段并等待全部部件完成，返回 原文 -> 译文"""
+        if self._pending_src:
+            self._submit(self._pending_src)
+            self._pending_src = []
+        while self._running:
+            self._drain(block=True)
+        # 理论上不会残留；防御性地把剩余部件按现有译文回写
+        for part_id, (_, payload) in list(self._parts.items()):
+            self._parts.pop(part_id, None)
+            self.on_ready(part_id, payload, self.translations)
+        if self.debug:
+            print(f"[Pipeline] parts={self.stats['parts']} segments={self.stats['segments']} "
+                  f"unique={self.stats['unique']} batches={self.stats['batches']}")
+        return self.translations
+
+    def close(self):
+        """异常退出时取消尚未开始的批次（不等待剩余批次的结果；常驻线程池不关闭）"""
+        for fut in list(self._running):
+            fut.cancel()
+        self._running.clear()
+
+    # ---------- 内部 ----------
+    def _submit(self, sources: List[str]):
+        # 背压：在途批次过多时先消化已完成的批次
+        while len(self._running) >= self.max_inflight:
+            self._drain(block=True)
+        if self.prepare is not None:
+            processed, ctx = self.prepare(sources)
+        else:
+            processed, ctx = list(sources), None
+        fut = self._executor.submit(self.translate_chunk, list(processed), list(sources))
+        self._running[fut] = (sources, ctx, self._submitted)
+        self._submitted += len(sources)
+        self.stats["batches"] += 1
+
+    def _drain(self, block: bool):
+        if not self._running:
+            return
+        done, _ = wait(list(self._running), timeout=None if block else 0, return_when=FIRST_COMPLETED)
+        for fut in done:
+            sources, ctx, offset = self._running.pop(fut)
+            try:
+                outputs = list(fut.result() or [])
+            except Exception as e:
+                print(f"[Pipeline] batch of {len(sources)} failed, keeping source text: {e}")
+                outputs = []
+                if self.dead_letters is not None:
+                    for i, src in enumerate(sources):
+                        self.dead_letters.add(offset + i, src, f"batch_error: {type(e).__name__}", 1)
+            if self.finalize is not None and outputs:
+                outputs = self.finalize(outputs, ctx)
+            for i, src in enumerate(sources):
+                out = outputs[i] if i < len(outputs) else None
+                if isinstance(out, list) and len(out) == 1:
+                    out = out[0]
+                # 保底：空串或None回退原文，避免清空
+                self.translations[src] = out if isinstance(out, str) and out.strip() else src
+                self._resolve(src)
+
+    def _resolve(self, src: str):
+        for part_id in self._waiting.pop(src, []):
+            entry = self._parts.get(part_id)
+            if entry is None:
+                continue
+            entry[0] -= 1
+            if entry[0] <= 0:
+                self._parts.pop(part_id, None)
+                self.on_ready(part_id, entry[1], self.translations)
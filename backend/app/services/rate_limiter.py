@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+"""
+集群级限流（令牌桶）
+
+每个 引擎/API Key 维护两个令牌桶：
+- 请求桶：容量 = 每分钟请求数（RPM），按 RPM/60 每秒补充
+- Token 桶：容量 = 每分钟 token 数（TPM），按 TPM/60 每秒补充；请求前按负载估算扣减，
+  拿到响应后按实际 usage 结算差额（允许透支，透支部分由后续请求等待偿还）
+
+后端：
+- redis：Lua 脚本原子扣减，所有 Celery worker 与 API 进程共享同一额度（使用 Redis 服务器时间）
+- local：进程内实现，供单机/无 Redis 部署使用
+RATE_LIMIT_BACKEND=auto（默认）时优先 Redis，连接失败自动退回本地。
+
+额度来源（优先级从高到低）：环境变量 <ENGINE>_RPM / <ENGINE>_TPM、
+translation_engines.api_config 中的 rpm / tokens_per_minute、translation_engines.rate_limit 列。
+0 或空表示不限制。
+"""
+import os
+import json
+import math
+import time
+import asyncio
+import hashlib
+import logging
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").strip().lower() in ("1", "true", "yes", "on")
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "auto").strip().lower()
+# 单次获取的最长等待；超时后放行并记录告警，避免任务被无限挂起
+RATE_LIMIT_MAX_WAIT_SECONDS = float(os.getenv("RATE_LIMIT_MAX_WAIT_SECONDS", "120"))
+REDIS_URL = os.getenv("REDIS_URL", "")
+
+# KEYS[1]=请求桶 KEYS[2]=token 桶；ARGV: rpm, tpm, 请求数, token 数
+# 两个桶都满足时才同时扣减；返回需要等待的毫秒数（0 表示已获取）
+_ACQUIRE_LUA = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local function refill(key, cap)
+  local data = redis.call('HMGET', key, 'tokens', 'ts')
+  local tokens = tonumber(data[1])
+  local ts = tonumber(data[2])
+  if tokens == nil then return cap end
+  return math.min(cap, tokens + (now - ts) / 60000.0 * cap)
+end
+local function need(avail, cap, cost)
+  if cap <= 0 or cost <= 0 then return 0 end
+  if avail >= math.min(cost, cap) then return 0 end
+  return math.ceil((math.min(cost, cap) - avail) / cap * 60000.0)
+end
+local rpm = tonumber(ARGV[1]); local tpm = tonumber(ARGV[2])
+local rcost = tonumber(ARGV[3]); local tcost = tonumber(ARGV[4])
+local ravail = 0; local tavail = 0
+if rpm > 0 then ravail = refill(KEYS[1], rpm) end
+if tpm > 0 then tavail = refill(KEYS[2], tpm) end
+local wait = math.max(need(ravail, rpm, rcost), need(tavail, tpm, tcost))
+if wait == 0 then
+  if rpm > 0 then ravail = ravail - rcost end
+  if tpm > 0 then tavail = tavail - tcost end
+end
+if rpm > 0 then
+  redis.call('HSET', KEYS[1], 'tokens', ravail, 'ts', now)
+  redis.call('PEXPIRE', KEYS[1], 120000)
+end
+if tpm > 0 then
+  redis.call('HSET', KEYS[2], 'tokens', tavail, 'ts', now)
+  redis.call('PEXPIRE', KEYS[2], 120000)
+end
+return wait
+"""
+
+# KEYS[1]=token 桶；ARGV: tpm, 差额（实际-估算，正数表示多扣）
+_SETTLE_LUA = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local cap = tonumber(ARGV[1]); local delta = tonumber(ARGV[2])
+local data = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(data[1]); local ts = tonumber(data[2])
+if tokens == nil then tokens = cap; ts = now end
+tokens = math.min(cap, tokens + (now - ts) / 60000.0 * cap) - delta
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('PEXPIRE', KEYS[1], 120000)
+return 0
+"""
+
+
+class _LocalBackend:
+    """进程内令牌桶（单机部署或 Redis 不可用时使用）"""
+
+    def __init__(self):
+        self._buckets: Dict[str, Tuple[float, float]] = {}
+        self._lock = threading.Lock()
+
+    def _refill(self, key: str, cap: float, now: float) -> float:
+        tokens, ts = self._buckets.get(key, (cap, now))
+        return min(cap, tokens + (now - ts) / 60.0 * cap)
+
+    @staticmethod
+    def _need(avail: float, cap: float, cost: float) -> float:
+        if cap <= 0 or cost <= 0:
+            return 0.0
+        cost = min(cost, cap)
+        if avail >= cost:
+            return 0.0
+        return (cost - avail) / cap * 60.0
+
+    def try_acquire(self, key: str, rpm: int, tpm: int, requests: int, tokens: int) -> float:
+        now = time.monotonic()
+        rkey, tkey = f"{key}:req", f"{key}:tok"
+        with self._lock:
+            ravail = self._refill(rkey, rpm, now) if rpm > 0 else 0.0
+            tavail = self._refill(tkey, tpm, now) if tpm > 0 else 0.0
+            wait = max(self._need(ravail, rpm, requests), self._need(tavail, tpm, tokens))
+            if wait == 0:
+                ravail -= requests
+                tavail -= tokens
+            if rpm > 0:
+                self._buckets[rkey] = (ravail, now)
+            if tpm > 0:
+                self._buckets[tkey] = (tavail, now)
+            return wait
+
+    def settle(self, key: str, tpm: int, delta: int):
+        now = time.monotonic()
+        tkey = f"{key}:tok"
+        with self._lock:
+            avail = self._refill(tkey, tpm, now)
+            self._buckets[tkey] = (avail - delta, now)
+
+
+class _RedisBackend:
+    def __init__(self, url: str):
+        import redis  # 可选依赖：celery[redis] 已带
+        self._client = redis.Redis.from_url(url, socket_timeout=2, socket_connect_timeout=2)
+        self._client.ping()
+        self._acquire = self._client.register_script(_ACQUIRE_LUA)
+        self._settle = self._client.register_script(_SETTLE_LUA)
+
+    def try_acquire(self, key: str, rpm: int, tpm: int, requests: int, tokens: int) -> float:
+        wait_ms = self._acquire(keys=[f"{key}:req", f"{key}:tok"], args=[rpm, tpm, requests, tokens])
+        return float(wait_ms or 0) / 1000.0
+
+    def settle(self, key: str, tpm: int, delta: int):
+        self._settle(keys=[f"{key}:tok"], args=[tpm, delta])
+
+
+class RateLimiter:
+    def __init__(self):
+        self._local = _LocalBackend()
+        self._redis: Optional[_RedisBackend] = None
+        self._redis_checked = False
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, float]] = {}
+
+    def _backend(self):
+        if RATE_LIMIT_BACKEND == "local":
+            return self._local
+        if not self._redis_checked:
+            with self._lock:
+                if not self._redis_checked:
+                    self._redis_checked = True
+                    if REDIS_URL:
+                        try:
+                            self._redis = _RedisBackend(REDIS_URL)
+                            logger.info("[RateLimiter] using Redis token buckets")
+                        except Exception as e:
+                            logger.warning(f"[RateLimiter] Redis unavailable, falling back to local buckets: {e}")
+        return self._redis or self._local
+
+    def _try(self, key: str, rpm: int, tpm: int, requests: int, tokens: int) -> float:
+        backend = self._backend()
+        try:
+            return backend.try_acquire(key, rpm, tpm, requests, tokens)
+        except Exception as e:
+            if backend is self._local:
+                raise
+            logger.warning(f"[RateLimiter] Redis acquire failed, using local bucket: {e}")
+            return self._local.try_acquire(key, rpm, tpm, requests, tokens)
+
+    def _record(self, key: str, waited: float):
+        with self._lock:
+            s = self._stats.setdefault(key, {"acquired": 0, "waited": 0, "wait_seconds": 0.0})
+            s["acquired"] += 1
+            if waited > 0:
+                s["waited"] += 1
+                s["wait_seconds"] = round(s["wait_seconds"] + waited, 3)
+
+    def acquire(self, key: str, rpm: int, tpm: int = 0, tokens: int = 0, requests: int = 1) -> float:
+        """阻塞直到获得额度，返回等待秒数"""
+        if not RATE_LIMIT_ENABLED or (rpm <= 0 and tpm <= 0):
+            return 0.0
+        start = time.monotonic()
+        while True:
+            wait = self._try(key, rpm, tpm, requests, tokens)
+            waited = time.monotonic() - start
+            if wait <= 0:
+                break
+            if waited + wait > RATE_LIMIT_MAX_WAIT_SECONDS:
+                logger.warning(f"[RateLimiter] {key} waited {waited:.1f}s, proceeding without quota")
+                break
+            time.sleep(min(wait, 1.0))
+        self._record(key, waited)
+        return waited
+
+    async def acquire_async(self, key: str, rpm: int, tpm: int = 0, tokens: int = 0, requests: int = 1) -> float:
+        """acquire 的异步版本（等待期间不阻塞事件循环）"""
+        if not RATE_LIMIT_ENABLED or (rpm <= 0 and tpm <= 0):
+            return 0.0
+        start = time.monotonic()
+        while True:
+            if self._redis is not None:
+                wait = await asyncio.to_thread(self._try, key, rpm, tpm, requests, tokens)
+            else:
+                wait = self._try(key, rpm, tpm, requests, tokens)
+            waited = time.monotonic() - start
+            if wait <= 0:
+                break
+            if waited + wait > RATE_LIMIT_MAX_WAIT_SECONDS:
+                logger.warning(f"[RateLimiter] {key} waited {waited:.1f}s, proceeding without quota")
+                break
+            await asyncio.sleep(min(wait, 1.0))
+        self._record(key, waited)
+        return waited
+
+    def settle(self, key: str, tpm: int, estimated: int, actual: int):
+        """按实际 token 用量结算估算差额"""
+        if not RATE_LIMIT_ENABLED or tpm <= 0:
+            return
+        delta = int(actual or 0) - int(estimated or 0)
+        if delta == 0:
+            return
+        backend = self._backend()
+        try:
+            backend.settle(key, tpm, delta)
+        except Exception as e:
+            logger.warning(f"[RateLimiter] settle failed: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = {k: dict(v) for k, v in self._stats.items()}
+        return {
+            "enabled": RATE_LIMIT_ENABLED,
+            "backend": "redis" if self._redis is not None else "local",
+            "keys": stats,
+        }
+
+
+rate_limiter = RateLimiter()
+
+
+def estimate_tokens(payload: Any) -> int:
+    """粗略估算一次请求的输入+输出 tokens（按字符数；CJK 约 1 字符/token，拉丁语约 4 字符/token）"""
+    if not payload:
+        return 0
+    try:
+        raw = payload if isinstance(payload, str) else json.dumps(payload, ensure_ascii=False)
+    except Exception:
+        raw = str(payload)
+    # 输入按 ~2 字符/token，输出按与输入同量级估算
+    return int(math.ceil(len(raw) / 2.0)) * 2
+
+
+def limits_for_engine(engine) -> Tuple[str, int, int]:
+    """返回 (限流键, rpm, tpm)；限流键按 引擎名 + API Key 摘要 区分"""
+    from .engine_config import EngineConfig
+    name = getattr(engine, 'engine_key', None) or engine.__class__.__name__.lower()
+    rpm, tpm = EngineConfig.get_rate_limits(name)
+    api_key = str(getattr(engine, 'api_key', '') or getattr(engine, 'app_id', '') or '')
+    digest = hashlib.sha1(api_key.encode('utf-8')).hexdigest()[:12]
+    return f"ratelimit:{name}:{digest}", rpm, tpm
+
+
+def _usage_tokens(response) -> int:
+    try:
+        data = response.json() if hasattr(response, 'json') else response
+        return int((data or {}).get("usage", {}).get("total_tokens", 0) or 0)
+    except Exception:
+        return 0
+
+
+def acquire_for_engine(engine, payload: Any = None) -> Tuple[str, int, int]:
+    """引擎请求前获取额度，返回结算凭据 (key, tpm, 估算 tokens)"""
+    key, rpm, tpm = limits_for_engine(engine)
+    est = estimate_tokens(payload) if tpm > 0 else 0
+    rate_limiter.acquire(key, rpm, tpm, tokens=est)
+    return key, tpm, est
+
+
+async def acquire_for_engine_async(engine, payload: Any = None) -> Tuple[str, int, int]:
+    key, rpm, tpm = limits_for_engine(engine)
+    est = estimate_tokens(payload) if tpm > 0 else 0
+    await rate_limiter.acquire_async(key, rpm, tpm, tokens=est)
+    return key, tpm, est
+
+
+def settle_for_engine(ticket: Tuple[str, int, int], response) -> None:
+    key, tpm, est = ticket
+    if tpm > 0 and response is not None:
+        rate_limiter.settle(key, tpm, est, _usage_tokens(response))
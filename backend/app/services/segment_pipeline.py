@@ -0,0 +1,359 @@
+#!/usr/bin/env python3
+"""
+各格式翻译器共用的片段流水线（SegmentPipeline）
+
+DOCX / XLSX / PPTX / 文本翻译器过去各自实现一遍：可翻译判断、去重、术语前后处理、引擎调用、
+并发与重试、token 统计，彼此的并发方式、分类规则与统计口径都不一致。这里把这些步骤收敛到一处：
+- 过滤：accept(plain) 判断片段是否需要翻译（默认 is_translatable）
+- 去重与调度：基于 PartPipeline，按引擎 batch_size 成批提交；在途批次受引擎自适应并发控制器约束，
+  异步模式下各批次提交到任务共用的事件循环（AsyncTranslateLoop），批次内请求共用在途请求上限
+- 缓存：任务级 SegmentStore，已有译文的片段不再提交引擎（跨任务缓存由 translate_batch 内的翻译记忆负责）
+- 术语：统一的分类规则（启用分类且未选择分类时不应用术语）；整个任务使用开始时的术语表版本；
+  批次译完后校验占位符，只重发丢失占位符的片段，仍失败的改译不带占位符的原文
+- 重试：批次内缺失/无效下标延迟重试，超出预算记入 dead_letters
+- 统计：token、字符数、片段数、成功翻译数、死信、引擎请求统计（engine_metrics），返回统一的结果字段
+- 回写：部件全部片段译完时回调 on_ready（调用线程中执行）
+
+格式模块只需提供抽取（部件 -> 片段列表）与写回（译文 -> 部件）两个适配函数。
+"""
+import threading
+from typing import Any, Callable, Dict, Hashable, List, Optional, Sequence
+
+from app.services.utils_translator import translate_batch
+from app.services.async_engine import AsyncTranslateLoop, is_async_mode
+from app.services.concurrency_controller import get_controller
+from app.services.segment_retry import DeadLetters, run_with_salvage
+from app.services.segment_store import SegmentStore
+from app.services.multi_engine_translator import EngineMetrics
+from app.services.part_pipeline import PartPipeline
+from app.services.terminology_service import (
+    get_terminology_options,
+    get_glossary_version,
+    preprocess_texts,
+    preprocess_texts_with_categories,
+    postprocess_texts,
+    repair_placeholders,
+)
+from app.database import SessionLocal
+
+# 只用于本地流程、不下发给引擎的参数
+LOCAL_OPTIONS = ("category_ids", "async_mode", "segment_store", "workers", "max_workers", "debug")
+
+
+def is_translatable(text):
+    """判断是否需要翻译：去掉首尾空格后为空、纯数字、纯符号则跳过"""
+    if not text or not isinstance(text, str) or not text.strip():
+        return False
+    stripped = text.strip()
+    if stripped.isdigit():
+        return False
+    if all(not ch.isalnum() for ch in stripped):
+        return False
+    return True
+
+
+class UsageCollector:
+    """线程安全的 token 用量收集器：每个并行 worker 的每个批次都把实际 tokens 记到这里"""
+
+    def __init__(self, forward: Optional[Callable[[Any], None]] = None):
+        self._lock = threading.Lock()
+        self.tokens = 0
+        self.batches = 0
+        # 同时转记到任务级存储（SegmentStore.add_tokens），回退路径上报整次任务的消耗
+        self.forward = forward
+
+    def add(self, tokens):
+        try:
+            tokens = int(tokens or 0)
+        except Exception:
+            tokens = 0
+        with self._lock:
+            self.tokens += tokens
+            self.batches += 1
+        if self.forward is not None:
+            self.forward(tokens)
+
+
+def _call_translate(texts, src_lang, tgt_lang, engine, usage=None, **options):
+    # 失败片段以 None 返回，交给 run_with_salvage 按下标重发
+    res = translate_batch(texts, src_lang, tgt_lang, engine=engine, report_failures=True, **options)
+    # 统一返回为 List[Optional[str]]，tokens 记入 usage
+    if isinstance(res, tuple):
+        if usage is not None and len(res) >= 2:
+            usage.add(res[1])
+        return res[0]
+    return res
+
+
+def batch_translate_with_retry(texts, src_lang, tgt_lang, engine, debug=False, usage=None, dead_letters=None, **options):
+    """批量翻译；只对缺失/无效的下标延迟重试（不再整块二分重发），超出重试预算记入 dead_letters"""
+    return run_with_salvage(
+        texts,
+        lambda chunk: _call_translate(chunk, src_lang, tgt_lang, engine, usage=usage, **options),
+        chunk_size=max(1, len(texts)),
+        workers=1,
+        dead_letters=dead_letters,
+        debug=debug,
+    )
+
+
+def _request_chunk_size(engine, total, workers):
+    """每个并行任务携带的条数：取引擎 batch_size，使并发度由控制器而不是切片数决定"""
+    try:
+        from app.services.engine_config import EngineConfig
+        size = int(EngineConfig.get_engine_config(engine).get("batch_size") or 0)
+    except Exception:
+        size = 0
+    if size <= 0:
+        # 未配置 batch_size：按总量平分；流水线模式下总量未知，取默认 20
+        size = max(1, total // max(1, workers)) if total else 20
+    return max(1, size)
+
+
+def _terminology_hooks(db, options, src_lang, tgt_lang, user_id, cat_ids, version=None, term_scope="unified"):
+    """返回 (prepare, finalize)：术语预处理/后处理；未启用术语时返回 (None, None)
+
+    version 为任务开始时读取的术语表版本：整个任务使用同一版本的术语表（编辑在下一个任务生效）
+    term_scope 为各格式沿用的术语范围规则：
+    - "unified"（DOCX、TXT、openpyxl/python-pptx 回退路径）：启用分类且未选择分类时不应用术语；
+      未启用分类时应用全部公共 + 用户术语
+    - "selected_or_all"（XLSX/PPTX OOXML）：选择了分类则只用这些分类，否则应用全部公共 + 用户术语
+    - "all"（translate_pptx）：忽略分类，始终应用全部公共 + 用户术语
+    """
+    if not options.get("terminology_enabled", True):
+        return None, None
+    case_sensitive = bool(options.get("case_sensitive", False))
+    has_cats = not (cat_ids is None or (isinstance(cat_ids, list) and len(cat_ids) == 0))
+    if term_scope == "all":
+        use_categories = False
+    elif term_scope == "selected_or_all":
+        use_categories = has_cats
+    else:
+        # 规则：若启用分类且未显式选择分类（None）或选择为空数组([])，则不应用术语
+        use_categories = bool(options.get("categories_enabled", True))
+        if use_categories and not has_cats:
+            return None, None
+
+    if use_categories:
+        def prepare(texts):
+            return preprocess_texts_with_categories(
+                db, texts, src_lang, tgt_lang, cat_ids, case_sensitive=case_sensitive, user_id=user_id, version=version
+            )
+    else:
+        def prepare(texts):
+            return preprocess_texts(db, texts, src_lang, tgt_lang, case_sensitive=case_sensitive, user_id=user_id,
+                                    version=version)
+
+    return prepare, postprocess_texts
+
+
+class SegmentPipeline:
+    """格式无关的片段翻译核心
+
+    用法：
+        with SegmentPipeline(src, tgt, engine, on_ready=write_part, **kwargs) as pipe:
+            for part in parts:
+                pipe.add_part(part, texts, payload)
+            translations = pipe.finish()
+        meta = pipe.result()
+
+    - on_ready(part_id, payload, translations)：部件全部片段有译文时回调；不传则只收集译文
+    - repair(processed, outputs, translate)：批次译完后的格式专属校验（在线程池中执行），
+      translate(texts, **extra_options) 以相同引擎参数重新翻译一组片段
+    - store：任务级 SegmentStore，可在主路径与回退路径之间共享
+    - term_scope：术语范围规则（见 _terminology_hooks），各格式沿用原有行为
+    - 其余关键字参数（style_instruction 等）原样下发给引擎
+    """
+
+    def __init__(self, src_lang: str, tgt_lang: str, engine: str = "deepseek", workers: int = 5,
+                 user_id: Optional[int] = None, category_ids=None, term_scope: str = "unified",
+                 on_ready: Optional[Callable[[Hashable, Any, Dict[str, str]], None]] = None,
+                 accept: Optional[Callable[[str], bool]] = is_translatable,
+                 repair: Optional[Callable[[List[str], List[Any], Callable], List[Any]]] = None,
+                 store: Optional[SegmentStore] = None, async_mode=None, debug: bool = False, **engine_options):
+        self.src_lang = src_lang
+        self.tgt_lang = tgt_lang
+        self.engine = engine
+        self.accept = accept
+        self.repair = repair
+        self.store = store
+        self.debug = debug
+        self.on_ready = on_ready
+        self.engine_options = {k: v for k, v in engine_options.items() if k not in LOCAL_OPTIONS}
+        # 任务级引擎请求统计（目前由 Qwen3 逐条请求路径记录）
+        self.metrics = EngineMetrics()
+        self.engine_options["metrics"] = self.metrics
+        self.async_mode = is_async_mode(async_mode)
+        self.usage = UsageCollector(forward=store.add_tokens if store is not None else None)
+        self.dead_letters = DeadLetters()
+        self.controller = get_controller(engine, initial=workers)
+
+        self.segments: List[str] = []
+        self.character_count = 0
+        self.translations: Dict[str, str] = {}
+        # 占位符修复统计
+        self._repair_lock = threading.Lock()
+        self.term_repair = {"lost": 0, "resent": 0, "fallback": 0}
+
+        self._db = SessionLocal()
+        try:
+            options = get_terminology_options(self._db)
+            version = get_glossary_version(self._db, refresh=True) if options.get("terminology_enabled", True) else None
+            self._prepare, self._finalize = _terminology_hooks(
+                self._db, options, src_lang, tgt_lang, user_id, category_ids, version, term_scope=term_scope
+            )
+            if self._prepare is not None:
+                # 术语表版本进入翻译记忆的缓存键：术语变更后不复用旧占位符下的译文
+                self.engine_options.setdefault("terminology_version", version)
+        except Exception:
+            self._db.close()
+            raise
+        # 异步模式：整个任务共用一个事件循环与异步客户端
+        self._async_loop = AsyncTranslateLoop() if self.async_mode else None
+        self._pipeline = PartPipeline(
+            self._translate_chunk,
+            chunk_size=_request_chunk_size(engine, 0, workers),
+            workers=max(1, self.controller.max_limit),
+            on_ready=self._ready, prepare=self._prepare_chunk, finalize=self._finalize_chunk,
+            dead_letters=self.dead_letters, debug=debug,
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    # ---------- 适配器接口 ----------
+    def add_part(self, part_id: Hashable, texts: Sequence[str], payload: Any = None,
+                 plains: Optional[Sequence[str]] = None) -> List[str]:
+        """登记一个部件的片段；plains 为用于过滤与字符统计的纯文本（默认即 texts）。返回过滤后的片段"""
+        plains = texts if plains is None else plains
+        kept: List[str] = []
+        for text, plain in zip(texts, plains):
+            if self.accept is not None and not self.accept(plain):
+                continue
+            kept.append(text)
+            self.character_count += len(plain)
+        self.segments.extend(kept)
+        if self.store is not None:
+            # 任务级缓存命中的片段直接视为已翻译，不再提交引擎
+            for text in kept:
+                if text not in self._pipeline.translations and text in self.store:
+                    self._pipeline.translations[text] = self.store.get(text)
+        self._pipeline.add_part(part_id, kept, payload)
+        return kept
+
+    def finish(self) -> Dict[str, str]:
+        """等待全部批次完成并回写剩余部件，返回 原文 -> 译文"""
+        self.translations = self._pipeline.finish()
+        self._pipeline = None
+        if self.debug:
+            print(f"[SegmentPipeline] {len(self.segments)} segments, {len(self.translations)} unique, "
+                  f"{self.usage.tokens} tokens, {self.dead_letters.count} dead letters")
+        return self.translations
+
+    def close(self):
+        if self._pipeline is not None:
+            self._pipeline.close()
+            self._pipeline = None
+        if self._async_loop is not None:
+            self._async_loop.close()
+            self._async_loop = None
+        try:
+            self._db.close()
+        except Exception:
+            pass
+
+    def result(self, **extra) -> Dict[str, Any]:
+        """统一的统计字段：片段级总数 / 成功翻译数（译文与原文不同）"""
+        translations = self.translations
+        meta = {
+            "token_count": self.store.token_count if self.store is not None else self.usage.tokens,
+            "character_count": self.character_count,
+            "total_texts": len(self.segments),
+            "translated_texts": sum(1 for s in self.segments if translations.get(s, s) != s),
+            "dead_letter_count": self.dead_letters.count,
+            "dead_letters": self.dead_letters.to_list(),
+        }
+        engine_metrics = self.metrics.as_dict()
+        if engine_metrics["total"]:
+            meta["engine_metrics"] = engine_metrics
+        if self.term_repair["lost"]:
+            meta["term_placeholder_repair"] = dict(self.term_repair)
+        meta.update(extra)
+        return meta
+
+    # ---------- 内部 ----------
+    def _ready(self, part_id, payload, translations):
+        if self.on_ready is not None:
+            self.on_ready(part_id, payload, translations)
+
+    def _prepare_chunk(self, sources):
+        if self._prepare is None:
+            return list(sources), (sources, None)
+        processed, mappings = self._prepare(sources)
+        return processed, (sources, mappings)
+
+    def _finalize_chunk(self, outputs, ctx):
+        sources, mappings = ctx
+        if self._finalize is not None:
+            outputs = self._finalize(outputs, mappings)
+        if self.store is not None:
+            self.store.put_many(sources, outputs)
+        return outputs
+
+    def _translate(self, texts, **extra):
+        options = dict(self.engine_options, **extra)
+        # 在途批次数由引擎的自适应并发控制器决定；无效下标在批次内延迟重试
+        with self.controller.slot():
+            if self.async_mode:
+                # 异步模式：批次提交到任务共用的事件循环，在途请求数受 ENGINE_ASYNC_CONCURRENCY 约束
+                return run_with_salvage(
+                    texts,
+                    lambda chunk: self._async_loop.translate(
+                        chunk, self.src_lang, self.tgt_lang, self.engine, usage=self.usage,
+                        report_failures=True, **options
+                    ),
+                    chunk_size=max(1, len(texts)),
+                    workers=1,
+                    dead_letters=self.dead_letters,
+                    debug=self.debug,
+                )
+            return batch_translate_with_retry(
+                texts, self.src_lang, self.tgt_lang, self.engine, debug=self.debug,
+                usage=self.usage, dead_letters=self.dead_letters, **options
+            )
+
+    def _translate_chunk(self, processed, sources):
+        outputs = list(self._translate(processed) or [])
+        if self._prepare is not None and outputs:
+            outputs = self._repair_terms(processed, outputs, sources)
+        if self.repair is not None and outputs:
+            outputs = list(self.repair(processed, outputs, self._translate))
+        return outputs
+
+
+    def _repair_terms(self, processed, outputs, sources):
+        """只重发丢失术语占位符的片段（合并为一批）；仍丢失的改译同位置的原文"""
+        def _fallback(indices):
+            # 按批次内位置取原文：大小写不同的原文可能预处理成同一段占位符文本
+            return self._translate([sources[i] for i in indices])
+
+        outputs, stats = repair_placeholders(processed, outputs, self._translate, fallback=_fallback)
+        if stats["lost"]:
+            with self._repair_lock:
+                for k, v in stats.items():
+                    self.term_repair[k] += v
+            if self.debug:
+                print(f"[SegmentPipeline] placeholder repair: {stats}")
+        return outputs
+
+
+def translate_segments(texts: Sequence[str], src_lang: str, tgt_lang: str, engine: str = "deepseek", **kwargs):
+    """一次性翻译一组片段（分阶段的格式模块使用）：返回 (原文 -> 译文, 统计字段)"""
+    with SegmentPipeline(src_lang, tgt_lang, engine, **kwargs) as pipe:
+        pipe.add_part(0, list(texts))
+        translations = pipe.finish()
+    return translations, pipe.result()
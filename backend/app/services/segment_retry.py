@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+片段级失败补救：只重发缺失/无效的下标
+
+引擎在返回条数不足或请求失败时会用原文回填，之前的做法是整块二分重发（直到单条），
+一个批次里丢了一条就会被重复翻译多次。这里改为按下标判断有效性：
+- 有效：非空字符串。引擎以 None 明确报告失败的片段（translate_batch(report_failures=True)），
+  不再根据“译文与原文相同”推断失败：编号、产品名、URL、纯术语占位符原样返回是正常结果
+- 无效的下标进入延迟重试队列，合并到后续批次一起发送（不阻塞文档其余部分）
+- 每个下标的重试次数受 SEGMENT_RETRY_MAX 约束，超出后记入死信列表并保留原文
+
+run_with_salvage 负责调度：按块并行提交到进程级常驻线程池（batch_scheduler），完成一块即按下标
+回填有效结果，无效下标并入下一个提交的块；主队列耗尽后剩余的延迟下标按块补发。
+workers=1 时在调用线程内串行执行，不占用线程池。
+"""
+import os
+import threading
+from collections import deque
+from concurrent.futures import wait, FIRST_COMPLETED
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from .batch_scheduler import cut_batches, get_executor
+
+SEGMENT_RETRY_MAX = int(os.getenv("SEGMENT_RETRY_MAX", "2"))
+# 任务记录中保留的死信条数上限
+DEAD_LETTER_LIMIT = int(os.getenv("DEAD_LETTER_LIMIT", "200"))
+
+
+def invalid_reason(source: Any, output: Any) -> Optional[str]:
+    """返回无效原因（missing/empty），有效时返回 None；source 仅用于与空原文区分"""
+    if output is None:
+        return "missing"
+    if isinstance(output, list) and len(output) == 1:
+        output = output[0]
+    if not isinstance(output, str):
+        return "missing"
+    if not output.strip():
+        # 空白原文的空白译文是正常结果
+        src = source if isinstance(source, str) else str(source or "")
+        return "empty" if src.strip() else None
+    return None
+
+
+class DeadLetters:
+    """线程安全的死信收集器（重试预算耗尽的片段）"""
+
+    def __init__(self, limit: int = DEAD_LETTER_LIMIT):
+        self._lock = threading.Lock()
+        self._items: List[Dict[str, Any]] = []
+        self.limit = limit
+        self.count = 0
+
+    def add(self, index: int, text: Any, reason: str, attempts: int):
+        with self._lock:
+            self.count += 1
+            if len(self._items) < self.limit:
+                self._items.append({
+                    "index": index,
+                    "text": str(text)[:200],
+                    "reason": reason,
+                    "attempts": attempts,
+                })
+
+    def to_list(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return list(self._items)
+
+
+def run_with_salvage(texts: Sequence[Any], translate_chunk: Callable[[List[Any]], Any], chunk_size: int,
+                     workers: int = 1, max_retries: Optional[int] = None, dead_letters: Optional[DeadLetters] = None,
+                     debug: bool = False) -> List[Any]:
+    """按块并行翻译 texts，只对无效下标延迟重试；返回与 texts 等长的结果（无效时保留原文）
+
+    translate_chunk(list) 返回 List[str]（或 ([...], tokens)）；抛异常时整块视为缺失。
+    """
+    n = len(texts)
+    results: List[Any] = list(texts)
+    if n == 0:
+        return results
+    retries = SEGMENT_RETRY_MAX if max_retries is None else max(0, int(max_retries))
+    chunk_size = max(1, int(chunk_size))
+    workers = max(1, int(workers))
+    attempts = [0] * n
+    queue = deque(cut_batches(n, chunk_size))
+    deferred: List[int] = []
+    # 每个新块最多并入的延迟下标数
+    merge_quota = max(1, chunk_size // 2)
+    stats = {"retried": 0, "dead": 0}
+
+    def _call(idxs: List[int]):
+        out = translate_chunk([texts[i] for i in idxs])
+        if isinstance(out, tuple) and len(out) >= 1:
+            out = out[0]
+        return out
+
+    def _next_chunk() -> List[int]:
+        if queue:
+            idxs = queue.popleft()
+            if deferred:
+                # 延迟重试的下标并入后续批次
+                idxs = deferred[:merge_quota] + idxs
+                del deferred[:merge_quota]
+        else:
+            idxs = deferred[:chunk_size]
+            del deferred[:chunk_size]
+        for i in idxs:
+            attempts[i] += 1
+        return idxs
+
+    def _collect(idxs: List[int], outs: Any):
+        # 结果按下标回填：失败/缺失只影响本块的下标
+        for j, i in enumerate(idxs):
+            out = outs[j] if isinstance(outs, list) and j < len(outs) else None
+            if isinstance(out, list) and len(out) == 1:
+                out = out[0]
+            reason = invalid_reason(texts[i], out)
+            if reason is None:
+                results[i] = out
+            elif attempts[i] <= retries:
+                deferred.append(i)
+                stats["retried"] += 1
+            else:
+                stats["dead"] += 1
+                if dead_letters is not None:
+                    dead_letters.add(i, texts[i], reason, attempts[i])
+
+    def _safe_call(idxs: List[int]):
+        try:
+            return _call(idxs)
+        except Exception as e:
+            if debug:
+                print(f"[Salvage] chunk of {len(idxs)} failed: {e}")
+            return None
+
+    if workers == 1:
+        # 串行：调用线程内执行（流水线批次内的调用走这里，不再嵌套占用线程池）
+        while queue or deferred:
+            idxs = _next_chunk()
+            _collect(idxs, _safe_call(idxs))
+    else:
+        executor = get_executor()
+        running: Dict[Any, List[int]] = {}
+        while queue or running or deferred:
+            # 在途块数不超过 workers，其余留在队列中等待空闲线程领取
+            while len(running) < workers and (queue or deferred):
+                idxs = _next_chunk()
+                running[executor.submit(_safe_call, idxs)] = idxs
+            done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+            for fut in done:
+                idxs = running.pop(fut)
+                _collect(idxs, fut.result())
+
+    if debug and (stats["retried"] or stats["dead"]):
+        print(f"[Salvage] {n} texts: {stats['retried']} index retries, {stats['dead']} dead letters")
+    return results
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""
+单个任务内的片段译文存储（原文 -> 译文）
+
+OOXML 路径一旦拿到译文就写入存储；若后续步骤（回写/打包）失败而回退到其他写出方式，
+回退路径先从存储中取已有译文，只对缺失的原文调用引擎，避免同一文档被完整翻译两次。
+token / 字符统计也在存储上累计，保证回退后上报的是整次任务的真实消耗。
+"""
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+
+class SegmentStore:
+    """线程安全的任务级片段译文存储"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._items: Dict[str, str] = {}
+        self.token_count = 0
+        self.engine_calls = 0
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __contains__(self, text: Any) -> bool:
+        return text in self._items
+
+    def get(self, text: str, default: Optional[str] = None) -> Optional[str]:
+        return self._items.get(text, default)
+
+    def put_many(self, sources: Sequence[str], outputs: Iterable[Any]):
+        """登记一批译文；空串/None 不登记（保留为缺失，回退时可重新翻译）"""
+        with self._lock:
+            for src, dst in zip(sources, outputs):
+                if isinstance(dst, str) and dst.strip():
+                    self._items[src] = dst
+
+    def missing(self, texts: Sequence[str]) -> List[str]:
+        """返回尚无译文的原文（保持顺序、去重）"""
+        with self._lock:
+            return [t for t in dict.fromkeys(texts) if t not in self._items]
+
+    def add_tokens(self, tokens: Any):
+        try:
+            value = int(tokens or 0)
+        except Exception:
+            value = 0
+        with self._lock:
+            self.token_count += value
+            self.engine_calls += 1
+
+    def as_dict(self) -> Dict[str, str]:
+        with self._lock:
+            return dict(self._items)
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+系统设置快照（SettingsSnapshot）
+
+热路径过去各自查询 system_settings：术语选项每次 4 次查询、文档任务再查 docx_parallel_workers、
+文本/文档接口每次请求查 max_*_items_per_user。这里：
+- 整张表一次加载为不可变快照（key -> value 字符串），进程内共享
+- 通过版本行（system_settings_version，设置的增删改在同一事务内递增）感知变更：
+  快照最多每 SYSTEM_SETTINGS_CHECK_SECONDS 秒比对一次版本号（单行查询），版本变化才重新加载
+- 本进程内 /api/admin/settings 写入后立即 invalidate_settings()，下一次读取即刷新
+- 绕过接口直接改库（脚本、手工 SQL）时不会递增版本，快照最长 SYSTEM_SETTINGS_MAX_AGE_SECONDS 秒后强制重载
+"""
+import os
+import time
+import logging
+import threading
+from types import MappingProxyType
+from typing import Mapping, Optional
+
+from app.database import SessionLocal
+from app import crud, models
+
+logger = logging.getLogger(__name__)
+
+SYSTEM_SETTINGS_CHECK_SECONDS = float(os.getenv("SYSTEM_SETTINGS_CHECK_SECONDS", "5"))
+SYSTEM_SETTINGS_MAX_AGE_SECONDS = float(os.getenv("SYSTEM_SETTINGS_MAX_AGE_SECONDS", "300"))
+
+_TRUE = ("1", "true", "yes", "on", "y")
+
+
+class SettingsSnapshot:
+    """不可变的系统设置快照：values 为只读映射，读取不访问数据库"""
+
+    __slots__ = ("version", "values", "loaded_at")
+
+    def __init__(self, version: int, values: Mapping[str, Optional[str]], loaded_at: float):
+        self.version = version
+        self.values = MappingProxyType(dict(values))
+        self.loaded_at = loaded_at
+
+    def get(self, key: str, default: Optional[str] = None) -> Optional[str]:
+        value = self.values.get(key)
+        return default if value is None else value
+
+    def get_bool(self, key: str, default: bool = False) -> bool:
+        value = self.values.get(key)
+        if value is None:
+            return default
+        return str(value).strip().lower() in _TRUE
+
+    def get_int(self, key: str, default: int = 0) -> int:
+        value = self.values.get(key)
+        if value is None or not str(value).strip().isdigit():
+            return default
+        return int(str(value).strip())
+
+
+_lock = threading.Lock()
+_state = {"snapshot": None, "checked": 0.0}
+
+
+def _load(db, version: int) -> SettingsSnapshot:
+    rows = db.query(models.SystemSetting.key, models.SystemSetting.value).all()
+    return SettingsSnapshot(version, {k: v for k, v in rows}, time.time())
+
+
+def get_settings(db=None) -> SettingsSnapshot:
+    """当前设置快照；db 仅在需要比对版本或重新加载时使用（不传则临时打开会话）"""
+    now = time.time()
+    snapshot: Optional[SettingsSnapshot] = _state["snapshot"]
+    if snapshot is not None and now - _state["checked"] < SYSTEM_SETTINGS_CHECK_SECONDS:
+        return snapshot
+    with _lock:
+        snapshot = _state["snapshot"]
+        if snapshot is not None and now - _state["checked"] < SYSTEM_SETTINGS_CHECK_SECONDS:
+            return snapshot
+        should_close = False
+        if db is None:
+            db = SessionLocal()
+            should_close = True
+        try:
+            version = crud.get_settings_version(db)
+            if snapshot is None or version != snapshot.version or now - snapshot.loaded_at >= SYSTEM_SETTINGS_MAX_AGE_SECONDS:
+                snapshot = _load(db, version)
+                _state["snapshot"] = snapshot
+            _state["checked"] = now
+        except Exception as e:
+            # 设置表不可用（如尚未建表）：沿用旧快照，没有旧快照时返回空快照（各处使用默认值）
+            logger.warning(f"[Settings] failed to refresh settings snapshot: {e}")
+            if snapshot is None:
+                return SettingsSnapshot(-1, {}, now)
+        finally:
+            if should_close:
+                db.close()
+        return snapshot
+
+
+def invalidate_settings():
+    """本进程内设置已变更：下一次 get_settings() 重新比对版本"""
+    with _lock:
+        _state["checked"] = 0.0
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+文档任务的认领与租约（保证同一 task_id 只有一个执行者）
+
+- claim_task：单条 UPDATE 原子地把任务从 pending（或租约已过期的 processing）切换为 processing，
+  同时写入 worker_id / lease_expires_at / heartbeat_time；受影响行数为 1 才算认领成功
+- LeaseHeartbeat：执行期间后台线程定期续约；续约失败（租约被他人接管）时置 lost
+- release_task：结束时写入最终状态并清除租约（仅当租约仍归本执行者所有）
+
+执行者崩溃后租约不再续期，过期后重新投递的消息（acks_late）即可接管该任务。
+"""
+import os
+import socket
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+from sqlalchemy import or_, and_, func
+
+from ..database import SessionLocal
+from .. import models
+
+logger = logging.getLogger(__name__)
+
+TASK_LEASE_SECONDS = int(os.getenv("TASK_LEASE_SECONDS", "120"))
+# 续约间隔（默认租约的 1/3）
+TASK_HEARTBEAT_SECONDS = max(1, int(os.getenv("TASK_HEARTBEAT_SECONDS", str(max(1, TASK_LEASE_SECONDS // 3)))))
+
+CLAIMED = "claimed"
+BUSY = "busy"          # 另一个执行者持有有效租约
+FINISHED = "finished"  # 已完成/失败，无需再执行
+MISSING = "missing"    # 任务记录不存在
+
+
+class TaskLeaseBusy(Exception):
+    """任务正被其他执行者处理（租约有效）"""
+
+
+def make_worker_id(kind: str = "worker") -> str:
+    return f"{kind}@{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+
+
+def claim_task(task_id: str, worker_id: str, db=None) -> str:
+    """原子认领任务，返回 CLAIMED / BUSY / FINISHED / MISSING"""
+    own = db is None
+    db = db or SessionLocal()
+    try:
+        now = datetime.utcnow()
+        T = models.TranslationTask
+        claimable = or_(
+            T.status == models.TaskStatus.pending,
+            and_(
+                T.status == models.TaskStatus.processing,
+                or_(T.lease_expires_at.is_(None), T.lease_expires_at < now),
+            ),
+        )
+        updated = (
+            db.query(T)
+            .filter(T.task_id == task_id, claimable)
+            .update({
+                T.status: models.TaskStatus.processing,
+                T.worker_id: worker_id,
+                T.lease_expires_at: now + timedelta(seconds=TASK_LEASE_SECONDS),
+                T.heartbeat_time: now,
+                T.attempts: func.coalesce(T.attempts, 0) + 1,
+            }, synchronize_session=False)
+        )
+        db.commit()
+        if updated == 1:
+            return CLAIMED
+        task = db.query(T).filter(T.task_id == task_id).first()
+        if task is None:
+            return MISSING
+        if task.status in (models.TaskStatus.completed, models.TaskStatus.failed):
+            return FINISHED
+        return BUSY
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        if own:
+            db.close()
+
+
+def renew_lease(task_id: str, worker_id: str) -> bool:
+    """续约；返回 False 表示租约已不属于本执行者"""
+    db = SessionLocal()
+    try:
+        now = datetime.utcnow()
+        T = models.TranslationTask
+        updated = (
+            db.query(T)
+            .filter(T.task_id == task_id, T.worker_id == worker_id, T.status == models.TaskStatus.processing)
+            .update({
+                T.lease_expires_at: now + timedelta(seconds=TASK_LEASE_SECONDS),
+                T.heartbeat_time: now,
+            }, synchronize_session=False)
+        )
+        db.commit()
+        return updated == 1
+    except Exception as e:
+        db.rollback()
+        logger.warning(f"[TaskLease] renew failed for {task_id}: {e}")
+        # 数据库暂时不可用时不判定为丢失，等待下一次续约
+        return True
+    finally:
+        db.close()
+
+
+def release_task(task_id: str, worker_id: str, values: Optional[Dict[str, Any]] = None) -> bool:
+    """写入最终字段并清除租约；租约已被接管时不写入，返回 False"""
+    db = SessionLocal()
+    try:
+        T = models.TranslationTask
+        data = {T.lease_expires_at: None}
+        for key, value in (values or {}).items():
+            if hasattr(T, key):
+                data[getattr(T, key)] = value
+        updated = (
+            db.query(T)
+            .filter(T.task_id == task_id, T.worker_id == worker_id)
+            .update(data, synchronize_session=False)
+        )
+        db.commit()
+        if updated != 1:
+            logger.warning(f"[TaskLease] lease for {task_id} lost by {worker_id}, final state not written")
+        return updated == 1
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+class LeaseHeartbeat:
+    """执行期间定期续约的后台线程（with 语句使用）"""
+
+    def __init__(self, task_id: str, worker_id: str, interval: int = TASK_HEARTBEAT_SECONDS):
+        self.task_id = task_id
+        self.worker_id = worker_id
+        self.interval = interval
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            if not renew_lease(self.task_id, self.worker_id):
+                self.lost = True
+                logger.warning(f"[TaskLease] {self.worker_id} lost lease on {self.task_id}")
+                return
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._run, name=f"lease-{self.task_id[:8]}", daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+        return False
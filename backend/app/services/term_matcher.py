@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+术语多模式匹配（Aho-Corasick 自动机）
+
+旧的术语前处理为每个术语编译一个正则，再对每条文本逐个术语 search + sub，复杂度为
+O(文本数 × 术语数) 次正则扫描：2 万条术语、5 万个片段的工作簿在调用引擎前就要耗掉大量 CPU。这里：
+- 全部术语构建一个自动机，每条文本只扫描一遍（与术语数无关）
+- 不区分大小写时术语与文本都做 casefold（比 re.IGNORECASE 覆盖更全，如 ß / ſ）；
+  casefold 改变长度的文本会保留到原文下标的映射，匹配边界必须落在原字符边界上
+- 匹配语义为最左最长、互不重叠：同一起点取最长术语，命中后从其结尾继续扫描；
+  替换基于原文进行，不会再在已插入的占位符内部误匹配
+- 自动机构建后只读，可在多线程间共享；由 terminology_service 的术语表缓存按
+  (语言对, 用户, 分类, 术语表版本) 持有，每种大小写模式编译一次
+"""
+from typing import List, Optional, Sequence, Tuple
+
+# 转移表键：state << 21 | ord(ch)（Unicode 码位不超过 21 位），避免每个节点一个 dict
+_SHIFT = 21
+
+
+def _fold(text: str) -> Tuple[str, Optional[List[int]]]:
+    """casefold 文本；长度发生变化时返回折叠后每个字符对应的原文下标，否则为 None"""
+    folded = text.casefold()
+    if len(folded) == len(text):
+        return folded, None
+    origin: List[int] = []
+    for i, ch in enumerate(text):
+        origin.extend([i] * len(ch.casefold()))
+    return folded, origin
+
+
+class TermMatcher:
+    """术语自动机：find(text) 返回 [(start, end, term_index)]，下标对应原文，term_index 为术语表下标
+
+    terms 中源文本相同（不区分大小写时折叠后相同）的术语只保留第一个，与旧实现按顺序替换的结果一致。
+    """
+
+    def __init__(self, terms: Sequence[Tuple[str, str]], case_sensitive: bool = False):
+        self.case_sensitive = case_sensitive
+        goto = {}
+        fail = [0]
+        output = [-1]   # 节点对应的术语下标（-1 表示无）
+        depth = [0]     # 节点深度 = 术语长度
+        edges: List[List[Tuple[int, int]]] = [[]]
+        for idx, (src, _tgt) in enumerate(terms):
+            if not isinstance(src, str) or not src:
+                continue
+            key = src if case_sensitive else src.casefold()
+            node = 0
+            for ch in key:
+                code = (node << _SHIFT) | ord(ch)
+                nxt = goto.get(code)
+                if nxt is None:
+                    nxt = len(output)
+                    goto[code] = nxt
+                    fail.append(0)
+                    output.append(-1)
+                    depth.append(depth[node] + 1)
+                    edges.append([])
+                    edges[node].append((ord(ch), nxt))
+                node = nxt
+            if output[node] < 0:
+                output[node] = idx
+
+        # BFS 计算失败指针与输出链接（最近的、带输出的真后缀节点）
+        link = [0] * len(output)
+        queue = [child for _, child in edges[0]]
+        head = 0
+        while head < len(queue):
+            node = queue[head]
+            head += 1
+            for code, child in edges[node]:
+                f = fail[node]
+                while True:
+                    nxt = goto.get((f << _SHIFT) | code)
+                    if nxt is not None and nxt != child:
+                        fail[child] = nxt
+                        break
+                    if f == 0:
+                        fail[child] = 0
+                        break
+                    f = fail[f]
+                target = fail[child]
+                link[child] = target if output[target] >= 0 else link[target]
+                queue.append(child)
+
+        self._goto = goto
+        self._fail = fail
+        self._output = output
+        self._depth = depth
+        self._link = link
+        self.size = len(output)
+
+    def __bool__(self):
+        return self.size > 1
+
+    def find(self, text: str) -> List[Tuple[int, int, int]]:
+        """最左最长、互不重叠的匹配列表（按位置升序）"""
+        if not text or self.size <= 1:
+            return []
+        if self.case_sensitive:
+            scan, origin = text, None
+        else:
+            scan, origin = _fold(text)
+        goto, fail, output, depth, link = self._goto, self._fail, self._output, self._depth, self._link
+
+        # 每个起点只记录最长的匹配
+        best = {}
+        state = 0
+        for pos, ch in enumerate(scan):
+            code = ord(ch)
+            while True:
+                nxt = goto.get((state << _SHIFT) | code)
+                if nxt is not None:
+                    state = nxt
+                    break
+                if state == 0:
+                    break
+                state = fail[state]
+            node = state if output[state] >= 0 else link[state]
+            while node:
+                end = pos + 1
+                start = end - depth[node]
+                if origin is not None:
+                    # 折叠后的匹配必须覆盖完整的原字符
+                    if (start > 0 and origin[start - 1] == origin[start]) or \
+                            (end < len(origin) and origin[end] == origin[end - 1]):
+                        node = link[node]
+                        continue
+                    start, end = origin[start], origin[end - 1] + 1
+                prev = best.get(start)
+                if prev is None or end > prev[0]:
+                    best[start] = (end, output[node])
+                node = link[node]
+        if not best:
+            return []
+
+        matches: List[Tuple[int, int, int]] = []
+        cursor = 0
+        for start in sorted(best):
+            if start < cursor:
+                continue
+            end, idx = best[start]
+            matches.append((start, end, idx))
+            cursor = end
+        return matches
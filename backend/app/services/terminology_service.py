@@ -1,165 +1,229 @@
+"""
+术语前/后处理
+
+术语表缓存（_TerminologyCache）按 (语言对, 用户, 分类, 术语表版本) 分两级：
+- L1：进程内 LRU，条目同时持有术语列表与已编译的匹配自动机（按大小写模式各一个）
+- L2：Redis（配置 REDIS_URL 时），跨 API / Celery 进程共享术语列表，未命中时才查询数据库
+术语/分类的增删改在同一事务内递增术语表版本（crud.bump_glossary_version），版本进入缓存键，
+因此无需 TTL：编辑在下一个任务（或版本检查间隔后）即生效，旧版本条目随 LRU / Redis 过期淘汰。
+
+占位符按片段从 1 编号（[T1]、[T2]…，同一片段内同一术语复用同一编号），不再使用按全表下标编号的
+__TRANS_TERM_{i}__ 长标记。译文返回后用 lost_placeholders 快速校验占位符是否全部保留，
+repair_placeholders 只把丢失占位符的片段合并为一批重发（不整批/整文档重做）。
+"""
 import os
 import re
+import json
 import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
 from typing import List, Tuple, Dict, Optional, Union
 
 # Local app imports
 from app.database import SessionLocal
 from app import crud
+from app.services.term_matcher import TermMatcher
+from app.services.settings_snapshot import get_settings
 
+logger = logging.getLogger(__name__)
 
-TERMINOLOGY_CACHE_TTL_SECONDS = int(os.getenv("TERMINOLOGY_CACHE_TTL_SECONDS", "300"))
+TERMINOLOGY_CACHE_SIZE = int(os.getenv("TERMINOLOGY_CACHE_SIZE", "64"))
+# 未显式传入版本时，进程内复用已读取版本的最长时间（秒）
+TERMINOLOGY_VERSION_CHECK_SECONDS = float(os.getenv("TERMINOLOGY_VERSION_CHECK_SECONDS", "2"))
+TERMINOLOGY_REDIS_TTL_SECONDS = int(os.getenv("TERMINOLOGY_REDIS_TTL_SECONDS", "86400"))
+REDIS_URL = os.getenv("REDIS_URL", "")
+# 丢失占位符的片段最多重发的轮数（每轮把仍丢失的片段合并为一批）
+TERM_PLACEHOLDER_RETRIES = int(os.getenv("TERM_PLACEHOLDER_RETRIES", "1"))
 
+# 占位符识别容忍大小写与空白（[t1] / [ T1 ]），写入时统一为 [T1]
+_PLACEHOLDER_RE = re.compile(r"\[\s*T\s*(\d+)\s*\]", re.IGNORECASE)
 
-class _TerminologyCache:
-    def __init__(self):
-        # key: (src_lang, tgt_lang) -> {"expire": ts, "terms": List[Tuple[src, tgt]]}
-        self._store: Dict[Tuple[str, str], Dict[str, object]] = {}
+CacheKey = Tuple[str, str, Optional[int], Optional[Tuple[int, ...]], int]
 
-    def get(self, src_lang: str, tgt_lang: str) -> Optional[List[Tuple[str, str]]]:
-        key = (src_lang or "", tgt_lang or "")
-        entry = self._store.get(key)
-        if not entry:
-            return None
-        if entry["expire"] < time.time():
-            self._store.pop(key, None)
-            return None
-        return entry["terms"]  # type: ignore
 
-    def set(self, src_lang: str, tgt_lang: str, terms: List[Tuple[str, str]]):
-        key = (src_lang or "", tgt_lang or "")
-        self._store[key] = {
-            "expire": time.time() + TERMINOLOGY_CACHE_TTL_SECONDS,
-            "terms": terms,
-        }
+class _Glossary:
+    """缓存条目：术语列表（按源文本长度降序）+ 按大小写模式惰性编译的自动机"""
 
+    def __init__(self, terms: List[Tuple[str, str]]):
+        self.terms = terms
+        self._matchers: Dict[bool, TermMatcher] = {}
+        self._lock = threading.Lock()
 
-_cache = _TerminologyCache()
+    def matcher(self, case_sensitive: bool) -> TermMatcher:
+        case_sensitive = bool(case_sensitive)
+        matcher = self._matchers.get(case_sensitive)
+        if matcher is None:
+            with self._lock:
+                matcher = self._matchers.get(case_sensitive)
+                if matcher is None:
+                    matcher = TermMatcher(self.terms, case_sensitive=case_sensitive)
+                    self._matchers[case_sensitive] = matcher
+        return matcher
 
 
-def _to_bool(value: Optional[str], default: bool = True) -> bool:
-    if value is None:
-        return default
-    v = value.strip().lower()
-    return v in ("1", "true", "yes", "on")
+class _TerminologyCache:
+    def __init__(self):
+        self._store: "OrderedDict[CacheKey, _Glossary]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._redis = None
+        self._redis_checked = False
+
+    def _client(self):
+        if not self._redis_checked:
+            with self._lock:
+                if not self._redis_checked:
+                    self._redis_checked = True
+                    if REDIS_URL:
+                        try:
+                            import redis  # 可选依赖：celery[redis] 已带
+                            client = redis.Redis.from_url(REDIS_URL, socket_timeout=2, socket_connect_timeout=2)
+                            client.ping()
+                            self._redis = client
+                        except Exception as e:
+                            logger.warning(f"[Terminology] Redis unavailable, using in-process cache only: {e}")
+        return self._redis
+
+    @staticmethod
+    def _redis_key(key: CacheKey) -> str:
+        raw = json.dumps(key, ensure_ascii=False, separators=(",", ":"))
+        return "transai:terms:" + hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key: CacheKey) -> Optional[_Glossary]:
+        with self._lock:
+            entry = self._store.get(key)
+            if entry is not None:
+                self._store.move_to_end(key)
+                return entry
+        client = self._client()
+        if client is None:
+            return None
+        try:
+            raw = client.get(self._redis_key(key))
+        except Exception as e:
+            logger.warning(f"[Terminology] Redis get failed: {e}")
+            return None
+        if raw is None:
+            return None
+        try:
+            terms = [(str(s), str(t)) for s, t in json.loads(raw)]
+        except Exception:
+            return None
+        return self._put_local(key, _Glossary(terms))
+
+    def set(self, key: CacheKey, terms: List[Tuple[str, str]]) -> _Glossary:
+        client = self._client()
+        if client is not None:
+            try:
+                client.set(self._redis_key(key), json.dumps(terms, ensure_ascii=False), ex=TERMINOLOGY_REDIS_TTL_SECONDS)
+            except Exception as e:
+                logger.warning(f"[Terminology] Redis set failed: {e}")
+        return self._put_local(key, _Glossary(terms))
+
+    def _put_local(self, key: CacheKey, entry: _Glossary) -> _Glossary:
+        with self._lock:
+            existing = self._store.get(key)
+            if existing is not None:
+                # 并发加载同一键时保留先写入的条目（及其已编译的自动机）
+                return existing
+            self._store[key] = entry
+            while len(self._store) > max(1, TERMINOLOGY_CACHE_SIZE):
+                self._store.popitem(last=False)
+            return entry
+
+    def clear(self):
+        with self._lock:
+            self._store.clear()
 
 
-def is_terminology_enabled(db=None) -> bool:
-    should_close = False
-    if db is None:
-        db = SessionLocal()
-        should_close = True
-    try:
-        setting = crud.get_system_setting_by_key(db, "terminology_enabled")
-        if not setting:
-            # default enabled
-            return True
-        return _to_bool(setting.value, True)
-    finally:
-        if should_close:
-            db.close()
+_cache = _TerminologyCache()
+_version_lock = threading.Lock()
+_version_state = {"value": None, "checked": 0.0}
 
 
-def get_terminology_options(db=None) -> Dict[str, object]:
-    """Fetch minimal options for terminology processing.
-    - terminology_enabled: bool (default True)
-    - case_sensitive: bool (default False)
-    - categories_enabled: bool (default True)
-    - max_categories_per_translation: int (default 10)
-    """
+def get_glossary_version(db=None, refresh: bool = False) -> int:
+    """当前术语表版本；refresh=False 时在 TERMINOLOGY_VERSION_CHECK_SECONDS 内复用上次读取的值"""
+    now = time.time()
+    if not refresh:
+        with _version_lock:
+            if _version_state["value"] is not None and now - _version_state["checked"] < TERMINOLOGY_VERSION_CHECK_SECONDS:
+                return _version_state["value"]
     should_close = False
     if db is None:
         db = SessionLocal()
         should_close = True
     try:
-        enabled = is_terminology_enabled(db)
-        case_sensitive = False
-        cs_setting = crud.get_system_setting_by_key(db, "terminology_case_sensitive")
-        if cs_setting:
-            case_sensitive = _to_bool(cs_setting.value, False)
-        
-        # 新增分类相关配置
-        categories_enabled = True
-        cs_enabled_setting = crud.get_system_setting_by_key(db, "terminology_categories_enabled")
-        if cs_enabled_setting:
-            categories_enabled = _to_bool(cs_enabled_setting.value, True)
-        
-        max_categories = 10
-        max_cat_setting = crud.get_system_setting_by_key(db, "terminology_max_categories_per_translation")
-        if max_cat_setting and max_cat_setting.value.isdigit():
-            max_categories = int(max_cat_setting.value)
-        
-        return {
-            "terminology_enabled": enabled,
-            "case_sensitive": case_sensitive,
-            "categories_enabled": categories_enabled,
-            "max_categories_per_translation": max_categories,
-        }
+        version = crud.get_glossary_version(db)
     finally:
         if should_close:
             db.close()
+    with _version_lock:
+        _version_state["value"] = version
+        _version_state["checked"] = now
+    return version
 
 
-def _load_terms_by_categories(db, category_ids: List[int], src_lang: str, tgt_lang: str, user_id: Optional[Union[int, str]] = None) -> List[Tuple[str, str]]:
-    """根据分类ID列表加载术语"""
-    if not category_ids:
-        return []
-    
-    # 使用新的CRUD函数按分类加载术语
-    terms = crud.get_terms_by_categories(db, category_ids, src_lang, tgt_lang, user_id)
+def _sort_pairs(terms) -> List[Tuple[str, str]]:
     pairs: List[Tuple[str, str]] = []
     for t in terms:
         # Normalize to str pairs
         pairs.append((t.source_text, t.target_text))
-
     # Sort by source length desc for longest-match-first
     pairs.sort(key=lambda x: len(x[0] or ""), reverse=True)
-    
     return pairs
 
 
-def _load_terms(db, src_lang: str, tgt_lang: str, user_id: Optional[Union[int, str]] = None) -> List[Tuple[str, str]]:
-    # Try cache first
-    cached = _cache.get(src_lang, tgt_lang)
-    if cached is not None:
-        return cached
-
-    # Only public + approved terms for MVP
-    # If user_id provided (or env var present), include user's private terms as well
-    if user_id is None:
-        env_uid = os.getenv("TERMINOLOGY_USER_ID")
-        user_id = int(env_uid) if env_uid and env_uid.isdigit() else None
-
-    terms = crud.get_terms_by_lang_pair(db, src_lang=src_lang, tgt_lang=tgt_lang, only_public=(user_id is None), user_id=(int(user_id) if user_id is not None else None))
-    pairs: List[Tuple[str, str]] = []
-    for t in terms:
-        # Normalize to str pairs
-        pairs.append((t.source_text, t.target_text))
-
-    # Sort by source length desc for longest-match-first
-    pairs.sort(key=lambda x: len(x[0] or ""), reverse=True)
+def _glossary_for(db, src_lang: str, tgt_lang: str, user_id: Optional[Union[int, str]],
+                  category_ids: Optional[List[int]], version: Optional[int]) -> _Glossary:
+    """按 (语言对, 用户, 分类, 版本) 取术语表条目：L1 -> L2 -> 数据库"""
+    if version is None:
+        version = get_glossary_version(db)
+    uid = int(user_id) if user_id is not None and str(user_id).isdigit() else None
+    cats = tuple(sorted({int(c) for c in category_ids})) if category_ids is not None else None
+    key: CacheKey = (src_lang or "", tgt_lang or "", uid, cats, int(version))
+    entry = _cache.get(key)
+    if entry is not None:
+        return entry
+    # 只取 (source_text, target_text)：public + approved，给定 user_id 时包含其私有术语；给定分类时只取这些分类
+    terms = crud.get_term_pairs(db, src_lang, tgt_lang, user_id=uid, category_ids=list(cats) if cats is not None else None)
+    return _cache.set(key, _sort_pairs(terms))
 
-    _cache.set(src_lang, tgt_lang, pairs)
-    return pairs
 
+def is_terminology_enabled(db=None) -> bool:
+    # default enabled
+    return get_settings(db).get_bool("terminology_enabled", True)
 
-def preprocess_texts_with_categories(db, texts: List[str], src_lang: str, tgt_lang: str, 
-                                   category_ids: List[int], case_sensitive: bool = False, 
-                                   user_id: Optional[Union[int, str]] = None) -> Tuple[List[str], List[Dict[str, str]]]:
-    """根据分类ID列表进行术语前处理"""
-    if not texts or not category_ids:
-        return texts, [{} for _ in texts]
 
-    terms = _load_terms_by_categories(db, category_ids, src_lang, tgt_lang, user_id)
-    if not terms:
-        return texts, [{} for _ in texts]
+def get_terminology_options(db=None) -> Dict[str, object]:
+    """Fetch minimal options for terminology processing (read from the settings snapshot).
+    - terminology_enabled: bool (default True)
+    - case_sensitive: bool (default False)
+    - categories_enabled: bool (default True)
+    - max_categories_per_translation: int (default 10)
+    """
+    settings = get_settings(db)
+    return {
+        "terminology_enabled": settings.get_bool("terminology_enabled", True),
+        "case_sensitive": settings.get_bool("terminology_case_sensitive", False),
+        # 分类相关配置
+        "categories_enabled": settings.get_bool("terminology_categories_enabled", True),
+        "max_categories_per_translation": settings.get_int("terminology_max_categories_per_translation", 10),
+    }
+
+
+def _resolve_user_id(user_id: Optional[Union[int, str]]) -> Optional[Union[int, str]]:
+    # If user_id not provided, fall back to env var TERMINOLOGY_USER_ID
+    if user_id is None:
+        env_uid = os.getenv("TERMINOLOGY_USER_ID")
+        user_id = int(env_uid) if env_uid and env_uid.isdigit() else None
+    return user_id
 
-    flags = 0 if case_sensitive else re.IGNORECASE
-    # Use ASCII sentinel placeholders that models通常会保留，且不易与自然文本冲突
-    # Each placeholder is unique per term index
-    placeholders = [f"__TRANS_TERM_{i}__" for i in range(len(terms))]
-    patterns = [re.compile(re.escape(src), flags) for src, _ in terms]
 
+def _apply_terms(texts: List[str], glossary: _Glossary, case_sensitive: bool) -> Tuple[List[str], List[Dict[str, str]]]:
+    """用自动机一次扫描替换术语：最左最长匹配替换为占位符，返回 processed_texts 与每条文本的 placeholder -> target_term"""
+    terms = glossary.terms
+    matcher = glossary.matcher(case_sensitive)
     processed_list: List[str] = []
     mappings: List[Dict[str, str]] = []
     for text in texts:
@@ -168,61 +232,60 @@ def preprocess_texts_with_categories(db, texts: List[str], src_lang: str, tgt_la
             mappings.append({})
             continue
 
+        matches = matcher.find(text)
+        if not matches or _PLACEHOLDER_RE.search(text):
+            # 无命中，或原文本身含 [Tn] 形式文本（无法与占位符区分）：不做术语保护
+            processed_list.append(text)
+            mappings.append({})
+            continue
+
         mapping: Dict[str, str] = {}
-        processed = text
-        # Replace by descending length order
-        for idx, ((src, tgt), pattern) in enumerate(zip(terms, patterns)):
-            placeholder = placeholders[idx]
-            if pattern.search(processed):
-                # 仅替换完整匹配，避免数字/标号误替换；保留原文边界
-                processed = pattern.sub(placeholder, processed)
-                mapping[placeholder] = tgt
-
-        processed_list.append(processed)
+        local: Dict[int, str] = {}
+        pieces: List[str] = []
+        pos = 0
+        for start, end, idx in matches:
+            # 片段内从 1 编号的短占位符；同一术语多次出现复用同一编号
+            placeholder = local.get(idx)
+            if placeholder is None:
+                placeholder = f"[T{len(local) + 1}]"
+                local[idx] = placeholder
+                mapping[placeholder] = terms[idx][1]
+            pieces.append(text[pos:start])
+            pieces.append(placeholder)
+            pos = end
+        pieces.append(text[pos:])
+        processed_list.append("".join(pieces))
         mappings.append(mapping)
 
     return processed_list, mappings
 
 
-def preprocess_texts(db, texts: List[str], src_lang: str, tgt_lang: str, case_sensitive: bool = False, user_id: Optional[Union[int, str]] = None) -> Tuple[List[str], List[Dict[str, str]]]:
+def preprocess_texts_with_categories(db, texts: List[str], src_lang: str, tgt_lang: str, 
+                                   category_ids: List[int], case_sensitive: bool = False, 
+                                   user_id: Optional[Union[int, str]] = None,
+                                   version: Optional[int] = None) -> Tuple[List[str], List[Dict[str, str]]]:
+    """根据分类ID列表进行术语前处理；version 为术语表版本（不传时读取当前版本）"""
+    if not texts or not category_ids:
+        return texts, [{} for _ in texts]
+
+    glossary = _glossary_for(db, src_lang, tgt_lang, user_id, category_ids, version)
+    if not glossary.terms:
+        return texts, [{} for _ in texts]
+    return _apply_terms(texts, glossary, case_sensitive)
+
+
+def preprocess_texts(db, texts: List[str], src_lang: str, tgt_lang: str, case_sensitive: bool = False,
+                     user_id: Optional[Union[int, str]] = None, version: Optional[int] = None) -> Tuple[List[str], List[Dict[str, str]]]:
     """Replace source terms with placeholders to protect them from being altered by models.
     Returns processed_texts and a list of mapping dicts per text: placeholder -> target_term.
     """
     if not texts:
         return texts, [{} for _ in range(0)]
 
-    terms = _load_terms(db, src_lang, tgt_lang, user_id=user_id)
-    if not terms:
+    glossary = _glossary_for(db, src_lang, tgt_lang, _resolve_user_id(user_id), None, version)
+    if not glossary.terms:
         return texts, [{} for _ in texts]
-
-    flags = 0 if case_sensitive else re.IGNORECASE
-    # Use ASCII sentinel placeholders that models通常会保留，且不易与自然文本冲突
-    # Each placeholder is unique per term index
-    placeholders = [f"__TRANS_TERM_{i}__" for i in range(len(terms))]
-    patterns = [re.compile(re.escape(src), flags) for src, _ in terms]
-
-    processed_list: List[str] = []
-    mappings: List[Dict[str, str]] = []
-    for text in texts:
-        if not isinstance(text, str) or not text:
-            processed_list.append(text)
-            mappings.append({})
-            continue
-
-        mapping: Dict[str, str] = {}
-        processed = text
-        # Replace by descending length order
-        for idx, ((src, tgt), pattern) in enumerate(zip(terms, patterns)):
-            placeholder = placeholders[idx]
-            if pattern.search(processed):
-                # 仅替换完整匹配，避免数字/标号误替换；保留原文边界
-                processed = pattern.sub(placeholder, processed)
-                mapping[placeholder] = tgt
-
-        processed_list.append(processed)
-        mappings.append(mapping)
-
-    return processed_list, mappings
+    return _apply_terms(texts, glossary, case_sensitive)
 
 
 def postprocess_texts(translated_texts: List[str], mappings: List[Dict[str, str]]) -> List[str]:
@@ -237,16 +300,74 @@ def postprocess_texts(translated_texts: List[str], mappings: List[Dict[str, str]
 
     results: List[str] = []
     for text, mapping in zip(translated_texts, mappings):
-        if not mapping:
+        if not mapping or not isinstance(text, str):
             results.append(text)
             continue
-        fixed = text
-        for placeholder, tgt in mapping.items():
-            fixed = fixed.replace(placeholder, tgt)
+        # 一次扫描替换全部占位符；不在映射中的保持原样
+        fixed = _PLACEHOLDER_RE.sub(lambda m: mapping.get(f"[T{m.group(1)}]", m.group(0)), text)
         results.append(fixed)
     return results
 
 
+def lost_placeholders(processed, translated) -> bool:
+    """processed 中的占位符是否有未出现在译文中的（无占位符的片段恒为 False）"""
+    if not isinstance(processed, str) or "[" not in processed:
+        return False
+    expected = set(_PLACEHOLDER_RE.findall(processed))
+    if not expected:
+        return False
+    if not isinstance(translated, str):
+        return True
+    return not expected.issubset(_PLACEHOLDER_RE.findall(translated))
+
+
+def repair_placeholders(processed: List[str], outputs: List, translate, fallback=None,
+                        retries: Optional[int] = None) -> Tuple[List, Dict[str, int]]:
+    """校验占位符并定向修复：返回 (outputs, {"lost", "resent", "fallback"})
+
+    - 只把丢失占位符的片段合并为一批，用 translate(texts) 重发，最多 retries 轮
+    - 仍丢失的片段交给 fallback(indices) -> 译文列表（如改为翻译不带占位符的原文），不再留下残缺占位符
+    """
+    outputs = list(outputs)
+    stats = {"lost": 0, "resent": 0, "fallback": 0}
+    pending = [i for i in range(min(len(processed), len(outputs))) if lost_placeholders(processed[i], outputs[i])]
+    stats["lost"] = len(pending)
+    rounds = TERM_PLACEHOLDER_RETRIES if retries is None else retries
+    for _ in range(max(0, rounds)):
+        if not pending:
+            break
+        stats["resent"] += len(pending)
+        try:
+            retried = list(translate([processed[i] for i in pending]) or [])
+        except Exception as e:
+            logger.warning(f"[Terminology] placeholder repair batch failed: {e}")
+            break
+        still = []
+        for j, i in enumerate(pending):
+            out = retried[j] if j < len(retried) else None
+            if isinstance(out, list) and len(out) == 1:
+                out = out[0]
+            if isinstance(out, str) and out.strip() and not lost_placeholders(processed[i], out):
+                outputs[i] = out
+            else:
+                still.append(i)
+        pending = still
+    if pending and fallback is not None:
+        try:
+            fixed = list(fallback(pending) or [])
+        except Exception as e:
+            logger.warning(f"[Terminology] placeholder fallback failed: {e}")
+            fixed = []
+        for j, i in enumerate(pending):
+            out = fixed[j] if j < len(fixed) else None
+            if isinstance(out, list) and len(out) == 1:
+                out = out[0]
+            if isinstance(out, str) and out.strip():
+                outputs[i] = out
+                stats["fallback"] += 1
+    return outputs, stats
+
+
 def record_translation_term_set(db, translation_id: str, translation_type: str, category_ids: List[int]):
     """记录翻译任务使用的术语分类"""
     try:
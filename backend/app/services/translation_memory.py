@@ -0,0 +1,371 @@
+#!/usr/bin/env python3
+"""
+翻译记忆（Translation Memory）缓存
+
+两级结构：
+- L1：进程内 LRU（OrderedDict + 锁），命中不访问数据库
+- L2：translation_memory 表（SQLite/Postgres 共享），跨进程/跨任务复用
+
+缓存键为 sha256(原文, 源语言, 目标语言, 引擎, 模型, 风格预设/指令, 术语版本, 作用域)。
+作用域为 public 或 user:<id>；查询时先查用户作用域，再查公共作用域。
+引擎明确返回的非空译文才会写回，与原文相同的也照常缓存（编号、产品名、纯占位符等原样返回是正常结果）；
+失败的片段（None/空串）与丢失术语占位符的译文不写回，避免把失败回退的原文或残缺译文缓存下来。
+"""
+import os
+import json
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+try:
+    from app.database import SessionLocal
+    from app import models
+except Exception:
+    SessionLocal = None
+    models = None
+
+from app.services.terminology_service import lost_placeholders
+
+logger = logging.getLogger(__name__)
+
+TM_ENABLED = os.getenv("TRANSLATION_MEMORY_ENABLED", "true").strip().lower() in ("1", "true", "yes", "on")
+TM_DB_ENABLED = os.getenv("TRANSLATION_MEMORY_DB_ENABLED", "true").strip().lower() in ("1", "true", "yes", "on")
+TM_LRU_SIZE = int(os.getenv("TRANSLATION_MEMORY_LRU_SIZE", "20000"))
+# 单次 IN 查询的键数量上限（SQLite 变量数限制）
+TM_DB_CHUNK = 500
+
+
+def _scope_for(user_id: Optional[Union[int, str]]) -> str:
+    if user_id is None or str(user_id).strip() in ("", "0"):
+        return "public"
+    return f"user:{user_id}"
+
+
+def make_key(text: str, src_lang: str, tgt_lang: str, engine: str, model: Optional[str] = None,
+             style_preset: Optional[str] = None, style_instruction: Optional[str] = None,
+             terminology_version: Optional[Union[int, str]] = None, scope: str = "public",
+             enable_thinking: bool = False) -> str:
+    """计算缓存键"""
+    raw = json.dumps([
+        text or "",
+        (src_lang or "auto").lower(),
+        (tgt_lang or "").lower(),
+        (engine or "").lower(),
+        model or "",
+        style_preset or "",
+        style_instruction or "",
+        "" if terminology_version is None else str(terminology_version),
+        scope,
+        bool(enable_thinking),
+    ], ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class _LRUCache:
+    def __init__(self, capacity: int):
+        self.capacity = max(0, int(capacity))
+        self._store: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            value = self._store.get(key)
+            if value is not None:
+                self._store.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: str):
+        if self.capacity <= 0:
+            return
+        with self._lock:
+            self._store[key] = value
+            self._store.move_to_end(key)
+            while len(self._store) > self.capacity:
+                self._store.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._store.clear()
+
+    def __len__(self):
+        return len(self._store)
+
+
+class TranslationMemory:
+    """翻译记忆：L1 进程内 LRU + L2 数据库表"""
+
+    def __init__(self, capacity: int = TM_LRU_SIZE, use_db: bool = TM_DB_ENABLED):
+        self._l1 = _LRUCache(capacity)
+        self.use_db = bool(use_db and SessionLocal and models)
+        self._stats_lock = threading.Lock()
+        self._stats = {"lookups": 0, "l1_hits": 0, "l2_hits": 0, "misses": 0, "writes": 0, "errors": 0}
+
+    # --- 统计 ---
+    def _incr(self, name: str, n: int = 1):
+        if n:
+            with self._stats_lock:
+                self._stats[name] = self._stats.get(name, 0) + n
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            stats = dict(self._stats)
+        hits = stats["l1_hits"] + stats["l2_hits"]
+        stats["hit_rate"] = round(hits / stats["lookups"], 4) if stats["lookups"] else 0.0
+        stats["l1_size"] = len(self._l1)
+        stats["enabled"] = TM_ENABLED
+        stats["db_enabled"] = self.use_db
+        return stats
+
+    def reset_stats(self):
+        with self._stats_lock:
+            for k in self._stats:
+                self._stats[k] = 0
+
+    def clear(self):
+        """仅清空进程内 L1；L2 表由管理接口按需清理"""
+        self._l1.clear()
+
+    # --- 查询/写入 ---
+    def lookup(self, keys: List[str]) -> Dict[str, str]:
+        """批量查询，返回命中的 key -> 译文"""
+        found: Dict[str, str] = {}
+        pending: List[str] = []
+        for k in keys:
+            v = self._l1.get(k)
+            if v is not None:
+                found[k] = v
+            else:
+                pending.append(k)
+        self._incr("l1_hits", len(found))
+
+        if pending and self.use_db:
+            db = None
+            try:
+                db = SessionLocal()
+                now = datetime.utcnow()
+                l2_found = 0
+                for i in range(0, len(pending), TM_DB_CHUNK):
+                    chunk = pending[i:i + TM_DB_CHUNK]
+                    rows = (
+                        db.query(models.TranslationMemory)
+                        .filter(models.TranslationMemory.cache_key.in_(chunk))
+                        .all()
+                    )
+                    for row in rows:
+                        found[row.cache_key] = row.target_text
+                        self._l1.set(row.cache_key, row.target_text)
+                        row.hit_count = (row.hit_count or 0) + 1
+                        row.last_hit_time = now
+                        l2_found += 1
+                if l2_found:
+                    db.commit()
+                self._incr("l2_hits", l2_found)
+            except Exception as e:
+                self._incr("errors")
+                logger.warning(f"[TM] L2 lookup failed: {e}")
+                try:
+                    if db:
+                        db.rollback()
+                except Exception:
+                    pass
+            finally:
+                if db:
+                    db.close()
+        return found
+
+    def store(self, entries: List[Dict[str, Any]]):
+        """写回新译文：entries 每项包含 key/scope/engine/model/src/tgt/source/target"""
+        if not entries:
+            return
+        for e in entries:
+            self._l1.set(e["key"], e["target"])
+        self._incr("writes", len(entries))
+        if not self.use_db:
+            return
+
+        db = None
+        try:
+            db = SessionLocal()
+            for i in range(0, len(entries), TM_DB_CHUNK):
+                chunk = entries[i:i + TM_DB_CHUNK]
+                keys = [e["key"] for e in chunk]
+                existing = {
+                    k for (k,) in db.query(models.TranslationMemory.cache_key)
+                    .filter(models.TranslationMemory.cache_key.in_(keys))
+                    .all()
+                }
+                rows = []
+                seen = set()
+                for e in chunk:
+                    if e["key"] in existing or e["key"] in seen:
+                        continue
+                    seen.add(e["key"])
+                    rows.append(models.TranslationMemory(
+                        cache_key=e["key"],
+                        scope=e["scope"],
+                        engine=e["engine"],
+                        model=e.get("model"),
+                        source_lang=e.get("src_lang"),
+                        target_lang=e.get("tgt_lang"),
+                        source_text=e["source"],
+                        target_text=e["target"],
+                        hit_count=0,
+                    ))
+                if not rows:
+                    continue
+                try:
+                    db.bulk_save_objects(rows)
+                    db.commit()
+                except Exception:
+                    # 并发写入导致唯一键冲突：忽略即可，另一进程已写入
+                    db.rollback()
+        except Exception as e:
+            self._incr("errors")
+            logger.warning(f"[TM] L2 store failed: {e}")
+        finally:
+            if db:
+                db.close()
+
+    def purge(self, engine: Optional[str] = None, scope: Optional[str] = None) -> int:
+        """删除 L2 中的条目（可按引擎/作用域过滤），同时清空 L1"""
+        self._l1.clear()
+        if not self.use_db:
+            return 0
+        db = None
+        try:
+            db = SessionLocal()
+            q = db.query(models.TranslationMemory)
+            if engine:
+                q = q.filter(models.TranslationMemory.engine == engine.lower())
+            if scope:
+                q = q.filter(models.TranslationMemory.scope == scope)
+            deleted = q.delete(synchronize_session=False)
+            db.commit()
+            return int(deleted or 0)
+        except Exception as e:
+            logger.warning(f"[TM] purge failed: {e}")
+            if db:
+                db.rollback()
+            return 0
+        finally:
+            if db:
+                db.close()
+
+
+translation_memory = TranslationMemory()
+
+
+def get_translation_memory_stats() -> Dict[str, Any]:
+    return translation_memory.get_stats()
+
+
+def translate_with_memory(texts: List[str], src_lang: str, tgt_lang: str, engine: str,
+                          translate_fn: Callable[[List[str]], Tuple[List[str], int]],
+                          model: Optional[str] = None, options: Optional[Dict[str, Any]] = None,
+                          user_id: Optional[Union[int, str]] = None,
+                          terminology_version: Optional[Union[int, str]] = None,
+                          report_failures: bool = False) -> Tuple[List[str], int]:
+    """在 translate_fn 外包一层翻译记忆。
+
+    - 命中的片段直接返回缓存译文，不调用引擎
+    - 未命中的片段去重后交给 translate_fn（一次调用），结果按下标回填并写回缓存
+    - 引擎以 None 表示该片段失败：report_failures=True 时原样返回 None（由片段级补救重发），
+      否则回填原文（直接使用译文列表的调用方）
+    - 返回 (译文列表, 本次实际消耗的 tokens)
+    """
+    if not TM_ENABLED or not texts:
+        outputs, tokens = _split_result(translate_fn(texts))
+        return _fill_failures(texts, outputs, report_failures), tokens
+
+    opts = options or {}
+    style_preset = opts.get("style_preset")
+    style_instruction = opts.get("style_instruction")
+    enable_thinking = bool(opts.get("enable_thinking", False))
+    user_scope = _scope_for(user_id)
+    scopes = [user_scope] if user_scope == "public" else [user_scope, "public"]
+
+    def _key(text: str, scope: str) -> str:
+        return make_key(text, src_lang, tgt_lang, engine, model, style_preset, style_instruction,
+                        terminology_version, scope, enable_thinking)
+
+    # 只缓存非空字符串；其余原样透传给引擎
+    cacheable = [i for i, t in enumerate(texts) if isinstance(t, str) and t.strip()]
+    keys_by_scope = {s: {i: _key(texts[i], s) for i in cacheable} for s in scopes}
+    all_keys: List[str] = []
+    for s in scopes:
+        all_keys.extend(keys_by_scope[s].values())
+    hits = translation_memory.lookup(all_keys)
+
+    results: List[Optional[str]] = [None] * len(texts)
+    for i in cacheable:
+        for s in scopes:
+            v = hits.get(keys_by_scope[s][i])
+            if v is not None:
+                results[i] = v
+                break
+    hit_count = sum(1 for i in cacheable if results[i] is not None)
+    translation_memory._incr("lookups", len(cacheable))
+    translation_memory._incr("misses", len(cacheable) - hit_count)
+
+    miss_idx = [i for i in range(len(texts)) if results[i] is None]
+    if not miss_idx:
+        logger.info(f"[TM] {engine}: all {len(texts)} segments served from cache")
+        return [r for r in results], 0  # type: ignore
+
+    # 未命中的片段按原文去重，只请求一次
+    unique_texts: List[str] = []
+    first_pos: Dict[str, int] = {}
+    pos_of: Dict[int, int] = {}
+    for i in miss_idx:
+        t = texts[i]
+        if isinstance(t, str) and t in first_pos:
+            pos_of[i] = first_pos[t]
+            continue
+        if isinstance(t, str):
+            first_pos[t] = len(unique_texts)
+        pos_of[i] = len(unique_texts)
+        unique_texts.append(t)
+
+    translated, tokens = _split_result(translate_fn(unique_texts))
+    translated = list(translated or [])
+
+    pending_writes: List[Dict[str, Any]] = []
+    for i in miss_idx:
+        t = texts[i]
+        pos = pos_of[i]
+        out = translated[pos] if pos < len(translated) else None
+        results[i] = out
+        # 失败（None/空串）与丢失术语占位符的译文不写回（调用方会定向重发，避免重发时命中残缺的缓存）；
+        # 引擎明确返回的与原文相同的译文（编号、产品名、纯占位符等）照常缓存
+        if i in keys_by_scope[user_scope] and isinstance(out, str) and out.strip() \
+                and not lost_placeholders(t, out):
+            pending_writes.append({
+                "key": keys_by_scope[user_scope][i],
+                "scope": user_scope,
+                "engine": (engine or "").lower(),
+                "model": model,
+                "src_lang": src_lang,
+                "tgt_lang": tgt_lang,
+                "source": t,
+                "target": out,
+            })
+    translation_memory.store(pending_writes)
+    logger.info(f"[TM] {engine}: {hit_count}/{len(cacheable)} cache hits, {len(unique_texts)} sent to engine")
+    return _fill_failures(texts, results, report_failures), tokens
+
+
+def _split_result(result) -> Tuple[List[Any], int]:
+    if isinstance(result, tuple) and len(result) >= 2:
+        return list(result[0] or []), result[1]
+    return list(result or []), 0
+
+
+def _fill_failures(texts: List[str], outputs: List[Any], report_failures: bool) -> List[Any]:
+    """失败的片段（None 或缺失）回填原文；report_failures=True 时保留 None 交给调用方处理"""
+    outputs = list(outputs) + [None] * (len(texts) - len(outputs))
+    if report_failures:
+        return outputs
+    return [texts[i] if out is None else out for i, out in enumerate(outputs)]
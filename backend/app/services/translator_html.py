@@ -22,6 +22,12 @@ from typing import List, Dict, Any
 
 import requests
 from dotenv import load_dotenv
+try:
+    from app.services.http_transport import http_post
+except (ImportError, ModuleNotFoundError):
+    # 作为独立脚本运行时退化为普通请求
+    def http_post(engine, url, **kwargs):
+        return requests.post(url, **kwargs)
 from bs4 import BeautifulSoup, NavigableString
 from lxml import etree
 from PIL import Image
@@ -145,7 +151,7 @@ def deepseek_translate_html(html_fragments: List[str], src_lang="zh", tgt_lang="
                 "temperature": 0.0
             }
             try:
-                resp = requests.post(DEEPSEEK_API_URL, headers=headers, json=payload, timeout=120)
+                resp = http_post('deepseek_html', DEEPSEEK_API_URL, headers=headers, json=payload, timeout=120)
                 if resp.status_code == 200:
                     j = resp.json()
                     txt = j['choices'][0]['message']['content']
@@ -176,7 +182,7 @@ def deepseek_translate_plain(texts: List[str], src_lang="zh", tgt_lang="ja") ->
         prompt = f"Translate the following text from {src_lang} to {tgt_lang}. Do not add commentary.\n\n{t}"
         payload = {"model":"deepseek-chat","messages":[{"role":"user","content":prompt}],"temperature":0.0}
         try:
-            r = requests.post(DEEPSEEK_API_URL, headers=headers, json=payload, timeout=60)
+            r = http_post('deepseek_html', DEEPSEEK_API_URL, headers=headers, json=payload, timeout=60)
             if r.status_code == 200:
                 j = r.json()
                 txt = j['choices'][0]['message']['content']
@@ -9,153 +9,18 @@ Usage:
 
 依赖:
     pip install python-pptx
-    并确保项目内有 translate_batch(texts, src, tgt, engine=...) 可调用
+    并确保项目内 app.services.segment_pipeline 可用
 """
 from pptx import Presentation
 from pptx.util import Pt
 from pptx.dml.color import RGBColor
 from pptx.enum.shapes import MSO_SHAPE_TYPE
 import sys
-import math
-from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import List, Tuple, Dict, Any
 import traceback
 
-# 调整下面导入为你项目中 utils_translator 的位置
-try:
-    # prefer package import if running inside app module
-    from app.services.utils_translator import translate_batch
-    from app.services.terminology_service import (
-        get_terminology_options,
-        preprocess_texts,
-        preprocess_texts_with_categories,
-        postprocess_texts,
-    )
-    from app.database import SessionLocal
-except Exception:
-    # fallback: assume utils_translator.py is in same folder
-    try:
-        from utils_translator import translate_batch
-    except Exception:
-        raise ImportError(
-            "无法导入 translate_batch。请确保 app.services.utils_translator.translate_batch 可用，"
-            "或者把 utils_translator.py 放到同级目录。"
-        )
-
-
-def is_translatable(text: str) -> bool:
-    """判断是否需要翻译：空/纯数字/纯符号/过短文本跳过"""
-    if text is None:
-        return False
-    s = text.strip()
-    if not s:
-        return False
-    if s.isdigit():
-        return False
-    # 如果都是标点/符号（没有字母或汉字等），跳过
-    if all(not ch.isalnum() for ch in s):
-        return False
-    # 过滤掉过短的文本（少于2个字符），避免翻译失败
-    if len(s) < 2:
-        return False
-    # 过滤掉只包含单个字符的文本
-    if len(s) == 1 and not s.isalnum():
-        return False
-    return True
-
-
-def chunk_list(lst: List[Any], n_chunks: int) -> List[List[Any]]:
-    """把 list 平均切分成 n_chunks 片（尽量均匀）"""
-    if n_chunks <= 0:
-        return [lst]
-    k = max(1, math.ceil(len(lst) / n_chunks))
-    return [lst[i:i + k] for i in range(0, len(lst), k)]
-
-
-def batch_translate_parallel(texts: List[str], src: str, tgt: str, engine: str = "deepseek", max_workers: int = 4, **options) -> List[str]:
-    """
-    将 texts 切块后并行调用 translate_batch，对每个块返回翻译结果（保持 order）
-    如果某个块抛异常，会在主线程中尝试二分重试（递归）。
-    """
-    if not texts:
-        return []
-
-    # small optimization: if only one text, call directly and unwrap result
-    if len(texts) == 1:
-        _res = translate_batch(texts, src, tgt, engine=engine, **options)
-        if isinstance(_res, tuple) and len(_res) >= 1:
-            _res = _res[0]
-        # ensure list[str]
-        if isinstance(_res, list):
-            return [str(_res[0])] if _res else [texts[0]]
-        return [str(_res)]
-
-    # choose number of chunks by length and max_workers
-    n_chunks = min(max_workers, max(1, len(texts) // 8))  # 每 chunk 最少包含 ~8 个句子以减少请求数
-    chunks = chunk_list(texts, n_chunks)
-
-    results = [None] * len(texts)
-    index_offsets = []
-    offset = 0
-    for c in chunks:
-        index_offsets.append(offset)
-        offset += len(c)
-
-    # ThreadPoolExecutor calling translate_batch for each chunk
-    with ThreadPoolExecutor(max_workers=max_workers) as ex:
-        future_to_chunk_idx = {}
-        for idx, chunk in enumerate(chunks):
-            future = ex.submit(translate_batch, chunk, src, tgt, engine, **options)
-            future_to_chunk_idx[future] = idx
-
-        for fut in as_completed(future_to_chunk_idx):
-            idx = future_to_chunk_idx[fut]
-            offset = index_offsets[idx]
-            try:
-                translated_chunk = fut.result()
-                # unwrap tuple (texts, tokens) if necessary
-                if isinstance(translated_chunk, tuple) and len(translated_chunk) >= 1:
-                    translated_chunk = translated_chunk[0]
-                # safety: ensure returned length matches
-                if not isinstance(translated_chunk, list) or len(translated_chunk) != len(chunks[idx]):
-                    # fallback to single-item translate for that chunk
-                    translated_chunk = []
-                    for item in chunks[idx]:
-                        _single = translate_batch([item], src, tgt, engine, **options)
-                        if isinstance(_single, tuple) and len(_single) >= 1:
-                            _single = _single[0]
-                        if isinstance(_single, list) and len(_single) >= 1:
-                            translated_chunk.append(str(_single[0]))
-                        else:
-                            translated_chunk.append(item)
-                for i, t in enumerate(translated_chunk):
-                    results[offset + i] = str(t) if t is not None else texts[offset + i]
-            except Exception as e:
-                # 异常：对该 chunk 进行二分重试
-                try:
-                    left = chunks[idx][:len(chunks[idx]) // 2]
-                    right = chunks[idx][len(chunks[idx]) // 2:]
-                    left_tr = batch_translate_parallel(left, src, tgt, engine, max_workers=max_workers)
-                    right_tr = batch_translate_parallel(right, src, tgt, engine, max_workers=max_workers)
-                    translated_chunk = left_tr + right_tr
-                    for i, t in enumerate(translated_chunk):
-                        results[offset + i] = t
-                except Exception:
-                    # 最后退化：逐条调用 translate_batch
-                    for i, item in enumerate(chunks[idx]):
-                        single_tr = translate_batch([item], src, tgt, engine, **options)
-                        if isinstance(single_tr, tuple) and len(single_tr) >= 1:
-                            single_tr = single_tr[0]
-                        if isinstance(single_tr, list) and len(single_tr) >= 1:
-                            results[offset + i] = str(single_tr[0])
-                        else:
-                            results[offset + i] = item
-
-    # final safety: replace any None by original texts
-    for i in range(len(results)):
-        if results[i] is None:
-            results[i] = texts[i]
-    return results
+# 过滤、去重、术语、调度与统计统一由 SegmentPipeline 处理，本模块只负责抽取与写回
+from app.services.segment_pipeline import SegmentPipeline, is_translatable
 
 
 def collect_text_items(prs: Presentation) -> Tuple[List[Tuple[str, int, int, int]], List[str]]:
@@ -409,84 +274,21 @@ def translate_pptx(input_path: str, output_path: str, src: str, tgt: str, engine
         prs.save(output_path)
         return {"token_count": 0, "character_count": 0}
 
-    total_character_count = sum(len(t) for t in texts)
-
-    # 去重：保持 items/texts 顺序，但创建 unique list 与映射
-    unique_texts = []
-    seen = {}
-    for t in texts:
-        if t not in seen:
-            seen[t] = len(unique_texts)
-            unique_texts.append(t)
-
-    # 并行批量翻译 unique_texts
-    # 术语前/后处理
-    try:
-        db = SessionLocal()
-        options = get_terminology_options(db)
-        if options.get("terminology_enabled", True):
-            processed_texts, mappings = preprocess_texts(db, unique_texts, src, tgt, case_sensitive=bool(options.get("case_sensitive", False)), user_id=user_id)
-        else:
-            processed_texts, mappings = unique_texts, [{} for _ in unique_texts]
-    finally:
-        try:
-            db.close()
-        except Exception:
-            pass
-
-    # Qwen3: 避免并行，改为顺序以降低 429 触发率
-    if engine and str(engine).lower() == 'qwen3':
-        # 顺序调用逐条翻译，并加入轻微节流，减少429
-        translated_unique = []
-        for s in processed_texts:
-            _r = translate_batch([s], src, tgt, engine=engine)
-            if isinstance(_r, tuple) and len(_r) >= 1:
-                _r = _r[0]
-            if isinstance(_r, list) and _r:
-                translated_unique.append(str(_r[0]))
-            else:
-                translated_unique.append(s)
-            try:
-                import time as _t
-                _t.sleep(0.05)
-            except Exception:
-                pass
-    else:
-        # 并行批量翻译，提升大文档速度
-        translated_unique = batch_translate_parallel(processed_texts, src, tgt, engine=engine, max_workers=max_workers)
-    total_token_count = 0
-
-    if options.get("terminology_enabled", True):
-        translated_unique = postprocess_texts(translated_unique, mappings)
-
-    # build map original -> translated
-    translated_map = {u: translated_unique[i] for i, u in enumerate(unique_texts)}
+    # 去重、术语前/后处理与并行批量翻译（在途批次由引擎自适应并发控制器约束）；
+    # 术语沿用原有行为：不区分分类，应用全部公共 + 用户术语
+    with SegmentPipeline(src, tgt, engine, workers=max_workers, user_id=user_id, term_scope="all", **kwargs) as pipe:
+        pipe.add_part(input_path, texts)
+        translated_map = pipe.finish()
 
     # 写回所有段落（按原始 items 顺序）
     write_translations_back(prs, items, texts, translated_map)
 
     # 保存
     prs.save(output_path)
-    
-    return {
-        "token_count": total_token_count,
-        "character_count": total_character_count
-    }
 
-import pptx
-from ..services.utils_translator import translate_batch
-from .translator_pptx_ooxml import translate_pptx_ooxml
+    return pipe.result()
 
-def is_translatable(text):
-    """判断文本是否需要翻译：非空、非纯数字、非纯符号"""
-    if not text or not text.strip():
-        return False
-    stripped = text.strip()
-    if stripped.isdigit():
-        return False
-    if all(not ch.isalnum() for ch in stripped):
-        return False
-    return True
+from .translator_pptx_ooxml import translate_pptx_ooxml
 
 def _normalize_text(s: str) -> str:
     if not isinstance(s, str):
@@ -513,8 +315,7 @@ def _iter_shapes_recursive(container):
 def translate_pptx_direct(input_path, output_path, src_lang, tgt_lang, engine="deepseek", user_id: int | None = None, **kwargs):
     # 优先使用 OOXML 层替换，仅改 a:t 文本，最大化保留样式/布局
     try:
-        cat_ids = kwargs.get('category_ids')
-        return translate_pptx_ooxml(input_path, output_path, src_lang, tgt_lang, engine=engine, user_id=user_id, category_ids=cat_ids)
+        return translate_pptx_ooxml(input_path, output_path, src_lang, tgt_lang, engine=engine, user_id=user_id, **kwargs)
     except Exception:
         # 出错时回退到 python-pptx 改写方案
         pass
@@ -523,7 +324,6 @@ def translate_pptx_direct(input_path, output_path, src_lang, tgt_lang, engine="d
     
     # Load the presentation
     prs = Presentation(input_path)
-    total_token_count = 0
     total_character_count = 0
     
     # 第一步：收集所有需要翻译的文本和位置信息
@@ -592,169 +392,60 @@ def translate_pptx_direct(input_path, output_path, src_lang, tgt_lang, engine="d
             "character_count": 0
         }
     
-    # 第二步：批量翻译所有文本
+    # 第二步：批量翻译所有文本（去重、术语、并发与重试由 SegmentPipeline 处理）
     print(f"开始批量翻译 {len(text_items)} 个文本...")
     all_texts = [item['text'] for item in text_items]
-    
-    try:
-        # 使用批量翻译，大幅减少API调用次数
-        # 术语前/后处理
-        try:
-            db = SessionLocal()
-            options = get_terminology_options(db)
-            if options.get("terminology_enabled", True):
-                cat_ids = kwargs.get("category_ids", None)
-                if options.get("categories_enabled", True):
-                    if not cat_ids or (isinstance(cat_ids, list) and len(cat_ids) == 0):
-                        processed_texts, mappings = all_texts, [{} for _ in all_texts]
-                    else:
-                        processed_texts, mappings = preprocess_texts_with_categories(
-                            db, all_texts, src_lang, tgt_lang, cat_ids,
-                            case_sensitive=bool(options.get("case_sensitive", False)), user_id=user_id
-                        )
-                else:
-                    processed_texts, mappings = preprocess_texts(
-                        db, all_texts, src_lang, tgt_lang,
-                        case_sensitive=bool(options.get("case_sensitive", False)), user_id=user_id
-                    )
-            else:
-                processed_texts, mappings = all_texts, [{} for _ in all_texts]
-        finally:
-            try:
-                db.close()
-            except Exception:
-                pass
 
-        translated_texts, batch_token_count = translate_batch(processed_texts, src_lang, tgt_lang, engine=engine)
-        total_token_count = batch_token_count
-        
-        if len(translated_texts) != len(all_texts):
-            print(f"警告：翻译结果数量不匹配，期望 {len(all_texts)}，实际 {len(translated_texts)}")
-            # 如果数量不匹配，使用原文填充
-            while len(translated_texts) < len(all_texts):
-                translated_texts.append(all_texts[len(translated_texts)])
-        
-        # 术语后处理
-        if options.get("terminology_enabled", True):
-            translated_texts = postprocess_texts(translated_texts, mappings)
+    with SegmentPipeline(src_lang, tgt_lang, engine, user_id=user_id, **kwargs) as pipe:
+        pipe.add_part(input_path, all_texts)
+        translations = pipe.finish()
+    print(f"批量翻译完成，消耗 {pipe.usage.tokens} tokens")
 
-        print(f"批量翻译完成，消耗 {total_token_count} tokens")
-        
-    except Exception as e:
-        print(f"批量翻译失败: {e}")
-        # 直接返回失败，不进行逐段翻译回退
-        print("翻译失败，返回错误")
-        raise e
-    
     # 第三步：将翻译结果写回PPTX
     print("开始将翻译结果写回PPTX...")
-    
-    # 添加调试信息
-    print(f"调试信息：")
-    print(f"  - 原始文本数量: {len(all_texts)}")
-    print(f"  - 翻译结果数量: {len(translated_texts)}")
-    print(f"  - 前5个原始文本: {all_texts[:5]}")
-    print(f"  - 前5个翻译结果: {translated_texts[:5]}")
-    
-    # 统计翻译结果
-    translated_count = 0
-    untranslated_count = 0
-    
-    for i, item in enumerate(text_items):
-        if i < len(translated_texts):
-            translated_text = translated_texts[i]
-            original_text = item['text']
-            
-            # 添加详细的调试日志
-            if i < 5:  # 只显示前5个的详细信息
-                print(f"调试 - 项目 {i}:")
-                print(f"  原始文本: '{original_text}'")
-                print(f"  翻译结果: '{translated_text}'")
-                print(f"  类型: {type(translated_text)}")
-                print(f"  是否相等: {translated_text == original_text}")
-            
-            # 检查翻译结果的有效性
-            if translated_text is None or not isinstance(translated_text, str):
-                print(f"警告: 文本 '{original_text[:50]}...' 的翻译结果无效，使用原文")
-                translated_text = original_text
-            elif translated_text.strip() == "":
-                print(f"警告: 文本 '{original_text[:50]}...' 的翻译结果为空，使用原文")
-                translated_text = original_text
-            else:
-                translated_text = _normalize_text(translated_text)
-            
-            # 检查是否真的被翻译了（不是原文）
-            if translated_text != original_text:
-                translated_count += 1
-                if i < 5:  # 只显示前5个的详细信息
-                    print(f"  ✅ 翻译成功: '{original_text[:30]}...' -> '{translated_text[:30]}...'")
-            else:
-                untranslated_count += 1
-                if i < 5:  # 只显示前5个的详细信息
-                    print(f"  ❌ 翻译失败或未变化: '{original_text[:30]}...'")
-            
-            # 确保translated_text是有效的字符串
-            if not isinstance(translated_text, str):
-                translated_text = str(translated_text) if translated_text is not None else original_text
-            
-            if item['type'] == 'shape':
-                paragraph = item.get('paragraph') or prs.slides[item['slide_idx']].shapes[item['shape_idx']].text_frame.paragraphs[item['para_idx']]
-                # 尽量保留样式：保留第一个 run，写入译文，清空其余 run 文本
-                if paragraph.runs:
-                    paragraph.runs[0].text = translated_text
-                    # 其余 run 清空文本但不移除，保留样式
-                    for r in paragraph.runs[1:]:
-                        r.text = ""
-                else:
-                    paragraph.add_run().text = translated_text
-                
-            elif item['type'] == 'table':
-                paragraph = item.get('paragraph')
-                if paragraph is None:
-                    slide = prs.slides[item['slide_idx']]
-                    shape = slide.shapes[item['shape_idx']]
-                    cell = shape.table.rows[item['row_idx']].cells[item['col_idx']]
-                    paragraph = cell.text_frame.paragraphs[item['para_idx']]
-                if paragraph.runs:
-                    paragraph.runs[0].text = translated_text
-                    for r in paragraph.runs[1:]:
-                        r.text = ""
-                else:
-                    paragraph.add_run().text = translated_text
-                
-            elif item['type'] == 'notes':
-                paragraph = item.get('paragraph') or prs.slides[item['slide_idx']].notes_slide.notes_text_frame.paragraphs[item['para_idx']]
-                if paragraph.runs:
-                    paragraph.runs[0].text = translated_text
-                    for r in paragraph.runs[1:]:
-                        r.text = ""
-                else:
-                    paragraph.add_run().text = translated_text
-    
+    for item in text_items:
+        original_text = item['text']
+        translated_text = _normalize_text(translations.get(original_text, original_text))
+
+        if item['type'] == 'shape':
+            paragraph = item.get('paragraph') or prs.slides[item['slide_idx']].shapes[item['shape_idx']].text_frame.paragraphs[item['para_idx']]
+        elif item['type'] == 'table':
+            paragraph = item.get('paragraph')
+            if paragraph is None:
+                slide = prs.slides[item['slide_idx']]
+                shape = slide.shapes[item['shape_idx']]
+                cell = shape.table.rows[item['row_idx']].cells[item['col_idx']]
+                paragraph = cell.text_frame.paragraphs[item['para_idx']]
+        else:
+            paragraph = item.get('paragraph') or prs.slides[item['slide_idx']].notes_slide.notes_text_frame.paragraphs[item['para_idx']]
+
+        # 尽量保留样式：保留第一个 run，写入译文，清空其余 run 文本
+        if paragraph.runs:
+            paragraph.runs[0].text = translated_text
+            # 其余 run 清空文本但不移除，保留样式
+            for r in paragraph.runs[1:]:
+                r.text = ""
+        else:
+            paragraph.add_run().text = translated_text
+
     # Save the translated presentation
     print("保存翻译后的PPTX...")
     prs.save(output_path)
-    
+
     # 输出详细的翻译统计
+    meta = pipe.result(translated_file_path=output_path)
+    total = meta["total_texts"] or 1
+    meta["untranslated_texts"] = meta["total_texts"] - meta["translated_texts"]
+    meta["translation_rate"] = meta["translated_texts"] / total * 100
     print(f"✅ PPTX翻译完成！输出文件: {output_path}")
     print(f"📊 详细统计信息:")
-    print(f"   - 总文本数: {len(text_items)}")
-    print(f"   - 已翻译数: {translated_count}")
-    print(f"   - 未翻译数: {untranslated_count}")
-    print(f"   - 翻译完成率: {(translated_count/len(text_items)*100):.1f}%")
-    print(f"   - 消耗 {total_token_count} tokens")
-    print(f"   - 处理 {total_character_count} 字符")
-    
-    # Return metadata
-    return {
-        "translated_file_path": output_path,
-        "token_count": total_token_count,
-        "character_count": total_character_count,
-        "total_texts": len(text_items),
-        "translated_texts": translated_count,
-        "untranslated_texts": untranslated_count,
-        "translation_rate": (translated_count/len(text_items)*100)
-    }
+    print(f"   - 总文本数: {meta['total_texts']}")
+    print(f"   - 已翻译数: {meta['translated_texts']}")
+    print(f"   - 未翻译数: {meta['untranslated_texts']}")
+    print(f"   - 翻译完成率: {meta['translation_rate']:.1f}%")
+    print(f"   - 消耗 {meta['token_count']} tokens")
+    print(f"   - 处理 {meta['character_count']} 字符")
+    return meta
 
 def main():
     if len(sys.argv) < 5:
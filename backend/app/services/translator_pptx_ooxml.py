@@ -1,16 +1,14 @@
+import shutil
 import zipfile
+import tempfile
 from io import BytesIO
 from typing import Dict, List, Tuple
 from lxml import etree as ET
 
-from app.services.utils_translator import translate_batch
-from app.services.terminology_service import (
-    get_terminology_options,
-    preprocess_texts,
-    preprocess_texts_with_categories,
-    postprocess_texts,
-)
-from app.database import SessionLocal
+from app.services.segment_pipeline import SegmentPipeline
+from app.services.ooxml_stream import DRAWING_RULE, should_stream, scan_part, rewrite_part
+from app.services.ooxml_zip import copy_unchanged, new_member_info
+from app.services.ooxml_parallel import should_parallelize, scan_parts, render_parts
 
 
 NS = {
@@ -47,6 +45,12 @@ def _apply_slide_text(tree: ET._ElementTree, translations: Dict[str, str]):
             t.text = translations[t.text]
 
 
+# 部件类型 -> (collect, apply)，串行与进程池路径共用
+PART_HANDLERS = {
+    'slide': (_collect_slide_text, _apply_slide_text),
+}
+
+
 def translate_pptx_ooxml(input_path: str, output_path: str, src_lang: str, tgt_lang: str, engine: str = 'deepseek', user_id: int | None = None, category_ids=None, **kwargs):
     with zipfile.ZipFile(input_path, 'r') as zin:
         names = zin.namelist()
@@ -54,75 +58,66 @@ def translate_pptx_ooxml(input_path: str, output_path: str, src_lang: str, tgt_l
         notes_names = [n for n in names if n.startswith('ppt/notesSlides/notesSlide') and n.endswith('.xml')]
 
         trees: Dict[str, ET._ElementTree] = {}
-        all_texts: List[str] = []
+        stream_parts = set()
+        part_texts: Dict[str, List[str]] = {}
 
+        tree_jobs = []
         for n in slide_names + notes_names:
-            texts, tree = _collect_slide_text(zin.read(n))
-            if tree is not None:
-                trees[n] = tree
-            all_texts.extend(texts)
-
-        unique = list(dict.fromkeys([t for t in all_texts if isinstance(t, str) and t.strip()]))
-
-        translations: Dict[str, str] = {}
-        if unique:
-            db = SessionLocal()
-            try:
-                options = get_terminology_options(db)
-                case_sensitive = bool(options.get('case_sensitive', False))
-                if options.get('terminology_enabled', True):
-                    if category_ids:
-                        processed, mappings = preprocess_texts_with_categories(db, unique, src_lang, tgt_lang, category_ids, case_sensitive=case_sensitive, user_id=user_id)
+            if should_stream(zin.getinfo(n)):
+                # 超大部件：流式抽取，写出时流式改写
+                stream_parts.add(n)
+                part_texts[n] = [v for v in (_normalize(t) for t in scan_part(zin, n, DRAWING_RULE)) if v.strip()]
+            else:
+                tree_jobs.append((n, 'slide'))
+
+        # 幻灯片多且大时在进程池中解析（只回传片段表），否则串行解析并保留树
+        pooled = scan_parts(input_path, __name__, tree_jobs) if should_parallelize(zin, tree_jobs) else None
+        if pooled is not None:
+            part_texts.update(pooled)
+        else:
+            for n, _kind in tree_jobs:
+                texts, tree = _collect_slide_text(zin.read(n))
+                if tree is not None:
+                    trees[n] = tree
+                part_texts[n] = texts
+
+        # 过滤、去重、术语、调度与统计由 SegmentPipeline 统一处理
+        # 术语：选择了分类则按分类，否则应用全部公共 + 用户术语（PPTX 原有行为）
+        with SegmentPipeline(src_lang, tgt_lang, engine, user_id=user_id, category_ids=category_ids,
+                             term_scope="selected_or_all", **kwargs) as pipe:
+            for n in slide_names + notes_names:
+                pipe.add_part(n, part_texts.get(n, []))
+            translations: Dict[str, str] = {s: _normalize(d) for s, d in pipe.finish().items()}
+
+        with tempfile.TemporaryDirectory(prefix='pptx_parts_') as tmp_dir:
+            rendered: Dict[str, str] = {}
+            if pooled is not None:
+                # 子进程只接收本部件片段的译文补丁，序列化到临时文件
+                patches = {n: {t: translations[t] for t in part_texts.get(n, []) if t in translations} for n, _ in tree_jobs}
+                rendered = render_parts(input_path, __name__, tree_jobs, patches, tmp_dir)
+                if rendered is None:
+                    rendered = {}
+                    for n, _kind in tree_jobs:
+                        _texts, tree = _collect_slide_text(zin.read(n))
+                        if tree is not None:
+                            trees[n] = tree
+
+            for n, tree in trees.items():
+                _apply_slide_text(tree, translations)
+
+            with zipfile.ZipFile(output_path, 'w') as zout:
+                for info in zin.infolist():
+                    name = info.filename
+                    if name in stream_parts:
+                        rewrite_part(zin, info, zout, DRAWING_RULE, lambda s: translations.get(_normalize(s)))
+                    elif name in rendered:
+                        with open(rendered[name], 'rb') as src, zout.open(new_member_info(info), 'w') as dst:
+                            shutil.copyfileobj(src, dst, 1 << 20)
+                    elif name in trees:
+                        with zout.open(new_member_info(info), 'w') as dst:
+                            trees[name].write(dst, encoding='utf-8', xml_declaration=True)
                     else:
-                        processed, mappings = preprocess_texts(db, unique, src_lang, tgt_lang, case_sensitive=case_sensitive, user_id=user_id)
-                else:
-                    processed, mappings = unique, [{} for _ in unique]
-
-                translated, _tok = translate_batch(processed, src_lang, tgt_lang, engine=engine, **kwargs)
-                try:
-                    total_token_count = int(_tok or 0)
-                except Exception:
-                    total_token_count = 0
-                if options.get('terminology_enabled', True):
-                    translated = postprocess_texts(translated, mappings)
-                for s, d in zip(unique, translated):
-                    safe = d if isinstance(d, str) and d.strip() else s
-                    translations[s] = _normalize(safe)
-            finally:
-                try:
-                    db.close()
-                except Exception:
-                    pass
-
-        for n, tree in trees.items():
-            _apply_slide_text(tree, translations)
-
-        with zipfile.ZipFile(output_path, 'w') as zout:
-            for info in zin.infolist():
-                name = info.filename
-                if name in trees:
-                    bio = BytesIO()
-                    trees[name].write(bio, encoding='utf-8', xml_declaration=True)
-                    zout.writestr(info, bio.getvalue())
-                else:
-                    zout.writestr(info, zin.read(name))
-
-    # 统计字符数（粗略）
-    total_chars = 0
-    try:
-        total_chars = sum(len(t) for t in unique)
-    except Exception:
-        total_chars = 0
-    # 简要统计：文本条目数量（去重后作为估计）
-    try:
-        total_texts = len(unique)
-    except Exception:
-        total_texts = None
-    return {
-        'translated_file_path': output_path,
-        'token_count': total_token_count,
-        'character_count': total_chars,
-        'total_texts': total_texts,
-    }
-
+                        # 未改动的成员按原始压缩字节拷贝
+                        copy_unchanged(zin, info, zout)
 
+    return pipe.result(translated_file_path=output_path)
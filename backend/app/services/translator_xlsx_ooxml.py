@@ -1,16 +1,18 @@
+import shutil
 import zipfile
+import tempfile
 from io import BytesIO
 from typing import List, Tuple, Dict
 from lxml import etree as ET
 
-from app.services.utils_translator import translate_batch
-from app.services.terminology_service import (
-    get_terminology_options,
-    preprocess_texts,
-    preprocess_texts_with_categories,
-    postprocess_texts,
+from app.services.segment_store import SegmentStore
+from app.services.segment_pipeline import SegmentPipeline
+from app.services.ooxml_stream import (
+    DRAWING_RULE, XLSX_COMMENT_RULE, XLSX_INLINE_RULE, XLSX_SHARED_RULE,
+    StreamRule, should_stream, scan_part, rewrite_part,
 )
-from app.database import SessionLocal
+from app.services.ooxml_zip import copy_unchanged, new_member_info
+from app.services.ooxml_parallel import should_parallelize, scan_parts, render_parts
 
 
 NS_SS = {
@@ -170,185 +172,168 @@ def _apply_chart_texts(tree: ET._ElementTree, translations: Dict[str, str]):
         if t.text and t.text in translations:
             t.text = translations[t.text]
 
-def translate_xlsx_ooxml(input_path: str, output_path: str, src_lang: str, tgt_lang: str, engine: str = 'deepseek', user_id: int | None = None, category_ids=None):
+def _collect_shared_part(xml_bytes: bytes):
+    texts, _positions, tree = _collect_shared_strings(xml_bytes)
+    return texts, tree
+
+
+def _apply_shared_part(tree: ET._ElementTree, translations: Dict[str, str]):
+    # sharedStrings 需要区分 t/r，简单地同时登记两个 key 供匹配
+    shared = {}
+    for src, dst in translations.items():
+        shared[(src, 't')] = dst
+        shared[(src, 'r')] = dst
+    _apply_shared_strings(tree, shared)
+
+
+def _collect_sheet_part(xml_bytes: bytes):
+    texts, trees = _collect_sheet_inline(xml_bytes)
+    return texts, (trees[0] if trees else None)
+
+
+# 部件类型 -> (collect(bytes) -> (texts, tree), apply(tree, translations))，串行与进程池路径共用
+PART_HANDLERS = {
+    'shared': (_collect_shared_part, _apply_shared_part),
+    'sheet': (_collect_sheet_part, _apply_sheet_inline),
+    'drawing': (_collect_drawing_text, _apply_drawing_text),
+    'comment': (_collect_comments, _apply_comments),
+    'chart': (_collect_chart_texts, _apply_chart_texts),
+}
+
+def _lang_label(code: str) -> str:
+    return {'zh': 'Chinese', 'ja': 'Japanese', 'ko': 'Korean'}.get(code, code)
+
+
+def _detect_lang_code(s: str) -> str:
+    if not isinstance(s, str) or not s:
+        return ''
+    total = len(s)
+    if total == 0:
+        return ''
+    # 统计主要文字块占比
+    han = sum(1 for ch in s if '\u4e00' <= ch <= '\u9fff')
+    hira = sum(1 for ch in s if '\u3040' <= ch <= '\u309f')
+    kata = sum(1 for ch in s if '\u30a0' <= ch <= '\u30ff')
+    hangul = sum(1 for ch in s if '\uac00' <= ch <= '\ud7af')
+    jp = hira + kata
+    # 粗略判断
+    if hangul / max(total, 1) > 0.2:
+        return 'ko'
+    if jp / max(total, 1) > 0.2:
+        return 'ja'
+    if han / max(total, 1) > 0.2:
+        return 'zh'
+    return ''
+
+
+def _language_repair(tgt_lang: str):
+    """语言后验校验：若输出语言与目标语言不符，则对不合格条目进行二次强制翻译"""
+    def repair(processed, translated, translate):
+        need_fix_indexes = [i for i, txt in enumerate(translated) if _detect_lang_code(txt) not in ('', tgt_lang)]
+        if not need_fix_indexes:
+            return translated
+        strong_msg = f"Translate strictly into {_lang_label(tgt_lang)} (language code {tgt_lang}). Do NOT output any other language."
+        fixed = translate([processed[i] for i in need_fix_indexes], style_instruction=strong_msg)
+        translated = list(translated)
+        for idx, val in zip(need_fix_indexes, fixed):
+            translated[idx] = val
+        return translated
+    return repair
+
+
+STREAM_RULES = {
+    'shared': XLSX_SHARED_RULE,
+    'sheet': XLSX_INLINE_RULE,
+    'drawing': DRAWING_RULE,
+    'comment': XLSX_COMMENT_RULE,
+    'chart': DRAWING_RULE,
+}
+
+
+def translate_xlsx_ooxml(input_path: str, output_path: str, src_lang: str, tgt_lang: str, engine: str = 'deepseek', user_id: int | None = None, category_ids=None, segment_store: SegmentStore | None = None, **kwargs):
+    """OOXML 级翻译 XLSX。译文随取随存入 segment_store（任务级），
+    回退路径可复用已取得的译文而无需再次调用引擎。"""
+    store = segment_store if segment_store is not None else SegmentStore()
     # 读取 zip
     with zipfile.ZipFile(input_path, 'r') as zin:
         namelist = zin.namelist()
+        # 待处理部件（顺序决定片段顺序）：sharedStrings、工作表、绘图、批注、图表
         shared_xml_name = 'xl/sharedStrings.xml'
-        shared_bytes = zin.read(shared_xml_name) if shared_xml_name in namelist else b''
-        shared_texts, shared_positions, shared_tree = _collect_shared_strings(shared_bytes)
-
-        sheet_names = [n for n in namelist if n.startswith('xl/worksheets/sheet') and n.endswith('.xml')]
-        sheet_trees: Dict[str, ET._ElementTree] = {}
-        sheet_texts_all: List[str] = []
-        for sname in sheet_names:
-            texts, trees = _collect_sheet_inline(zin.read(sname))
-            sheet_texts_all.extend(texts)
-            if trees:
-                sheet_trees[sname] = trees[0]
-
-        drawing_names = [n for n in namelist if n.startswith('xl/drawings/') and n.endswith('.xml')]
-        drawing_trees: Dict[str, ET._ElementTree] = {}
-        drawing_texts_all: List[str] = []
-        for dname in drawing_names:
-            texts, tree = _collect_drawing_text(zin.read(dname))
-            drawing_texts_all.extend(texts)
-            if tree is not None:
-                drawing_trees[dname] = tree
-
-        # comments
-        comment_names = [n for n in namelist if n.startswith('xl/comments') and n.endswith('.xml')]
-        comment_trees: Dict[str, ET._ElementTree] = {}
-        comment_texts_all: List[str] = []
-        for cname in comment_names:
-            texts, tree = _collect_comments(zin.read(cname))
-            comment_texts_all.extend(texts)
-            if tree is not None:
-                comment_trees[cname] = tree
-
-        # charts
-        chart_names = [n for n in namelist if n.startswith('xl/charts/') and n.endswith('.xml')]
-        chart_trees: Dict[str, ET._ElementTree] = {}
-        chart_texts_all: List[str] = []
-        for chname in chart_names:
-            texts, tree = _collect_chart_texts(zin.read(chname))
-            chart_texts_all.extend(texts)
-            if tree is not None:
-                chart_trees[chname] = tree
-
-        # 汇总所有文本去重
-        all_texts = []
-        for arr in (shared_texts, sheet_texts_all, drawing_texts_all, comment_texts_all, chart_texts_all):
-            all_texts.extend(arr)
-        unique_texts = list(dict.fromkeys([t for t in all_texts if isinstance(t, str) and t.strip()]))
-
-        translations_map_str: Dict[str, str] = {}
-        translations_map_shared: Dict[Tuple[str, str], str] = {}
-        if unique_texts:
-            db = SessionLocal()
-            try:
-                options = get_terminology_options(db)
-                case_sensitive = bool(options.get('case_sensitive', False))
-                if options.get('terminology_enabled', True):
-                    if category_ids:
-                        processed, mappings = preprocess_texts_with_categories(db, unique_texts, src_lang, tgt_lang, category_ids, case_sensitive=case_sensitive, user_id=user_id)
+        parts: List[Tuple[str, str]] = []
+        if shared_xml_name in namelist:
+            parts.append((shared_xml_name, 'shared'))
+        parts += [(n, 'sheet') for n in namelist if n.startswith('xl/worksheets/sheet') and n.endswith('.xml')]
+        parts += [(n, 'drawing') for n in namelist if n.startswith('xl/drawings/') and n.endswith('.xml')]
+        parts += [(n, 'comment') for n in namelist if n.startswith('xl/comments') and n.endswith('.xml')]
+        parts += [(n, 'chart') for n in namelist if n.startswith('xl/charts/') and n.endswith('.xml')]
+
+        part_texts: Dict[str, List[str]] = {}
+        # 超大部件走流式抽取/改写（不保留 DOM）：部件名 -> 规则
+        stream_parts: Dict[str, StreamRule] = {}
+        tree_jobs: List[Tuple[str, str]] = []
+        for name, kind in parts:
+            if should_stream(zin.getinfo(name)):
+                stream_parts[name] = STREAM_RULES[kind]
+                part_texts[name] = scan_part(zin, name, STREAM_RULES[kind])
+            else:
+                tree_jobs.append((name, kind))
+
+        # 整树部件：部件多且大时在进程池中解析（只回传片段表），否则串行解析并保留树
+        part_trees: Dict[str, ET._ElementTree] = {}
+        pooled = scan_parts(input_path, __name__, tree_jobs) if should_parallelize(zin, tree_jobs) else None
+        if pooled is not None:
+            part_texts.update(pooled)
+        else:
+            for name, kind in tree_jobs:
+                texts, tree = PART_HANDLERS[kind][0](zin.read(name))
+                part_texts[name] = texts
+                if tree is not None:
+                    part_trees[name] = tree
+
+        # 过滤、去重、术语、调度与统计由 SegmentPipeline 统一处理；存储中已有译文的片段不再提交引擎，
+        # 译文随批次完成立即登记到任务级存储，后续步骤失败时回退路径可直接复用
+        # 术语：选择了分类则按分类，否则应用全部公共 + 用户术语（XLSX 原有行为）
+        with SegmentPipeline(src_lang, tgt_lang, engine, user_id=user_id, category_ids=category_ids,
+                             term_scope="selected_or_all", repair=_language_repair(tgt_lang), store=store,
+                             **kwargs) as pipe:
+            for name, _ in parts:
+                pipe.add_part(name, part_texts.get(name, []))
+            translations_map_str: Dict[str, str] = pipe.finish()
+
+        # 应用替换并写出新的 xlsx（流式部件边解析边写；进程池部件由子进程序列化到临时文件）
+        with tempfile.TemporaryDirectory(prefix='xlsx_parts_') as tmp_dir:
+            rendered: Dict[str, str] = {}
+            if pooled is not None:
+                patches = {
+                    name: {t: translations_map_str[t] for t in part_texts.get(name, []) if t in translations_map_str}
+                    for name, _ in tree_jobs
+                }
+                rendered = render_parts(input_path, __name__, tree_jobs, patches, tmp_dir)
+                if rendered is None:
+                    # 进程池不可用：串行重新解析
+                    rendered = {}
+                    for name, kind in tree_jobs:
+                        _texts, tree = PART_HANDLERS[kind][0](zin.read(name))
+                        if tree is not None:
+                            part_trees[name] = tree
+            kinds = dict(tree_jobs)
+            for name, tree in part_trees.items():
+                PART_HANDLERS[kinds[name]][1](tree, translations_map_str)
+
+            with zipfile.ZipFile(output_path, 'w') as zout:
+                for item in zin.infolist():
+                    name = item.filename
+                    if name in stream_parts:
+                        rewrite_part(zin, item, zout, stream_parts[name], translations_map_str.get)
+                    elif name in rendered:
+                        with open(rendered[name], 'rb') as src, zout.open(new_member_info(item), 'w') as dst:
+                            shutil.copyfileobj(src, dst, 1 << 20)
+                    elif name in part_trees:
+                        # 直接序列化到输出条目，不经过中间缓冲
+                        with zout.open(new_member_info(item), 'w') as dst:
+                            part_trees[name].write(dst, encoding='utf-8', xml_declaration=True)
                     else:
-                        processed, mappings = preprocess_texts(db, unique_texts, src_lang, tgt_lang, case_sensitive=case_sensitive, user_id=user_id)
-                else:
-                    processed, mappings = unique_texts, [{} for _ in unique_texts]
-
-                # 翻译
-                translated, _tokens = translate_batch(processed, src_lang, tgt_lang, engine=engine)
-                try:
-                    total_token_count += int(_tokens or 0)
-                except Exception:
-                    pass
-                
-                # 语言后验校验：若输出语言与目标语言不符，则对不合格条目进行二次强制翻译
-                def _lang_label(code: str) -> str:
-                    return {'zh': 'Chinese', 'ja': 'Japanese', 'ko': 'Korean'}.get(code, code)
-                
-                def _detect_lang_code(s: str) -> str:
-                    if not isinstance(s, str) or not s:
-                        return ''
-                    total = len(s)
-                    if total == 0:
-                        return ''
-                    # 统计主要文字块占比
-                    han = sum(1 for ch in s if '\u4e00' <= ch <= '\u9fff')
-                    hira = sum(1 for ch in s if '\u3040' <= ch <= '\u309f')
-                    kata = sum(1 for ch in s if '\u30a0' <= ch <= '\u30ff')
-                    hangul = sum(1 for ch in s if '\uac00' <= ch <= '\ud7af')
-                    jp = hira + kata
-                    # 粗略判断
-                    if hangul / max(total, 1) > 0.2:
-                        return 'ko'
-                    if jp / max(total, 1) > 0.2:
-                        return 'ja'
-                    if han / max(total, 1) > 0.2:
-                        return 'zh'
-                    return ''
-                
-                need_fix_indexes = [i for i, txt in enumerate(translated) if _detect_lang_code(txt) not in ('', tgt_lang)]
-                if need_fix_indexes:
-                    strong_msg = f"Translate strictly into {_lang_label(tgt_lang)} (language code {tgt_lang}). Do NOT output any other language."
-                    subset = [processed[i] for i in need_fix_indexes]
-                    fixed, _ = translate_batch(subset, src_lang, tgt_lang, engine=engine, style_instruction=strong_msg)
-                    for idx, val in zip(need_fix_indexes, fixed):
-                        translated[idx] = val
-                if options.get('terminology_enabled', True):
-                    translated = postprocess_texts(translated, mappings)
-
-                for src, dst in zip(unique_texts, translated):
-                    # 保底：空串或None回退原文，避免清空
-                    safe = dst if isinstance(dst, str) and dst.strip() else src
-                    translations_map_str[src] = safe
-                    # sharedStrings 需要区分 t/r，简单地同时登记两个 key 供匹配
-                    translations_map_shared[(src, 't')] = safe
-                    translations_map_shared[(src, 'r')] = safe
-            finally:
-                try:
-                    db.close()
-                except Exception:
-                    pass
-
-        # 应用替换
-        if shared_tree is not None:
-            _apply_shared_strings(shared_tree, translations_map_shared)
-        for sname, tree in sheet_trees.items():
-            _apply_sheet_inline(tree, translations_map_str)
-        for dname, tree in drawing_trees.items():
-            _apply_drawing_text(tree, translations_map_str)
-        for cname, tree in comment_trees.items():
-            _apply_comments(tree, translations_map_str)
-        for chname, tree in chart_trees.items():
-            _apply_chart_texts(tree, translations_map_str)
-
-        # 写出新的 xlsx
-        with zipfile.ZipFile(output_path, 'w') as zout:
-            for item in zin.infolist():
-                name = item.filename
-                if name == shared_xml_name and shared_tree is not None:
-                    bio = BytesIO()
-                    shared_tree.write(bio, encoding='utf-8', xml_declaration=True)
-                    zout.writestr(item, bio.getvalue())
-                elif name in sheet_trees:
-                    bio = BytesIO()
-                    sheet_trees[name].write(bio, encoding='utf-8', xml_declaration=True)
-                    zout.writestr(item, bio.getvalue())
-                elif name in drawing_trees:
-                    bio = BytesIO()
-                    drawing_trees[name].write(bio, encoding='utf-8', xml_declaration=True)
-                    zout.writestr(item, bio.getvalue())
-                elif name in comment_trees:
-                    bio = BytesIO()
-                    comment_trees[name].write(bio, encoding='utf-8', xml_declaration=True)
-                    zout.writestr(item, bio.getvalue())
-                elif name in chart_trees:
-                    bio = BytesIO()
-                    chart_trees[name].write(bio, encoding='utf-8', xml_declaration=True)
-                    zout.writestr(item, bio.getvalue())
-                else:
-                    zout.writestr(item, zin.read(name))
-
-    # 返回简要元数据（可扩展 tokens 统计）
-    total_chars = 0
-    try:
-        # 粗略按去重前的文本集合估算字符数
-        all_texts_len = sum(len(t) for t in shared_texts) + sum(len(t) for t in sheet_texts_all) + sum(len(t) for t in drawing_texts_all)
-        total_chars = int(all_texts_len)
-    except Exception:
-        total_chars = 0
-    # 粗略统计：文本条目数量（去重后作为估计）
-    try:
-        total_texts = len(unique_texts)
-    except Exception:
-        total_texts = None
-    return {
-        'translated_file_path': output_path,
-        'token_count': total_token_count,
-        'character_count': total_chars,
-        'total_texts': total_texts,
-    }
-
+                        # 未改动的成员按原始压缩字节拷贝
+                        copy_unchanged(zin, item, zout)
 
+    return pipe.result(translated_file_path=output_path)
@@ -8,11 +8,15 @@ import time
 import logging
 import requests
 from abc import ABC, abstractmethod
-from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import List, Dict, Any, Optional
 
 # 导入引擎配置管理器
 from .engine_config import EngineConfig
+from .http_transport import http_post
+from .async_engine import AsyncEngineMixin
+from .rate_limiter import acquire_for_engine, settle_for_engine
+from .batch_packer import pack_for_engine
+from .concurrency_controller import report_response, get_controller
 
 # --- 配置日志 ---
 logging.basicConfig(level=logging.INFO)
@@ -21,8 +25,8 @@ logger = logging.getLogger(__name__)
 # --- 配置加载 ---
 # load_dotenv() # 移除，改为直接从环境变量加载
 
-class TranslationEngine(ABC):
-    """AI翻译引擎抽象基类"""
+class TranslationEngine(AsyncEngineMixin, ABC):
+    """AI翻译引擎抽象基类（同步接口 + translate_batch_async 异步孪生接口）"""
     
     def __init__(self, api_key: str, api_url: str, **kwargs):
         self.api_key = api_key
@@ -53,32 +57,42 @@ class TranslationEngine(ABC):
         if not texts:
             return texts, 0
         
-        # 分批处理
-        if len(texts) > self.batch_size:
-            batch_size = self.batch_size
-            logger.info(f"[{self.__class__.__name__}] Large batch detected ({len(texts)} texts), processing in batches of {batch_size}")
+        # 按条数上限 + token 预算装箱分批（batch_packer），结果按下标回填
+        batches = self._pack_batches(texts)
+        if len(batches) > 1:
+            logger.info(f"[{self.__class__.__name__}] Large batch detected ({len(texts)} texts), packed into {len(batches)} batches")
             
-            all_results = []
+            results = [None] * len(texts)
             total_tokens = 0
             
-            for i in range(0, len(texts), batch_size):
-                batch_texts = texts[i:i + batch_size]
-                logger.info(f"[{self.__class__.__name__}] Processing batch {i//batch_size + 1}/{(len(texts) + batch_size - 1)//batch_size}: {len(batch_texts)} texts")
-                
+            def _one(batch):
+                n, idxs = batch
+                batch_texts = [texts[i] for i in idxs]
+                logger.info(f"[{self.__class__.__name__}] Processing batch {n + 1}/{len(batches)}: {len(batch_texts)} texts")
                 try:
-                    batch_results, batch_tokens = self._process_batch(batch_texts, src_lang, tgt_lang)
-                    all_results.extend(batch_results)
-                    total_tokens += batch_tokens
+                    return self._process_batch(batch_texts, src_lang, tgt_lang)
                 except Exception as e:
-                    logger.error(f"[{self.__class__.__name__}] Batch {i//batch_size + 1} failed: {e}")
+                    logger.error(f"[{self.__class__.__name__}] Batch {n + 1} failed: {e}")
                     # 直接返回失败，不使用原文回退
                     logger.error(f"[{self.__class__.__name__}] Translation failed, returning failure")
-                    raise e
+                    raise
+            
+            # 各批次从共享队列中领取，按引擎自适应并发并行请求（不再逐批串行）
+            controller = get_controller(getattr(self, 'engine_key', None) or self.__class__.__name__, initial=self.max_workers)
+            for idxs, (batch_results, batch_tokens) in zip(batches, controller.run_items(_one, list(enumerate(batches)))):
+                for i, r in zip(idxs, batch_results):
+                    results[i] = r
+                total_tokens += batch_tokens
             
-            return all_results, total_tokens
+            # 未回填的下标保持 None（失败），由上层回填原文或补救重发
+            return results, total_tokens
         else:
             return self._process_batch(texts, src_lang, tgt_lang)
     
+    def _pack_batches(self, texts: List[str], max_items: Optional[int] = None) -> List[List[int]]:
+        """按引擎批次预算（EngineConfig.get_batch_limits）与 batch_size 切分，返回每批下标"""
+        return pack_for_engine(getattr(self, 'engine_key', None) or '', texts, max_items=max_items or self.batch_size)
+    
     def _process_batch(self, texts: List[str], src_lang: str, tgt_lang: str) -> tuple:
         """处理单个批次"""
         try:
@@ -117,9 +131,27 @@ class TranslationEngine(ABC):
         """获取请求头"""
         return {"Content-Type": "application/json"}
 
+    def _post(self, url: str, **kwargs):
+        """通过共享 keep-alive 连接池发送 POST 请求（发送前按 RPM/TPM 令牌桶获取额度）"""
+        kwargs.setdefault('timeout', getattr(self, 'timeout', 60))
+        ticket = acquire_for_engine(self, kwargs.get('json') or kwargs.get('data'))
+        engine_key = getattr(self, 'engine_key', None) or self.__class__.__name__
+        started = time.monotonic()
+        try:
+            response = http_post(self.__class__.__name__, url, pool_size=getattr(self, 'max_workers', None), **kwargs)
+        except Exception:
+            report_response(engine_key, None, time.monotonic() - started)
+            raise
+        report_response(engine_key, response.status_code, time.monotonic() - started)
+        settle_for_engine(ticket, response)
+        return response
+
 class DeepSeekTranslator(TranslationEngine):
     """DeepSeek翻译引擎"""
     
+    engine_key = 'deepseek'
+    async_json_api = True
+    
     def __init__(self, **kwargs):
         # 使用EngineConfig获取配置
         cfg = EngineConfig.get_deepseek_config()
@@ -150,7 +182,7 @@ class DeepSeekTranslator(TranslationEngine):
         system_msg = (
             f"You are a professional translation engine. {lang_instruction}\n"
             "Follow these rules:\n"
-            "1. PRESERVE all format markers like [b], [/b], [c:#FF0000], etc.\n"
+            "1. PRESERVE all format markers like [b], [/b], [r1], [/r1], [c:#FF0000], etc.\n"
             "2. Return a single, valid JSON array of strings with the translations in order.\n"
             "3. The JSON array must have exactly the same number of items as the input.\n"
             "4. ALWAYS translate the content to the target language, even if it appears to be already in that language."
@@ -231,7 +263,7 @@ class DeepSeekTranslator(TranslationEngine):
         
         try:
             start_time = time.time()
-            response = requests.post(self.api_url, headers=headers, json=payload, timeout=self.timeout)
+            response = self._post(self.api_url, headers=headers, json=payload)
             response.raise_for_status()
             
             elapsed_time = time.time() - start_time
@@ -246,6 +278,8 @@ class DeepSeekTranslator(TranslationEngine):
 
 class TencentTranslator(TranslationEngine):
     """腾讯原子能力翻译引擎"""
+
+    engine_key = 'tencent'
     
     def __init__(self, **kwargs):
         api_key = kwargs.get('api_key') or os.getenv("TENCENT_API_KEY", "").strip()
@@ -294,7 +328,7 @@ class TencentTranslator(TranslationEngine):
         
         try:
             start_time = time.time()
-            response = requests.post(self.api_url, headers=headers, json=payload, timeout=self.timeout)
+            response = self._post(self.api_url, headers=headers, json=payload)
             response.raise_for_status()
             
             elapsed_time = time.time() - start_time
@@ -311,6 +345,9 @@ class TencentTranslator(TranslationEngine):
 class KimiTranslator(TranslationEngine):
     """Kimi API翻译引擎"""
     
+    engine_key = 'kimi'
+    async_json_api = True
+    
     def __init__(self, **kwargs):
         api_key = kwargs.get('api_key') or os.getenv("KIMI_API_KEY", "").strip()
         api_url = kwargs.get('api_url') or os.getenv("KIMI_API_URL", "https://api.moonshot.cn/v1/chat/completions")
@@ -325,6 +362,7 @@ class KimiTranslator(TranslationEngine):
         """构造Kimi API请求负载"""
         system_msg = (
             f"You are a professional translation engine. Translate the following texts from {src_lang} to {tgt_lang}.\n"
+            "PRESERVE all format markers like [r1], [/r1] and keep the text they wrap inside them.\n"
             "Return ONLY a valid JSON array of strings with the translations in order.\n"
             "Example: [\"translation1\", \"translation2\", ...]"
         )
@@ -379,7 +417,7 @@ class KimiTranslator(TranslationEngine):
         
         try:
             start_time = time.time()
-            response = requests.post(self.api_url, headers=headers, json=payload, timeout=self.timeout)
+            response = self._post(self.api_url, headers=headers, json=payload)
             response.raise_for_status()
             
             elapsed_time = time.time() - start_time
@@ -438,7 +476,9 @@ class TranslationEngineFactory:
             raise ValueError(f"Unsupported engine: {engine_name}. Supported engines: {list(cls._engines.keys())}")
         
         engine_class = cls._engines[engine_name]
-        return engine_class(**kwargs)
+        # 按引擎名+配置指纹复用实例，避免每次调用都重建引擎/读取配置
+        from .engine_pool import get_engine
+        return get_engine(engine_name, engine_class, **kwargs)
     
     @classmethod
     def get_available_engines(cls) -> List[str]:
@@ -449,9 +489,16 @@ class TranslationEngineFactory:
 # _translator_instance = DeepSeekTranslator(debug=True) # 移除，改为使用工厂类
 
 def translate_batch(texts, src_lang='auto', tgt_lang='ja', engine='deepseek', debug=False, **options):
-    """模块级批量翻译函数，支持多引擎"""
+    """模块级批量翻译函数，支持多引擎（前置翻译记忆缓存）"""
     logger.info(f"[translate_batch] Starting translation with engine: {engine}")
     logger.info(f"[translate_batch] Texts count: {len(texts)}, src_lang: {src_lang}, tgt_lang: {tgt_lang}")
+    # 翻译记忆作用域/术语版本，仅用于缓存键，不下发给引擎
+    user_id = options.pop('user_id', None)
+    terminology_version = options.pop('terminology_version', None)
+    # 任务级请求统计（EngineMetrics），逐次传给引擎（引擎实例由 engine_pool 共享，不能挂在实例上），不参与缓存键
+    metrics = options.pop('metrics', None)
+    # True 时失败片段以 None 返回（片段级补救），否则回填原文
+    report_failures = bool(options.pop('report_failures', False))
     
     # 根据引擎类型创建对应的翻译器
     try:
@@ -459,37 +506,23 @@ def translate_batch(texts, src_lang='auto', tgt_lang='ja', engine='deepseek', de
         translator = TranslationEngineFactory.create_engine(engine)
         logger.info(f"[translate_batch] Engine created successfully: {type(translator).__name__}")
         
-        # 若引擎支持带 options 的入口，优先走该路径
-        if hasattr(translator, 'translate_batch_with_options'):
-            result = translator.translate_batch_with_options(texts, src_lang, tgt_lang, **options)
-        else:
-            result = translator.translate_batch(texts, src_lang, tgt_lang)
-        logger.info(f"[translate_batch] Translation completed, result type: {type(result)}, result length: {len(result) if isinstance(result, (list, tuple)) else 'N/A'}")
-        
-        # 清理翻译结果：移除可能的额外包装
-        if isinstance(result, (list, tuple)) and len(result) >= 2:
-            translated_texts = result[0]
-            token_count = result[1]
-            
-            if isinstance(translated_texts, list):
-                logger.info(f"[translate_batch] Cleaning translation results...")
-                cleaned_translations = []
-                for trans in translated_texts:
-                    if isinstance(trans, list) and len(trans) == 1:
-                        # 如果翻译结果被包装在列表中，提取出来
-                        cleaned_translations.append(trans[0])
-                        logger.debug(f"[translate_batch] Unwrapped: {trans} -> {trans[0]}")
-                    elif isinstance(trans, str):
-                        # 如果翻译结果是字符串，直接使用
-                        cleaned_translations.append(trans)
-                    else:
-                        # 其他情况，转换为字符串
-                        cleaned_translations.append(str(trans))
-                
-                logger.info(f"[translate_batch] Cleaned {len(cleaned_translations)} translations")
-                return cleaned_translations, token_count
+        def _run(batch_texts):
+            # 若引擎支持带 options 的入口，优先走该路径
+            if hasattr(translator, 'translate_batch_with_options'):
+                result = translator.translate_batch_with_options(batch_texts, src_lang, tgt_lang, **options)
+            elif metrics is not None and getattr(translator, 'supports_metrics', False):
+                result = translator.translate_batch(batch_texts, src_lang, tgt_lang, metrics=metrics)
+            else:
+                result = translator.translate_batch(batch_texts, src_lang, tgt_lang)
+            logger.info(f"[translate_batch] Translation completed, result type: {type(result)}, result length: {len(result) if isinstance(result, (list, tuple)) else 'N/A'}")
+            return _unwrap_result(result)
         
-        return result
+        from .translation_memory import translate_with_memory
+        return translate_with_memory(
+            texts, src_lang, tgt_lang, engine, _run,
+            model=getattr(translator, 'model', None), options=options,
+            user_id=user_id, terminology_version=terminology_version, report_failures=report_failures,
+        )
         
     except Exception as e:
         logger.error(f"[translate_batch] Failed to create engine {engine}: {e}")
@@ -497,6 +530,32 @@ def translate_batch(texts, src_lang='auto', tgt_lang='ja', engine='deepseek', de
         logger.error(f"[translate_batch] Engine {engine} failed, returning failure")
         raise e
 
+def _unwrap_result(result):
+    """清理翻译结果：移除可能的额外包装（[[text]] -> [text]）"""
+    if isinstance(result, (list, tuple)) and len(result) >= 2:
+        translated_texts = result[0]
+        token_count = result[1]
+        
+        if isinstance(translated_texts, list):
+            logger.info(f"[translate_batch] Cleaning translation results...")
+            cleaned_translations = []
+            for trans in translated_texts:
+                if isinstance(trans, list) and len(trans) == 1:
+                    # 如果翻译结果被包装在列表中，提取出来
+                    cleaned_translations.append(trans[0])
+                    logger.debug(f"[translate_batch] Unwrapped: {trans} -> {trans[0]}")
+                elif isinstance(trans, str) or trans is None:
+                    # 字符串直接使用；None 表示该片段翻译失败，保留给上层判断
+                    cleaned_translations.append(trans)
+                else:
+                    # 其他情况，转换为字符串
+                    cleaned_translations.append(str(trans))
+            
+            logger.info(f"[translate_batch] Cleaned {len(cleaned_translations)} translations")
+            return cleaned_translations, token_count
+    
+    return result
+
 # --- 简化测试函数 ---
 def simple_translate(text, src_lang='auto', tgt_lang='ja'):
     """简化的翻译函数，用于测试"""
@@ -531,7 +590,7 @@ def simple_translate(text, src_lang='auto', tgt_lang='ja'):
         start_time = time.time()
         logger.info("Sending request to DeepSeek API...")
         
-        response = requests.post(api_url, headers=headers, json=payload, timeout=30)
+        response = http_post('simple_translate', api_url, headers=headers, json=payload, timeout=30)
         response.raise_for_status()
         
         elapsed_time = time.time() - start_time
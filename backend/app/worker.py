@@ -6,8 +6,13 @@ from .services.translator_text import translate_text_direct
 from .services.translator_ooxml_direct import translate_docx_inplace
 from .services.translator_xlsx_direct import translate_xlsx_direct
 from .services.translator_pptx_direct import translate_pptx_direct
+from .services.settings_snapshot import get_settings
 from .database import get_db
 from . import crud, models
+from .services.task_lease import (
+    BUSY, CLAIMED, LeaseHeartbeat, TaskLeaseBusy, TASK_LEASE_SECONDS,
+    claim_task, make_worker_id, release_task,
+)
 
 def process_translation_task(
     task_id: str,
@@ -21,155 +26,171 @@ def process_translation_task(
     style_instruction: str | None = None,
     style_preset: str | None = None,
 ):
-    """处理翻译任务的后台函数"""
-    db = next(get_db())
-    
+    """处理翻译任务的后台函数（先认领任务租约，保证同一任务只执行一次）"""
+    worker_id = make_worker_id("doc")
+    claim = claim_task(task_id, worker_id)
+    if claim == BUSY:
+        raise TaskLeaseBusy(task_id)
+    if claim != CLAIMED:
+        print(f"翻译任务 {task_id} 跳过执行: {claim}")
+        return
     try:
-        # 读取任务以获取 user_id
-        task = crud.get_translation_task(db, task_id)
-        task_user_id = task.user_id if task else None
-        # 更新任务状态为处理中
-        crud.update_translation_task(db, task_id, {"status": "processing", "progress": 10})
+        with LeaseHeartbeat(task_id, worker_id) as heartbeat:
+            db = next(get_db())
+            try:
+                # 读取任务以获取 user_id
+                task = crud.get_translation_task(db, task_id)
+                task_user_id = task.user_id if task else None
+                # 认领时已置为处理中
+                crud.update_translation_task(db, task_id, {"progress": 10})
         
-        # 根据策略与扩展名执行实际翻译
-        os.makedirs("downloads", exist_ok=True)
+                # 根据策略与扩展名执行实际翻译
+                os.makedirs("downloads", exist_ok=True)
 
-        ext = os.path.splitext(file_path)[1].lower()
+                ext = os.path.splitext(file_path)[1].lower()
 
-        # 进度推进
-        for progress in [20, 40]:
-            time.sleep(0.5)
-            crud.update_translation_task(db, task_id, {"progress": progress})
+                # 进度推进
+                for progress in [20, 40]:
+                    time.sleep(0.5)
+                    crud.update_translation_task(db, task_id, {"progress": progress})
 
-        start_ts = time.time()
-        meta = {}
-        if strategy == "text_direct" or ext in [".txt", ".md"]:
-            meta = translate_text_direct(file_path, output_path, source_lang, target_lang, engine=engine, user_id=task_user_id, category_ids=category_ids) or {}
-        elif strategy == "ooxml_direct" and ext == ".docx":
-            # 读取并发设置
-            db_settings = { s.key: s for s in db.query(models.SystemSetting).filter(models.SystemSetting.category=="ooxml").all() }
-            workers = 5
-            try:
-                if db_settings.get("docx_parallel_workers") and str(db_settings["docx_parallel_workers"].value).isdigit():
-                    workers = int(db_settings["docx_parallel_workers"].value)
-            except Exception:
-                pass
-            meta = translate_docx_inplace(
-                file_path, output_path, source_lang, target_lang,
-                engine=engine, workers=workers, debug=False,
-                user_id=task_user_id, category_ids=category_ids,
-                style_instruction=style_instruction, style_preset=style_preset
-            ) or {}
-        elif strategy == "ooxml_direct" and ext == ".xlsx":
-            # 允许通过设置控制是否启用 OOXML 模式（当前实现默认走 OOXML，回退 openpyxl）
-            meta = translate_xlsx_direct(
-                file_path, output_path, source_lang, target_lang,
-                engine=engine, user_id=task_user_id, category_ids=category_ids,
-                style_instruction=style_instruction, style_preset=style_preset
-            ) or {}
-        elif strategy == "ooxml_direct" and ext == ".pptx":
-            meta = translate_pptx_direct(
-                file_path, output_path, source_lang, target_lang,
-                engine=engine, user_id=task_user_id, category_ids=category_ids,
-                style_instruction=style_instruction, style_preset=style_preset
-            ) or {}
-        else:
-            # 未实现的类型，先直接复制
-            import shutil
-            shutil.copy2(file_path, output_path)
-        # 计算耗时
-        duration = max(0.0, time.time() - start_ts)
-        # 目标文件大小
-        target_size = None
-        try:
-            if os.path.exists(output_path):
-                target_size = os.path.getsize(output_path)
-        except Exception:
-            pass
+                start_ts = time.time()
+                meta = {}
+                if strategy == "text_direct" or ext in [".txt", ".md"]:
+                    meta = translate_text_direct(file_path, output_path, source_lang, target_lang, engine=engine, user_id=task_user_id, category_ids=category_ids) or {}
+                elif strategy == "ooxml_direct" and ext == ".docx":
+                    # 读取并发设置（系统设置快照）
+                    workers = get_settings(db).get_int("docx_parallel_workers", 5)
+                    meta = translate_docx_inplace(
+                        file_path, output_path, source_lang, target_lang,
+                        engine=engine, workers=workers, debug=False,
+                        user_id=task_user_id, category_ids=category_ids,
+                        style_instruction=style_instruction, style_preset=style_preset
+                    ) or {}
+                elif strategy == "ooxml_direct" and ext == ".xlsx":
+                    # 允许通过设置控制是否启用 OOXML 模式（当前实现默认走 OOXML，回退 openpyxl）
+                    meta = translate_xlsx_direct(
+                        file_path, output_path, source_lang, target_lang,
+                        engine=engine, user_id=task_user_id, category_ids=category_ids,
+                        style_instruction=style_instruction, style_preset=style_preset
+                    ) or {}
+                elif strategy == "ooxml_direct" and ext == ".pptx":
+                    meta = translate_pptx_direct(
+                        file_path, output_path, source_lang, target_lang,
+                        engine=engine, user_id=task_user_id, category_ids=category_ids,
+                        style_instruction=style_instruction, style_preset=style_preset
+                    ) or {}
+                else:
+                    # 未实现的类型，先直接复制
+                    import shutil
+                    shutil.copy2(file_path, output_path)
+                # 计算耗时
+                duration = max(0.0, time.time() - start_ts)
+                # 目标文件大小
+                target_size = None
+                try:
+                    if os.path.exists(output_path):
+                        target_size = os.path.getsize(output_path)
+                except Exception:
+                    pass
 
-        # 完成
-        crud.update_translation_task(db, task_id, {
-            "status": "completed",
-            "progress": 100,
-            "result_path": output_path,
-            "target_file_size": target_size,
-            "character_count": meta.get("character_count"),
-            "token_count": meta.get("token_count"),
-            "duration": duration,
-        })
-        # 记录通用统计：写入 error_message(JSON)
-        try:
-            extra_common = {}
-            if isinstance(meta, dict):
-                if meta.get("total_texts") is not None:
-                    extra_common["total_texts"] = int(meta.get("total_texts"))
-                if meta.get("translated_texts") is not None:
-                    extra_common["translated_texts"] = int(meta.get("translated_texts"))
-            if extra_common:
-                import json as _json
-                task = crud.get_translation_task(db, task_id)
-                prev = {}
+                if heartbeat.lost:
+                    # 租约已被其他执行者接管，由对方写入最终状态
+                    print(f"翻译任务 {task_id} 租约已丢失，放弃写入结果")
+                    return
+
+                # 完成
+                crud.update_translation_task(db, task_id, {
+                    "status": "completed",
+                    "progress": 100,
+                    "result_path": output_path,
+                    "target_file_size": target_size,
+                    "character_count": meta.get("character_count"),
+                    "token_count": meta.get("token_count"),
+                    "duration": duration,
+                })
+                # 记录通用统计：写入 error_message(JSON)
                 try:
-                    if task and task.error_message and task.error_message.strip().startswith('{'):
-                        prev = _json.loads(task.error_message)
+                    extra_common = {}
+                    if isinstance(meta, dict):
+                        if meta.get("total_texts") is not None:
+                            extra_common["total_texts"] = int(meta.get("total_texts"))
+                        if meta.get("translated_texts") is not None:
+                            extra_common["translated_texts"] = int(meta.get("translated_texts"))
+                        # 重试预算耗尽、保留原文的片段（死信）
+                        if meta.get("dead_letter_count"):
+                            extra_common["dead_letter_count"] = int(meta.get("dead_letter_count"))
+                            extra_common["dead_letters"] = meta.get("dead_letters") or []
+                    if extra_common:
+                        import json as _json
+                        task = crud.get_translation_task(db, task_id)
+                        prev = {}
+                        try:
+                            if task and task.error_message and task.error_message.strip().startswith('{'):
+                                prev = _json.loads(task.error_message)
+                        except Exception:
+                            prev = {}
+                        prev.update(extra_common)
+                        crud.update_translation_task(db, task_id, {"error_message": _json.dumps(prev, ensure_ascii=False)})
+                        # 控制台输出
+                        print(f"[Engine:{engine}] 文档文本统计: total_texts={extra_common.get('total_texts')} translated_texts={extra_common.get('translated_texts')} chars={meta.get('character_count')}")
                 except Exception:
-                    prev = {}
-                prev.update(extra_common)
-                crud.update_translation_task(db, task_id, {"error_message": _json.dumps(prev, ensure_ascii=False)})
-                # 控制台输出
-                print(f"[Engine:{engine}] 文档文本统计: total_texts={extra_common.get('total_texts')} translated_texts={extra_common.get('translated_texts')} chars={meta.get('character_count')}")
-        except Exception:
-            pass
+                    pass
 
-        # 附加：汇总统计/风格参数并附加到任务记录的 error_message(JSON)
-        try:
-            import json as _json
-            task = crud.get_translation_task(db, task_id)
-            prev = {}
-            try:
-                if task and task.error_message and task.error_message.strip().startswith('{'):
-                    prev = _json.loads(task.error_message)
-            except Exception:
-                prev = {}
-            # qwen3 统计
-            if str(engine).lower() == 'qwen3':
-                from .services.multi_engine_translator import qwen3_get_metrics
-                m = qwen3_get_metrics()
-                stats = {"qwen3_total": m.get('total'), "qwen3_success": m.get('success'), "qwen3_429": m.get('429')}
-                if isinstance(meta, dict):
-                    if meta.get("total_texts") is not None:
-                        stats["total_texts"] = int(meta.get("total_texts"))
-                    if meta.get("translated_texts") is not None:
-                        stats["translated_texts"] = int(meta.get("translated_texts"))
-                prev.update(stats)
-                print(f"[Qwen3] 文档翻译统计: total={stats.get('qwen3_total')} success={stats.get('qwen3_success')} 429={stats.get('qwen3_429')} texts={stats.get('total_texts')} translated={stats.get('translated_texts')}")
-            # 附加风格参数
-            try:
-                if style_preset or style_instruction:
-                    ep = prev.get('engine_params', {})
-                    if style_preset:
-                        ep['style_preset'] = style_preset
-                    if style_instruction:
-                        ep['style_instruction'] = style_instruction[:300]
-                    prev['engine_params'] = ep
-            except Exception:
-                pass
-            crud.update_translation_task(db, task_id, {"error_message": _json.dumps(prev, ensure_ascii=False)})
-        except Exception:
-            pass
+                # 附加：汇总统计/风格参数并附加到任务记录的 error_message(JSON)
+                try:
+                    import json as _json
+                    task = crud.get_translation_task(db, task_id)
+                    prev = {}
+                    try:
+                        if task and task.error_message and task.error_message.strip().startswith('{'):
+                            prev = _json.loads(task.error_message)
+                    except Exception:
+                        prev = {}
+                    # qwen3 统计
+                    if str(engine).lower() == 'qwen3':
+                        # 任务级请求统计（由本任务的 SegmentPipeline 收集，不再读取进程级全局计数）
+                        m = (meta.get("engine_metrics") if isinstance(meta, dict) else None) or {}
+                        stats = {"qwen3_total": m.get('total'), "qwen3_success": m.get('success'), "qwen3_429": m.get('429')}
+                        if isinstance(meta, dict):
+                            if meta.get("total_texts") is not None:
+                                stats["total_texts"] = int(meta.get("total_texts"))
+                            if meta.get("translated_texts") is not None:
+                                stats["translated_texts"] = int(meta.get("translated_texts"))
+                        prev.update(stats)
+                        print(f"[Qwen3] 文档翻译统计: total={stats.get('qwen3_total')} success={stats.get('qwen3_success')} 429={stats.get('qwen3_429')} texts={stats.get('total_texts')} translated={stats.get('translated_texts')}")
+                    # 附加风格参数
+                    try:
+                        if style_preset or style_instruction:
+                            ep = prev.get('engine_params', {})
+                            if style_preset:
+                                ep['style_preset'] = style_preset
+                            if style_instruction:
+                                ep['style_instruction'] = style_instruction[:300]
+                            prev['engine_params'] = ep
+                    except Exception:
+                        pass
+                    crud.update_translation_task(db, task_id, {"error_message": _json.dumps(prev, ensure_ascii=False)})
+                except Exception:
+                    pass
         
-        print(f"翻译任务 {task_id} 完成")
+                print(f"翻译任务 {task_id} 完成")
         
-    except Exception as e:
-        # 更新任务状态为失败
-        crud.update_translation_task(db, task_id, {
-            "status": "failed",
-            "error_message": str(e)
-        })
-        print(f"翻译任务 {task_id} 失败: {e}")
+            except Exception as e:
+                # 更新任务状态为失败
+                crud.update_translation_task(db, task_id, {
+                    "status": "failed",
+                    "error_message": str(e)
+                })
+                print(f"翻译任务 {task_id} 失败: {e}")
         
+            finally:
+                db.close()
     finally:
-        db.close()
+        try:
+            release_task(task_id, worker_id)
+        except Exception:
+            pass
 
 # Celery配置（如果需要的话）
 from celery import Celery
@@ -191,8 +212,24 @@ celery_app.conf.update(
     result_serializer="json",
     timezone="UTC",
     enable_utc=True,
+    # 执行完成后再确认消息：worker 崩溃时消息被重新投递，由任务租约决定能否接管
+    task_acks_late=os.getenv("CELERY_TASK_ACKS_LATE", "false").strip().lower() in ("1", "true", "yes", "on"),
+    worker_prefetch_multiplier=int(os.getenv("CELERY_WORKER_PREFETCH_MULTIPLIER", "4")),
 )
 
+
+def dispatch_task(celery_task, background_tasks, fallback, task_id: str, kwargs: Dict[str, Any]) -> str:
+    """派发任务到 Celery；broker 不可达时才交给 FastAPI BackgroundTasks 在本进程执行。
+    返回 "celery" 或 "inproc"。"""
+    try:
+        # retry=False：broker 不可达时立即抛错，而不是阻塞重试
+        celery_task.apply_async(kwargs=kwargs, task_id=task_id, retry=False)
+        return "celery"
+    except Exception as e:
+        print(f"任务 {task_id} 派发到 Celery 失败，改为本进程执行: {e}")
+        background_tasks.add_task(fallback, **kwargs)
+        return "inproc"
+
 @celery_app.on_after_configure.connect
 def setup_periodic_tasks(sender, **kwargs):
     # 每天 03:00 运行清理任务
@@ -256,8 +293,9 @@ def cleanup_old_histories():
     finally:
         db.close()
 
-@celery_app.task
+@celery_app.task(bind=True, max_retries=10)
 def translate_document_task(
+    self,
     task_id: str,
     file_path: str,
     output_path: str,
@@ -269,19 +307,22 @@ def translate_document_task(
     style_instruction: str | None = None,
     style_preset: str | None = None,
 ):
-    """Celery任务：翻译文档"""
-    return process_translation_task(
-        task_id=task_id,
-        file_path=file_path,
-        output_path=output_path,
-        source_lang=source_lang,
-        target_lang=target_lang,
-        engine=engine,
-        strategy=strategy,
-        category_ids=category_ids,
-        style_instruction=style_instruction,
-        style_preset=style_preset,
-    )
+    """Celery任务：翻译文档（任务正被其他执行者持有时，等租约到期后重试以便接管）"""
+    try:
+        return process_translation_task(
+            task_id=task_id,
+            file_path=file_path,
+            output_path=output_path,
+            source_lang=source_lang,
+            target_lang=target_lang,
+            engine=engine,
+            strategy=strategy,
+            category_ids=category_ids,
+            style_instruction=style_instruction,
+            style_preset=style_preset,
+        )
+    except TaskLeaseBusy as e:
+        raise self.retry(exc=e, countdown=TASK_LEASE_SECONDS)
 
 def run_batch_translation_task(
     task_id: str,
@@ -293,80 +334,96 @@ def run_batch_translation_task(
     style_instruction: Optional[str] = None,
     style_preset: Optional[str] = None,
 ):
-    """纯函数：执行批量翻译任务（供 Celery 与后台线程共用）。"""
-    # 更新任务状态为处理中
+    """纯函数：执行批量翻译任务（供 Celery 与后台线程共用）。先认领任务租约，保证只执行一次。"""
+    worker_id = make_worker_id("batch")
+    claim = claim_task(task_id, worker_id)
+    if claim == BUSY:
+        raise TaskLeaseBusy(task_id)
+    if claim != CLAIMED:
+        print(f"Batch translation task {task_id} skipped: {claim}")
+        return
     from .database import get_db
     from . import crud
-    db = next(get_db())
     try:
-        crud.update_translation_task(db, task_id, {"status": "processing"})
+        with LeaseHeartbeat(task_id, worker_id) as heartbeat:
+            db = next(get_db())
+            try:
 
-        file_ext = os.path.splitext(file_path)[1].lower()
+                file_ext = os.path.splitext(file_path)[1].lower()
 
-        if file_ext == '.docx':
-            result = translate_docx_batch_api(
-                file_path, output_path, source_lang, target_lang,
-                category_ids, style_instruction, style_preset
-            )
-        elif file_ext == '.pptx':
-            result = translate_pptx_batch_api(
-                file_path, output_path, source_lang, target_lang,
-                category_ids, style_instruction, style_preset
-            )
-        elif file_ext == '.xlsx':
-            result = translate_xlsx_batch_api(
-                file_path, output_path, source_lang, target_lang,
-                category_ids, style_instruction, style_preset
-            )
-        elif file_ext in ['.txt', '.md']:
-            result = translate_text_batch_api(
-                file_path, output_path, source_lang, target_lang,
-                category_ids, style_instruction, style_preset
-            )
-        else:
-            raise ValueError(f"Unsupported file type: {file_ext}")
+                if file_ext == '.docx':
+                    result = translate_docx_batch_api(
+                        file_path, output_path, source_lang, target_lang,
+                        category_ids, style_instruction, style_preset
+                    )
+                elif file_ext == '.pptx':
+                    result = translate_pptx_batch_api(
+                        file_path, output_path, source_lang, target_lang,
+                        category_ids, style_instruction, style_preset
+                    )
+                elif file_ext == '.xlsx':
+                    result = translate_xlsx_batch_api(
+                        file_path, output_path, source_lang, target_lang,
+                        category_ids, style_instruction, style_preset
+                    )
+                elif file_ext in ['.txt', '.md']:
+                    result = translate_text_batch_api(
+                        file_path, output_path, source_lang, target_lang,
+                        category_ids, style_instruction, style_preset
+                    )
+                else:
+                    raise ValueError(f"Unsupported file type: {file_ext}")
 
-        crud.update_translation_task(db, task_id, {
-            "status": "completed",
-            "token_count": result.get('token_count', 0),
-            "character_count": result.get('character_count', 0),
-            "target_file_size": os.path.getsize(output_path) if os.path.exists(output_path) else None,
-            "duration": result.get('duration', 0)
-        })
-        try:
-            # 记录语言到 error_message 便于追踪
-            task = crud.get_translation_task(db, task_id)
-            import json as _json
-            info = {}
-            try:
-                if task and task.error_message and task.error_message.strip().startswith('{'):
-                    info = _json.loads(task.error_message)
-            except Exception:
-                info = {}
-            info.update({"src_lang": source_lang, "tgt_lang": target_lang})
-            crud.update_translation_task(db, task_id, {"error_message": _json.dumps(info, ensure_ascii=False)})
-        except Exception:
-            pass
-        print(f"Batch translation task {task_id} completed successfully")
-    except Exception as e:
-        print(f"Batch translation task {task_id} failed: {str(e)}")
-        try:
-            crud.update_translation_task(db, task_id, {
-                "status": "failed",
-                "error_message": str(e)
-            })
-        except Exception:
-            pass
-        raise
+                if heartbeat.lost:
+                    print(f"Batch translation task {task_id} lost its lease, result not recorded")
+                    return
+                crud.update_translation_task(db, task_id, {
+                    "status": "completed",
+                    "token_count": result.get('token_count', 0),
+                    "character_count": result.get('character_count', 0),
+                    "target_file_size": os.path.getsize(output_path) if os.path.exists(output_path) else None,
+                    "duration": result.get('duration', 0)
+                })
+                try:
+                    # 记录语言到 error_message 便于追踪
+                    task = crud.get_translation_task(db, task_id)
+                    import json as _json
+                    info = {}
+                    try:
+                        if task and task.error_message and task.error_message.strip().startswith('{'):
+                            info = _json.loads(task.error_message)
+                    except Exception:
+                        info = {}
+                    info.update({"src_lang": source_lang, "tgt_lang": target_lang})
+                    crud.update_translation_task(db, task_id, {"error_message": _json.dumps(info, ensure_ascii=False)})
+                except Exception:
+                    pass
+                print(f"Batch translation task {task_id} completed successfully")
+            except Exception as e:
+                print(f"Batch translation task {task_id} failed: {str(e)}")
+                try:
+                    crud.update_translation_task(db, task_id, {
+                        "status": "failed",
+                        "error_message": str(e)
+                    })
+                except Exception:
+                    pass
+                raise
+            finally:
+                try:
+                    db.close()
+                except Exception:
+                    pass
     finally:
         try:
-            db.close()
+            release_task(task_id, worker_id)
         except Exception:
             pass
 
 
-@celery_app.task
+@celery_app.task(bind=True, max_retries=10)
 def process_batch_translation_task(
+    self,
     task_id: str,
     file_path: str,
     output_path: str,
@@ -376,16 +433,19 @@ def process_batch_translation_task(
     style_instruction: Optional[str] = None,
     style_preset: Optional[str] = None,
 ):
-    return run_batch_translation_task(
-        task_id=task_id,
-        file_path=file_path,
-        output_path=output_path,
-        source_lang=source_lang,
-        target_lang=target_lang,
-        category_ids=category_ids,
-        style_instruction=style_instruction,
-        style_preset=style_preset,
-    )
+    try:
+        return run_batch_translation_task(
+            task_id=task_id,
+            file_path=file_path,
+            output_path=output_path,
+            source_lang=source_lang,
+            target_lang=target_lang,
+            category_ids=category_ids,
+            style_instruction=style_instruction,
+            style_preset=style_preset,
+        )
+    except TaskLeaseBusy as e:
+        raise self.retry(exc=e, countdown=TASK_LEASE_SECONDS)
 
 def translate_docx_batch_api(
     file_path: str,
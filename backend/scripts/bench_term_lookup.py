@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""术语加载/检索基准：旧的 func.lower(...).in_() 整行查询 vs 规范化列 + 覆盖索引
+
+在临时 SQLite 库中生成术语表（默认 10 万条，多语言对、多用户、多分类），比较：
+- 任务加载术语：旧实现（ORM 整行、lower() 使索引失效）vs crud.get_term_pairs（index-only）
+- 前缀检索：source_text LIKE 扫描 vs crud.search_terms（source_key 索引区间）
+并打印 SQLite 的查询计划，确认走的是 COVERING INDEX。
+
+用法（在 backend 目录下）：
+    python scripts/bench_term_lookup.py --terms 100000
+"""
+import argparse
+import os
+import random
+import string
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, func, or_, text  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+
+from app import crud, models  # noqa: E402
+
+LANG_PAIRS = [("en", "zh"), ("zh", "en"), ("en", "ja"), ("ja", "zh"), ("en", "ko"), ("ko", "en"), ("de", "en"), ("fr", "en")]
+# 模拟历史数据中大小写/别名不统一的语言代码
+LANG_VARIANTS = {"zh": ["zh", "zh-CN", "ZH"], "en": ["en", "EN", "en-US"], "ja": ["ja", "JA"], "ko": ["ko"], "de": ["de"], "fr": ["fr"]}
+
+
+def _word(rng, lo=3, hi=10):
+    return "".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(lo, hi)))
+
+
+def populate(db, n_terms, n_users, n_categories, seed):
+    rng = random.Random(seed)
+    users = [models.User(username=f"bench{i}", email=f"bench{i}@example.com", password="x") for i in range(n_users)]
+    db.add_all(users)
+    db.flush()
+    cats = [models.TermCategory(name=f"cat{i}", owner_type="public") for i in range(n_categories)]
+    db.add_all(cats)
+    db.commit()
+    user_ids = [None] * 3 + [u.id for u in users]
+    cat_ids = [None] + [c.id for c in cats]
+    batch = []
+    for i in range(n_terms):
+        src_lang, tgt_lang = rng.choice(LANG_PAIRS)
+        src = " ".join(_word(rng) for _ in range(rng.randint(1, 3)))
+        tgt = src.upper()
+        sl, tl = rng.choice(LANG_VARIANTS[src_lang]), rng.choice(LANG_VARIANTS[tgt_lang])
+        batch.append({
+            "source_text": src, "target_text": tgt, "source_lang": sl, "target_lang": tl,
+            "user_id": rng.choice(user_ids), "category_id": rng.choice(cat_ids),
+            "is_approved": True, "is_active": True,
+            **crud.term_norm_fields(src, tgt, sl, tl),
+        })
+        if len(batch) >= 5000:
+            db.bulk_insert_mappings(models.Terminology, batch)
+            db.commit()
+            batch = []
+    if batch:
+        db.bulk_insert_mappings(models.Terminology, batch)
+        db.commit()
+    db.execute(text("ANALYZE"))
+    return user_ids[3], cat_ids[1:3]
+
+
+def legacy_lookup(db, src_lang, tgt_lang, user_id):
+    """旧实现：lower() 包裹列 + 别名 IN，取完整 ORM 对象"""
+    aliases = {"zh": ["zh", "zh-cn", "中文", "chinese", "cn"], "en": ["en", "en-us", "英文", "english"]}
+    T = models.Terminology
+    return db.query(T).filter(
+        T.is_approved == True,  # noqa: E712
+        func.lower(T.target_lang).in_(aliases.get(tgt_lang, [tgt_lang])),
+        func.lower(T.source_lang).in_(aliases.get(src_lang, [src_lang])),
+        or_(T.user_id.is_(None), T.user_id == user_id),
+    ).all()
+
+
+def timed(fn, repeat):
+    best, result = None, None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def explain(db, query):
+    compiled = query.statement.compile(db.get_bind(), compile_kwargs={"literal_binds": True})
+    return "; ".join(row[-1] for row in db.execute(text(f"EXPLAIN QUERY PLAN {compiled}")))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark terminology loading and search")
+    parser.add_argument("--terms", type=int, default=100000, help="number of terms to generate")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--categories", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=5, help="report the best of N runs")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--db", default=None, help="SQLite file to use (default: a temporary file)")
+    args = parser.parse_args()
+
+    path = args.db or os.path.join(tempfile.mkdtemp(prefix="term-bench-"), "terms.db")
+    engine = create_engine(f"sqlite:///{path}")
+    models.Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    try:
+        t0 = time.perf_counter()
+        if not db.query(models.Terminology.id).first():
+            uid, cats = populate(db, args.terms, args.users, args.categories, args.seed)
+        else:
+            uid, cats = db.query(models.User.id).order_by(models.User.id).first()[0], [1, 2]
+        total = db.query(func.count(models.Terminology.id)).scalar()
+        print(f"[Bench] {total} terms in {path} (setup {time.perf_counter() - t0:.1f}s)")
+
+        legacy_t, legacy_rows = timed(lambda: legacy_lookup(db, "en", "zh", uid), args.repeat)
+        new_t, new_rows = timed(lambda: crud.get_term_pairs(db, "en", "zh", user_id=uid), args.repeat)
+        same = {(t.source_text, t.target_text) for t in legacy_rows} == {tuple(r) for r in new_rows}
+        print(f"- job term load en->zh: legacy {legacy_t * 1000:.1f}ms, indexed {new_t * 1000:.1f}ms "
+              f"({legacy_t / max(new_t, 1e-9):.1f}x), {len(new_rows)} terms, same result: {same}")
+        cat_t, cat_rows = timed(lambda: crud.get_term_pairs(db, "en", "zh", user_id=uid, category_ids=cats), args.repeat)
+        print(f"- job term load by categories: {cat_t * 1000:.1f}ms, {len(cat_rows)} terms")
+
+        T = models.Terminology
+        plan_q = crud._term_lookup_query(db, (T.source_text, T.target_text), "en", "zh", user_id=uid)
+        print(f"  plan: {explain(db, plan_q)}")
+
+        prefix = legacy_rows[0].source_text[:3] if legacy_rows else "abc"
+        scan_t, scan_rows = timed(lambda: db.query(T).filter(T.source_text.like(f"{prefix}%")).order_by(T.id).limit(50).all(), args.repeat)
+        idx_t, idx_rows = timed(lambda: crud.search_terms(db, prefix, all_owners=True, limit=50), args.repeat)
+        print(f"- prefix search '{prefix}': LIKE scan {scan_t * 1000:.1f}ms, source_key index {idx_t * 1000:.1f}ms, {len(idx_rows)} hits")
+        sub_t, sub_rows = timed(lambda: crud.search_terms(db, prefix, mode="contains", all_owners=True, limit=50), args.repeat)
+        print(f"- contains search '{prefix}': {sub_t * 1000:.1f}ms, {len(sub_rows)} hits (trigram index on PostgreSQL only)")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()